@@ -0,0 +1,35 @@
+"""
+Entry point for the `docext` command.
+
+    docext [app args]             start the gradio app (same as `python -m docext.app.app`)
+    docext worker [worker args]   process jobs from the local job queue
+    docext enqueue [args] files   add documents to the local job queue
+    docext bench [args] files     load-test the core functions, the app or the VLM server
+"""
+from __future__ import annotations
+
+import sys
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == "worker":
+        from docext.core.worker import docext_worker
+
+        docext_worker(sys.argv[2:])
+    elif command == "enqueue":
+        from docext.core.worker import docext_enqueue
+
+        docext_enqueue(sys.argv[2:])
+    elif command == "bench":
+        from docext.bench import docext_bench
+
+        docext_bench(sys.argv[2:])
+    else:
+        from docext.app.app import docext_app
+
+        docext_app()
+
+
+if __name__ == "__main__":
+    main()
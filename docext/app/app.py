@@ -15,6 +15,8 @@ from docext.app.utils import cleanup
 from docext.core.config import TEMPLATES_FIELDS
 from docext.core.config import TEMPLATES_TABLES
 from docext.core.extract import extract_information
+from docext.core.metrics import queued
+from docext.core.metrics import start_metrics_server
 from docext.core.utils import convert_files_to_images
 from docext.core.vllm import VLLMServer
 
@@ -195,11 +197,13 @@ def define_keys_and_extract(model_name: str, max_img_size: int, concurrency_limi
                 headers=["col1", "col2", "coln"],
             )
 
+    # the wrapper limits the concurrency and counts the waiting requests, for the
+    # UI and the API calls alike
     submit_btn.click(
-        extract_information,
+        queued(extract_information, concurrency_limit),
         [images_input, model_name, max_img_size, fields_display],
         [extracted_fields_output, extracted_tables_output],
-        concurrency_limit=concurrency_limit,
+        concurrency_limit=None,
     )
 
 
@@ -275,7 +279,16 @@ def main(
     share: bool,
     dtype: str,
     max_gen_tokens: int,
+    metrics_port: int = 0,
 ):
+    if metrics_port > 0:
+        try:
+            start_metrics_server(metrics_port)
+        except OSError as e:
+            logger.warning(
+                f"Could not start the metrics server on port {metrics_port}: {e}"
+            )
+
     vllm_server = None
     if model_name.startswith("hosted_vllm/") and (
         "localhost" in host or host == "0.0.0.0" or host == "127.0.0.1"
@@ -365,6 +378,7 @@ def docext_app():
         args.share,
         args.dtype,
         args.max_gen_tokens,
+        args.metrics_port,
     )
 
 
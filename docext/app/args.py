@@ -92,4 +92,10 @@ def parse_args():
         default=10000,
         help="Maximum number of tokens to generate for the model.",
     )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        default=0,
+        help="Port for the Prometheus metrics endpoint (http://127.0.0.1:<port>/metrics). Disabled by default (0).",
+    )
     return parser.parse_args()
@@ -10,6 +10,7 @@ from datetime import datetime
 
 import gradio as gr
 
+from docext.core.metrics import queued
 from docext.core.pdf2md.pdf2md import convert_to_markdown_stream
 from docext.core.utils import convert_files_to_images
 
@@ -135,12 +136,13 @@ We’ve open-sourced Nanonets-OCR-s, A model for transforming documents into str
                     error_message = f"❌ **Error processing request {request_id}**: {str(e)}\n\nPlease try again or contact support if the issue persists."
                     yield error_message
 
-            # Enable concurrent request processing by setting concurrency_limit
-            # This allows multiple users to process documents simultaneously
+            # Enable concurrent request processing, `queued` runs concurrency_limit
+            # requests at a time and counts the waiting ones, for the UI and the API
+            # calls alike
             submit_btn.click(
-                process_markdown_streaming,
+                queued(process_markdown_streaming, concurrency_limit),
                 inputs=[images_input],
                 outputs=[formatted_output],
-                concurrency_limit=concurrency_limit,  # Allow multiple concurrent requests
+                concurrency_limit=None,
                 concurrency_id="pdf_to_markdown_conversion",  # Unique ID for this processing pipeline
             )
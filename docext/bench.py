@@ -0,0 +1,495 @@
+"""
+Load generator for the extraction and pdf2md endpoints.
+
+Replays a corpus of documents against one of the targets:
+    core  the `extract_information` / `convert_to_markdown_stream` functions in process
+    app   a running docext app, through its gradio API (`/extract_information`,
+          `/process_markdown_streaming`)
+    vlm   the OpenAI-compatible VLM server directly, with the same prompts docext sends
+
+in closed-loop mode (`--users` concurrent users sending requests back to back) or
+open-loop mode (Poisson arrivals at `--rate` requests per second). Open-loop latencies
+are measured from the scheduled arrival, so client-side queueing is not hidden.
+
+    docext bench --target app --task extract --template "invoice 🧾" --mode closed --users 8 --num_requests 200 assets/
+    docext bench --target vlm --task pdf2md --mode open --rate 2 --duration 120 --output pdf2md_bench.json docs/
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from dataclasses import dataclass
+
+import numpy as np
+from loguru import logger
+
+from docext.core.utils import file_is_supported_image
+
+TARGETS = ["core", "app", "vlm"]
+TASKS = ["extract", "pdf2md"]
+MODES = ["closed", "open"]
+
+
+@dataclass
+class Document:
+    path: str
+    num_pages: int
+    # rasterized pages, the app and vlm targets send images like the UI does
+    page_paths: list[str]
+
+
+@dataclass
+class RequestResult:
+    document: str
+    num_pages: int
+    scheduled: float
+    start: float
+    end: float
+    ttft: float | None = None
+    error: str | None = None
+
+    @property
+    def latency(self):
+        return self.end - self.scheduled
+
+
+def load_corpus(paths: list[str], workdir: str) -> list[Document]:
+    from docext.core.file_converters.pdf_converter import PDFConverter
+
+    file_paths: list[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            file_paths.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+            )
+        else:
+            file_paths.append(path)
+
+    documents = []
+    pdf_converter = PDFConverter()
+    for i, file_path in enumerate(file_paths):
+        if os.path.splitext(file_path)[1].lower() == ".pdf":
+            page_paths = pdf_converter.convert_and_save_images(
+                file_path, os.path.join(workdir, f"doc_{i}")
+            )
+        elif file_is_supported_image(file_path):
+            page_paths = [file_path]
+        else:
+            continue
+        documents.append(Document(file_path, len(page_paths), page_paths))
+    assert len(documents) > 0, f"No pdf or image files found in {paths}"
+    logger.info(
+        f"Loaded {len(documents)} documents with {sum(d.num_pages for d in documents)} pages"
+    )
+    return documents
+
+
+def _copy_to_tmp(file_paths: list[str], workdir: str):
+    # docext resizes the images in place, work on copies like the gradio uploads
+    request_dir = tempfile.mkdtemp(dir=workdir)
+    copies = []
+    for i, file_path in enumerate(file_paths):
+        copy = os.path.join(request_dir, f"{i}_{os.path.basename(file_path)}")
+        shutil.copyfile(file_path, copy)
+        copies.append(copy)
+    return request_dir, copies
+
+
+def make_core_runner(args, fields_and_tables: dict | None, workdir: str):
+    from docext.core.extract import extract_information
+    from docext.core.pdf2md.pdf2md import convert_to_markdown_stream
+
+    def run(document: Document):
+        request_dir, file_paths = _copy_to_tmp([document.path], workdir)
+        try:
+            if args.task == "extract":
+                extract_information(
+                    file_paths, args.model_name, args.max_img_size, fields_and_tables
+                )
+                return None
+            first_token = None
+            for _ in convert_to_markdown_stream(
+                file_paths, args.model_name, args.max_img_size, 1, args.max_gen_tokens
+            ):
+                if first_token is None:
+                    first_token = time.perf_counter()
+            return first_token
+        finally:
+            shutil.rmtree(request_dir, ignore_errors=True)
+
+    return run
+
+
+def make_app_runner(args, fields_and_tables: dict | None):
+    import pandas as pd
+    from gradio_client import Client
+    from gradio_client import handle_file
+
+    local = threading.local()
+    if fields_and_tables is not None:
+        fields_df = pd.DataFrame(
+            fields_and_tables["fields"] + fields_and_tables["tables"]
+        )
+        fields_display = {
+            "headers": fields_df.columns.tolist(),
+            "data": fields_df.values.tolist(),
+            "metadata": None,
+        }
+
+    def run(document: Document):
+        # gradio clients are not thread safe, one per user thread
+        if not hasattr(local, "client"):
+            local.client = Client(
+                args.app_url, auth=(args.username, args.password), verbose=False
+            )
+        images = [{"image": handle_file(path)} for path in document.page_paths]
+        # the endpoints of the submit buttons, the app limits and counts these calls
+        # in its queue depth like the UI ones, see `docext.core.metrics.queued`
+        if args.task == "extract":
+            local.client.predict(
+                file_inputs=images,
+                model_name=args.model_name,
+                max_img_size=args.max_img_size,
+                fields_and_tables=fields_display,
+                api_name="/extract_information",
+            )
+            return None
+        first_token = None
+        job = local.client.submit(images=images, api_name="/process_markdown_streaming")
+        for _ in job:
+            if first_token is None:
+                first_token = time.perf_counter()
+        job.result()
+        return first_token
+
+    return run
+
+
+def make_vlm_runner(args, fields_and_tables: dict | None, workdir: str):
+    from docext.core.pdf2md.pdf2md import get_pdf2md_messages
+    from docext.core.pdf2md.pdf2md import stream_request
+    from docext.core.prompts import get_fields_messages
+    from docext.core.prompts import get_tables_messages
+    from docext.core.utils import resize_images
+
+    def stream(messages: list[dict]):
+        first_token = None
+        for _ in stream_request(
+            messages, args.model_name, max_tokens=args.max_gen_tokens
+        ):
+            if first_token is None:
+                first_token = time.perf_counter()
+        return first_token
+
+    def run(document: Document):
+        request_dir, page_paths = _copy_to_tmp(document.page_paths, workdir)
+        try:
+            resize_images(page_paths, args.max_img_size)
+            if args.task == "pdf2md":
+                first_tokens = [
+                    stream(get_pdf2md_messages(page_path)) for page_path in page_paths
+                ]
+                return first_tokens[0]
+            # fields and tables are requested in parallel, like extract_information
+            assert fields_and_tables is not None, "extract needs a --template"
+            messages_list = []
+            if fields_and_tables["fields"]:
+                messages_list.append(
+                    get_fields_messages(
+                        [field["name"] for field in fields_and_tables["fields"]],
+                        [field["description"] for field in fields_and_tables["fields"]],
+                        page_paths,
+                    )
+                )
+            if fields_and_tables["tables"]:
+                messages_list.append(
+                    get_tables_messages(
+                        [column["name"] for column in fields_and_tables["tables"]],
+                        [
+                            column["description"]
+                            for column in fields_and_tables["tables"]
+                        ],
+                        page_paths,
+                    )
+                )
+            with ThreadPoolExecutor(len(messages_list)) as executor:
+                first_tokens = list(executor.map(stream, messages_list))
+            return min((t for t in first_tokens if t is not None), default=None)
+        finally:
+            shutil.rmtree(request_dir, ignore_errors=True)
+
+    return run
+
+
+def _execute(run: Callable, document: Document, scheduled: float):
+    """
+    Send one request. Runners return the `time.perf_counter()` of the first
+    streamed output, or None if the target does not stream.
+    """
+    start = time.perf_counter()
+    try:
+        first_token = run(document)
+        error = None
+    except Exception as e:
+        first_token = None
+        error = f"{type(e).__name__}: {e}"
+        logger.warning(f"Request for {document.path} failed: {error}")
+    end = time.perf_counter()
+    return RequestResult(
+        document=document.path,
+        num_pages=document.num_pages,
+        scheduled=scheduled,
+        start=start,
+        end=end,
+        ttft=None if first_token is None else first_token - scheduled,
+        error=error,
+    )
+
+
+def run_closed_loop(
+    run: Callable,
+    documents: list[Document],
+    users: int,
+    num_requests: int | None,
+    duration: float | None,
+    rng: random.Random,
+):
+    results: list[RequestResult] = []
+    lock = threading.Lock()
+    sent = 0
+    deadline = None if duration is None else time.perf_counter() + duration
+
+    def user():
+        nonlocal sent
+        while True:
+            with lock:
+                if num_requests is not None and sent >= num_requests:
+                    return
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return
+                sent += 1
+                document = rng.choice(documents)
+            result = _execute(run, document, time.perf_counter())
+            with lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=user, daemon=True) for _ in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def run_open_loop(
+    run: Callable,
+    documents: list[Document],
+    rate: float,
+    num_requests: int | None,
+    duration: float | None,
+    max_in_flight: int,
+    rng: random.Random,
+):
+    # draw the whole arrival schedule upfront, so the load does not depend on
+    # how fast the target answers
+    arrivals: list[tuple[float, Document]] = []
+    t = 0.0
+    while True:
+        t += rng.expovariate(rate)
+        if duration is not None and t > duration:
+            break
+        if num_requests is not None and len(arrivals) >= num_requests:
+            break
+        arrivals.append((t, rng.choice(documents)))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_in_flight) as executor:
+        futures = []
+        for offset, document in arrivals:
+            scheduled = start + offset
+            time.sleep(max(scheduled - time.perf_counter(), 0.0))
+            futures.append(executor.submit(_execute, run, document, scheduled))
+        return [future.result() for future in futures]
+
+
+def _distribution(values: list[float]):
+    if len(values) == 0:
+        return None
+    array = np.asarray(values)
+    return {
+        "mean": float(array.mean()),
+        "p50": float(np.percentile(array, 50)),
+        "p95": float(np.percentile(array, 95)),
+        "p99": float(np.percentile(array, 99)),
+        "max": float(array.max()),
+    }
+
+
+def summarize(results: list[RequestResult]):
+    ok = [result for result in results if result.error is None]
+    if len(results) == 0:
+        return {"requests": 0}
+    wall = max(r.end for r in results) - min(r.scheduled for r in results)
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "error_rate": (len(results) - len(ok)) / len(results),
+        "duration_s": wall,
+        "throughput_rps": len(ok) / wall if wall > 0 else 0.0,
+        "pages_per_s": sum(r.num_pages for r in ok) / wall if wall > 0 else 0.0,
+        "latency_s": _distribution([r.latency for r in ok]),
+        "ttft_s": _distribution([r.ttft for r in ok if r.ttft is not None]),
+    }
+
+
+def parse_args(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        description="DocExt: load-generation benchmark for extraction and pdf2md",
+    )
+    parser.add_argument(
+        "corpus", nargs="+", help="Documents or directories of documents"
+    )
+    parser.add_argument("--target", type=str, default="core", choices=TARGETS)
+    parser.add_argument("--task", type=str, default="extract", choices=TASKS)
+    parser.add_argument(
+        "--template",
+        type=str,
+        default=None,
+        help="Template name from docext.core.config. Required for extract.",
+    )
+    parser.add_argument("--mode", type=str, default="closed", choices=MODES)
+    parser.add_argument(
+        "--users",
+        type=int,
+        default=1,
+        help="Concurrent users in closed-loop mode.",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=1.0,
+        help="Mean arrival rate (requests per second) in open-loop mode.",
+    )
+    parser.add_argument(
+        "--max_in_flight",
+        type=int,
+        default=256,
+        help="Maximum number of outstanding requests in open-loop mode.",
+    )
+    parser.add_argument("--num_requests", type=int, default=None)
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=None,
+        help="Stop sending requests after this many seconds.",
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=1,
+        help="Requests sent before the measurement, eg: to load the model.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--model_name",
+        type=str,
+        default="hosted_vllm/Qwen/Qwen2.5-VL-3B-Instruct-AWQ",
+    )
+    parser.add_argument("--vlm_server_host", type=str, default="127.0.0.1")
+    parser.add_argument("--vlm_server_port", type=int, default=8000)
+    parser.add_argument("--app_url", type=str, default="http://localhost:7860")
+    parser.add_argument("--username", type=str, default="admin")
+    parser.add_argument("--password", type=str, default="admin")
+    parser.add_argument("--max_img_size", type=int, default=2048)
+    parser.add_argument("--max_gen_tokens", type=int, default=10000)
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="bench_report.json",
+        help="Path of the JSON report.",
+    )
+    args = parser.parse_args(argv)
+    if args.num_requests is None and args.duration is None:
+        args.num_requests = 100
+    assert (
+        args.task != "extract" or args.template is not None
+    ), "--template is required for extract"
+    return args
+
+
+def docext_bench(argv: list[str] | None = None):
+    args = parse_args(argv)
+    logger.info(f"Config:\n{args}")
+
+    # same as the gradio app and the workers
+    hosted_model_url = f"http://{args.vlm_server_host}:{args.vlm_server_port}"
+    os.environ["VLM_MODEL_URL"] = (
+        f"{hosted_model_url}/v1"
+        if args.model_name.startswith("hosted_vllm/")
+        else hosted_model_url
+    )
+
+    fields_and_tables = None
+    if args.task == "extract":
+        from docext.core.worker import get_template_fields_and_tables
+
+        fields_and_tables = get_template_fields_and_tables(args.template)
+
+    workdir = tempfile.mkdtemp(prefix="docext_bench_")
+    try:
+        documents = load_corpus(args.corpus, workdir)
+        if args.target == "core":
+            run = make_core_runner(args, fields_and_tables, workdir)
+        elif args.target == "app":
+            run = make_app_runner(args, fields_and_tables)
+        else:
+            run = make_vlm_runner(args, fields_and_tables, workdir)
+
+        rng = random.Random(args.seed)
+        for _ in range(args.warmup):
+            _execute(run, rng.choice(documents), time.perf_counter())
+
+        logger.info(f"Running {args.mode}-loop benchmark against {args.target}")
+        if args.mode == "closed":
+            results = run_closed_loop(
+                run, documents, args.users, args.num_requests, args.duration, rng
+            )
+        else:
+            results = run_open_loop(
+                run,
+                documents,
+                args.rate,
+                args.num_requests,
+                args.duration,
+                args.max_in_flight,
+                rng,
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = summarize(results)
+    report = {
+        "config": vars(args),
+        "summary": summary,
+        "requests": [asdict(result) for result in results],
+    }
+    dirname = os.path.dirname(os.path.abspath(args.output))
+    os.makedirs(dirname, exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    logger.info(f"Summary:\n{json.dumps(summary, indent=2)}")
+    logger.info(f"Report written to {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    docext_bench()
@@ -0,0 +1,201 @@
+"""
+Offline batch files for the benchmark requests.
+
+`--export_batch` writes the uncached requests of every (model, dataset) pair in
+the OpenAI batch format, one request per line with the cache key as `custom_id`:
+
+    {"custom_id": "<cache key>", "method": "POST", "url": "/v1/chat/completions",
+     "body": {"model": "gpt-4o", "messages": [...], "temperature": 0.0}}
+
+The files can be sent to the OpenAI batch API, or run with the offline runner of
+vLLM (`python -m vllm.entrypoints.openai.run_batch -i <file> -o <results>`).
+`--ingest_batch <results> --batch_model <model>` then stores the responses of the
+results file in the prediction cache, and the benchmark (or `--rescore`) scores
+them as if they were sent interactively.
+
+Without a batch service, the requests of a file are sent to any OpenAI-compatible
+server by the stand-in executor of this module:
+
+    python -m docext.benchmark.batch --input <file> --output <results> \\
+        --api_base http://localhost:8000/v1
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from collections.abc import Iterable
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import requests
+from loguru import logger
+from tqdm import tqdm
+
+BATCH_URL = "/v1/chat/completions"
+
+# litellm prefixes of the providers that serve the OpenAI batch format
+_BATCH_PROVIDERS = ["hosted_vllm", "openai"]
+
+
+def batch_model_name(model_name: str) -> str:
+    # the provider prefix is only used by litellm
+    provider, _, name = model_name.partition("/")
+    return name if provider in _BATCH_PROVIDERS and name else model_name
+
+
+def batch_request(
+    custom_id: str,
+    model_name: str,
+    messages: list[dict[str, Any]],
+    model_config: dict[str, Any],
+) -> dict[str, Any]:
+    """
+    One line of a batch file, with the sampling parameters of the interactive
+    requests.
+    """
+    body = {
+        "model": batch_model_name(model_name),
+        "messages": messages,
+        "temperature": model_config.get("temperature", 0.0),
+    }
+    for key in ["max_tokens", "max_completion_tokens"]:
+        if model_config.get(key, None) is not None:
+            body[key] = model_config[key]
+    return {"custom_id": custom_id, "method": "POST", "url": BATCH_URL, "body": body}
+
+
+def write_batch_files(
+    path_prefix: str,
+    lines: Iterable[dict[str, Any]],
+    max_requests: int = 50000,
+    max_bytes: int = 190 * 2**20,
+) -> list[str]:
+    """
+    Write `lines` to `{path_prefix}.jsonl`, split into `{path_prefix}_part{n}.jsonl`
+    files of at most `max_requests` lines and `max_bytes` (the limits of the OpenAI
+    batch API). Returns the paths of the files.
+    """
+    parts: list[list[bytes]] = [[]]
+    size = 0
+    for line in lines:
+        data = (json.dumps(line, ensure_ascii=False) + "\n").encode()
+        if parts[-1] and (
+            len(parts[-1]) >= max_requests or size + len(data) > max_bytes
+        ):
+            parts.append([])
+            size = 0
+        parts[-1].append(data)
+        size += len(data)
+    if not parts[-1]:
+        return []
+
+    paths = []
+    for index, part in enumerate(parts):
+        path = (
+            f"{path_prefix}.jsonl"
+            if len(parts) == 1
+            else f"{path_prefix}_part{index}.jsonl"
+        )
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.writelines(part)
+        os.replace(tmp_path, path)
+        paths.append(path)
+    return paths
+
+
+def read_batch_results(
+    path: str,
+) -> Iterator[tuple[str, dict[str, Any] | None, str | None]]:
+    """
+    Iterate over the `(custom_id, body, error)` of a batch results file, `body` is
+    the chat completion of the successful requests and `error` the reason of the
+    failed ones.
+    """
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if result.get("error") is not None:
+                yield result["custom_id"], None, json.dumps(result["error"])
+            elif response.get("status_code") != 200:
+                yield result["custom_id"], None, (
+                    f"status code {response.get('status_code')}: "
+                    f"{json.dumps(response.get('body'))[:1000]}"
+                )
+            else:
+                yield result["custom_id"], response["body"], None
+
+
+def run_batch_file(
+    input_path: str,
+    output_path: str,
+    api_base: str,
+    api_key: str | None = None,
+    max_workers: int = 8,
+    timeout: float = 600.0,
+):
+    """
+    Stand-in for a batch service: send the requests of `input_path` to the
+    OpenAI-compatible server at `api_base` and write the results file.
+    """
+    with open(input_path) as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    headers = {} if api_key is None else {"Authorization": f"Bearer {api_key}"}
+    url = api_base.rstrip("/") + "/chat/completions"
+
+    def send(index_line: tuple[int, dict[str, Any]]) -> dict[str, Any]:
+        index, line = index_line
+        result = {
+            "id": f"batch_req_{index}",
+            "custom_id": line["custom_id"],
+            "response": None,
+            "error": None,
+        }
+        try:
+            response = requests.post(
+                url, json=line["body"], headers=headers, timeout=timeout
+            )
+        except requests.RequestException as e:
+            result["error"] = {"code": type(e).__name__, "message": str(e)[:1000]}
+            return result
+        try:
+            body = response.json()
+        except ValueError:
+            body = {"error": response.text[:1000]}
+        result["response"] = {
+            "status_code": response.status_code,
+            "request_id": response.headers.get("x-request-id", ""),
+            "body": body,
+        }
+        return result
+
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, open(
+        tmp_path, "w"
+    ) as f:
+        for result in tqdm(
+            executor.map(send, enumerate(lines)), total=len(lines), desc=input_path
+        ):
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, output_path)
+    logger.info(f"Wrote the results of {len(lines)} requests to {output_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Send the requests of a batch file to an OpenAI-compatible server"
+    )
+    parser.add_argument("--input", type=str, required=True)
+    parser.add_argument("--output", type=str, required=True)
+    parser.add_argument("--api_base", type=str, default="http://localhost:8000/v1")
+    parser.add_argument("--api_key", type=str, default=None)
+    parser.add_argument("--max_workers", type=int, default=8)
+    args = parser.parse_args()
+    run_batch_file(
+        args.input, args.output, args.api_base, args.api_key, args.max_workers
+    )
@@ -9,32 +9,80 @@ Author: Souvik Mandal
 """
 from __future__ import annotations
 
+import argparse
 import hashlib
 import json
+import multiprocessing
 import os
+import time
+from collections import Counter
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
 from itertools import repeat
 from typing import Any
+from typing import TypeGuard
 
-import json_repair
 import mdpd
+import numpy as np
 import pandas as pd
 from litellm import completion
+from litellm import completion_cost
+from litellm import stream_chunk_builder
 from loguru import logger
-from tenacity import retry
-from tenacity import stop_after_attempt
-from tenacity import wait_exponential
 from tqdm import tqdm
 
-from docext.benchmark.metrics.classification import get_classification_metrics
-from docext.benchmark.metrics.kie import get_kie_metrics
-from docext.benchmark.metrics.ocr import get_ocr_metrics
-from docext.benchmark.metrics.tables import get_table_metrics
-from docext.benchmark.metrics.vqa import get_vqa__metric_for_multiple_possible_answers
-from docext.benchmark.metrics.vqa import get_vqa_metrics
+from docext.benchmark.batch import batch_request
+from docext.benchmark.batch import read_batch_results
+from docext.benchmark.batch import write_batch_files
+from docext.benchmark.cache import CACHE_BACKENDS
+from docext.benchmark.cache import get_prediction_cache
+from docext.benchmark.cache import model_cache_name
+from docext.benchmark.concurrency import find_saturation
+from docext.benchmark.concurrency import run_level
+from docext.benchmark.concurrency import summarize_level
+from docext.benchmark.concurrency import SWEEP_COLUMNS
+from docext.benchmark.early_stopping import bootstrap_interval
+from docext.benchmark.early_stopping import EarlyStopping
+from docext.benchmark.early_stopping import sample_ratios
+from docext.benchmark.image_store import pack_dataset_images
+from docext.benchmark.metrics.tables import GRITS_MODES
+from docext.benchmark.performance import pareto_table
+from docext.benchmark.performance import PerformanceStats
+from docext.benchmark.performance import response_performance
+from docext.benchmark.resolution import get_resized_image_digest_url
+from docext.benchmark.resolution import get_resized_image_url
+from docext.benchmark.resolution import get_resolutions
+from docext.benchmark.resolution import image_size
+from docext.benchmark.resolution import Resolution
+from docext.benchmark.results import get_results_store
+from docext.benchmark.results import result_key
+from docext.benchmark.retry import classify_error
+from docext.benchmark.retry import failed_response
+from docext.benchmark.retry import INVALID_REQUEST
+from docext.benchmark.retry import RATE_LIMIT
+from docext.benchmark.retry import RetryPolicy
+from docext.benchmark.retry import RetryStats
+from docext.benchmark.scheduler import AsyncScheduler
+from docext.benchmark.scheduler import EXECUTORS
+from docext.benchmark.scheduler import get_provider
+from docext.benchmark.scheduler import Reschedule
+from docext.benchmark.scoring import ChunkedScorer
+from docext.benchmark.scoring import merge_chunks
+from docext.benchmark.scoring import parse_response
+from docext.benchmark.scoring import score_chunk
+from docext.benchmark.scoring import score_responses
+from docext.benchmark.sharding import ClaimDir
+from docext.benchmark.sharding import CLAIMS_DIR
+from docext.benchmark.sharding import get_claim_dir
+from docext.benchmark.sharding import Shard
+from docext.benchmark.sharding import ShardingConfig
 from docext.benchmark.tasks import change_system_prompt
 from docext.benchmark.tasks import get_CLASSIFICATION_messages
 from docext.benchmark.tasks import get_datasets
+from docext.benchmark.tasks import get_image_digest_url
 from docext.benchmark.tasks import get_KIE_messages
 from docext.benchmark.tasks import get_OCR_messages
 from docext.benchmark.tasks import get_TABLE_messages
@@ -43,11 +91,7 @@ from docext.benchmark.tasks import TABLE_DATASETS
 from docext.benchmark.utils import load_yaml
 from docext.benchmark.vlm_datasets.ds import BenchmarkData
 from docext.benchmark.vlm_datasets.ds import BenchmarkDataset
-from docext.benchmark.vlm_datasets.ds import Classification
-from docext.benchmark.vlm_datasets.ds import PredField
-from docext.benchmark.vlm_datasets.ds import Prediction
-from docext.benchmark.vlm_datasets.ds import Table
-from docext.benchmark.vlm_datasets.ds import VQA
+from docext.core.metrics import CACHE_LOOKUPS
 
 
 class NanonetsIDPBenchmark:
@@ -64,6 +108,14 @@ class NanonetsIDPBenchmark:
         for dataset in self.datasets:
             logger.info(f"Dataset {dataset.name} has {len(dataset.data)} samples")
 
+        if self.benchmark_config.get("packed_images", False):
+            # serve the images from one memory-mapped file per dataset
+            for dataset in self.datasets:
+                pack_dataset_images(
+                    dataset.cache_dir,
+                    [path for data in dataset.data for path in data.image_paths],
+                )
+
         # create the models
         self.models = self.benchmark_config["models"]
         self.models = {model: self.benchmark_config[model] for model in self.models}
@@ -82,11 +134,38 @@ class NanonetsIDPBenchmark:
             "cache_dir",
             "./docext_benchmark_cache",
         )
-        self.cache_dir = os.path.join(self.cache_dir, "prediction_cache")
-        os.makedirs(self.cache_dir, exist_ok=True)
+        self.prediction_cache = get_prediction_cache(
+            self.benchmark_config.get("cache_backend", "file"), self.cache_dir
+        )
 
         self.max_workers = self.benchmark_config.get("max_workers", 1)
         self.ignore_cache = self.benchmark_config.get("ignore_cache", False)
+        # also look up responses cached under the old keys (hash of the full
+        # messages, images included) and copy them to the new keys
+        self.legacy_cache_keys = self.benchmark_config.get("legacy_cache_keys", True)
+        self.executor = self.benchmark_config.get("executor", "threads")
+        self.provider_limits = self.benchmark_config.get("provider_limits", None) or {}
+        self.retry_policy = RetryPolicy.from_config(
+            self.benchmark_config.get("retry", None)
+        )
+        self.retry_stats = RetryStats()
+        self.performance_stats = PerformanceStats()
+        self.early_stopping = EarlyStopping.from_config(
+            self.benchmark_config.get("early_stopping", None)
+        )
+        # only run the pairs without an up to date result, see results.py
+        self.incremental = self.benchmark_config.get("incremental", True)
+        self.results_store = get_results_store(self.cache_dir)
+        # used by --shard and --merge, see sharding.py
+        self.sharding = ShardingConfig.from_config(
+            self.benchmark_config.get("sharding", None)
+        )
+        # used by --export_batch, see batch.py
+        self.batch_config = self.benchmark_config.get("batch", None) or {}
+        # parsing and metrics run in `scoring_workers` processes (0: inline), in
+        # chunks of `scoring_chunk_size` samples
+        self.scoring_workers = self.benchmark_config.get("scoring_workers", None)
+        self.scoring_chunk_size = self.benchmark_config.get("scoring_chunk_size", 64)
 
     def _get_datasets(self):
         datasets = get_datasets(
@@ -285,19 +364,638 @@ class NanonetsIDPBenchmark:
         return init_datasets
 
     def run_benchmark(self):
+        # only the pairs without an up to date result in the results store are run
+        result_keys = {
+            (dataset.name, model_name): self._get_result_key(dataset, model_name)
+            for dataset in self.datasets
+            for model_name in self.models
+        }
+        stored = {}
+        if self.incremental and not self.ignore_cache:
+            for pair, key in result_keys.items():
+                if key is None:
+                    continue
+                result = self.results_store.get(*pair, key)
+                if result is not None:
+                    stored[pair] = result
+        pairs = [pair for pair in result_keys if pair not in stored]
+        logger.info(
+            f"{len(stored)} of {len(result_keys)} dataset x model pairs are up to "
+            f"date in the results store, running {len(pairs)}"
+        )
+
+        # the responses are parsed and scored in worker processes while the next
+        # responses are collected
+        self._incomplete_pairs = set()
+        with self._scoring_executor() as executor:
+            if self.early_stopping.enabled:
+                results = self._run_with_early_stopping(executor, pairs)
+            else:
+                results = self._run_all_pairs(executor, pairs)
+
+        for pair in pairs:
+            score, avg_cost = results[pair]
+            if pair in self._incomplete_pairs or result_keys[pair] is None:
+                # failed requests are sent again by the next run
+                continue
+            self.results_store.set(
+                *pair,
+                result_keys[pair],
+                score,
+                avg_cost,
+                num_samples=len(self.performance_stats.records_for(*pair)),
+                performance=self.performance_stats.records_for(*pair),
+            )
+        for pair, result in stored.items():
+            results[pair] = (result["score"], result["cost"])
+            self.performance_stats.add_records(result["performance"])
+
         all_scores = {}
         all_costs = {}
-        for dataset in tqdm(self.datasets):
+        for dataset in self.datasets:
             all_scores[dataset.name] = {}
             all_costs[dataset.name] = {}
             for model_name in self.models:
-                benchmark_scores, avg_cost = self._run_single_model_single_dataset(
-                    dataset,
+                score, avg_cost = results[(dataset.name, model_name)]
+                all_scores[dataset.name][model_name] = score
+                all_costs[dataset.name][model_name] = avg_cost
+        self._write_report(all_scores, all_costs)
+        self._write_performance_report(all_scores, all_costs)
+
+        df_retries = self.retry_stats.to_dataframe()
+        if len(df_retries) > 0:
+            logger.info("RETRIES:\n" + df_retries.to_string(index=False))
+        df_retries.to_csv("retries.csv", index=False)
+        if self.retry_stats.failed_requests:
+            logger.warning(
+                f"{len(self.retry_stats.failed_requests)} requests failed and were "
+                "scored as empty answers, see failed_requests.csv"
+            )
+            pd.DataFrame(self.retry_stats.failed_requests).to_csv(
+                "failed_requests.csv", index=False
+            )
+        return all_scores, all_costs
+
+    def _run_all_pairs(
+        self, executor: ProcessPoolExecutor | None, pairs: list[tuple[str, str]]
+    ):
+        """
+        Run and score the (dataset, model) `pairs`, returns their score and average
+        cost.
+        """
+        scorer = ChunkedScorer(executor, self.scoring_chunk_size)
+        datasets = {dataset.name: dataset for dataset in self.datasets}
+        for pair in pairs:
+            dataset = datasets[pair[0]]
+            scorer.add_pair(
+                pair,
+                dataset.data,
+                dataset.task,
+                dataset.name,
+                self._get_grits_config(dataset),
+            )
+
+        def on_response(pair: tuple[str, str], index: int, response: dict):
+            self._record_response(pair, response)
+            scorer.add_response(pair, index, response)
+
+        if self.executor == "async":
+            self._collect_all_responses(on_response=on_response, pairs=pairs)
+        else:
+            for dataset_name, model_name in tqdm(pairs):
+                self._collect_responses(
+                    datasets[dataset_name],
                     model_name,
                     self.models[model_name],
+                    on_response=partial(on_response, (dataset_name, model_name)),
                 )
-                all_scores[dataset.name][model_name] = benchmark_scores
-                all_costs[dataset.name][model_name] = avg_cost
+        return {pair: scorer.result(pair) for pair in pairs}
+
+    def _record_response(self, pair: tuple[str, str], response: dict):
+        self.performance_stats.record(*pair, response)
+        if not self._is_complete_response(response):
+            self._incomplete_pairs.add(pair)
+
+    def _run_with_early_stopping(
+        self, executor: ProcessPoolExecutor | None, pairs: list[tuple[str, str]]
+    ):
+        """
+        Evaluate each (dataset, model) pair in random batches until the bootstrap
+        interval of its score is narrow enough, see `docext.benchmark.early_stopping`.
+        The pairs run one after the other, also with the async executor.
+        """
+        policy = self.early_stopping
+        results = {}
+        early_stops = []
+        for dataset in tqdm(self.datasets):
+            grits_config = self._get_grits_config(dataset)
+            order = policy.sample_order(dataset.name, len(dataset.data))
+            for model_name, model_config in self.models.items():
+                if (dataset.name, model_name) not in pairs:
+                    continue
+                if len(order) == 0:
+                    logger.warning(f"{dataset.name} has no samples, skipping it")
+                    results[(dataset.name, model_name)] = (np.nan, np.nan)
+                    self._incomplete_pairs.add((dataset.name, model_name))
+                    continue
+                chunks = []
+                numerators = []
+                denominators = []
+                low, high = np.nan, np.nan
+                num_samples = 0
+                for start in range(0, len(order), policy.batch_size):
+                    batch = order[start : start + policy.batch_size]
+                    samples = [dataset.data[i] for i in batch]
+                    responses = self._collect_responses(
+                        dataset, model_name, model_config, samples=samples
+                    )
+                    for response in responses:
+                        self._record_response((dataset.name, model_name), response)
+                    args = (samples, responses, dataset.task, dataset.name)
+                    chunk = (
+                        score_chunk(*args, grits_config)
+                        if executor is None
+                        else executor.submit(score_chunk, *args, grits_config).result()
+                    )
+                    chunks.append(chunk)
+                    numerator, denominator = sample_ratios(
+                        chunk[0], samples, dataset.task
+                    )
+                    numerators.append(numerator)
+                    denominators.append(denominator)
+                    num_samples = start + len(samples)
+                    low, high = bootstrap_interval(
+                        np.concatenate(numerators),
+                        np.concatenate(denominators),
+                        policy.confidence,
+                        policy.num_bootstrap,
+                        policy.seed,
+                    )
+                    if policy.is_converged(num_samples, low, high):
+                        break
+                score, avg_cost = merge_chunks(chunks, dataset.task, grits_config)
+                results[(dataset.name, model_name)] = (score, avg_cost)
+                early_stops.append(
+                    {
+                        "model": model_name,
+                        "dataset": dataset.name,
+                        "samples": num_samples,
+                        "total_samples": len(dataset.data),
+                        "stopped_early": num_samples < len(dataset.data),
+                        "score": score,
+                        "ci_low": low,
+                        "ci_high": high,
+                        "ci_width": high - low,
+                        "confidence": policy.confidence,
+                    }
+                )
+                logger.info(
+                    f"{model_name} on {dataset.name}: {score:.4f} "
+                    f"[{low:.4f}, {high:.4f}] after {num_samples} of "
+                    f"{len(dataset.data)} samples"
+                )
+        df_early_stop = pd.DataFrame(early_stops)
+        df_early_stop.to_csv("early_stop.csv", index=False)
+        return results
+
+    def rescore(self):
+        """
+        Rebuild `accuracy.csv` and `cost.csv` from the cached responses only, eg:
+        after changing a metric or the parsing. No request is sent: the samples
+        without a complete cached response are left out of the scores and listed
+        in `missing_responses.csv`.
+        """
+        jobs = {}
+        missing = []
+        for dataset in self.datasets:
+            for model_name, model_config in self.models.items():
+                template = self._get_template(dataset.task, model_config)
+                cache_keys = [
+                    self._get_cache_key(data, template, dataset.task, model_name)
+                    for data in dataset.data
+                ]
+                cached = self.prediction_cache.get_many(model_name, cache_keys)
+                samples, responses = [], []
+                for index, (data, cache_key) in enumerate(
+                    zip(dataset.data, cache_keys)
+                ):
+                    response = cached.get(cache_key)
+                    if self._is_complete_response(response):
+                        samples.append(data)
+                        responses.append(response)
+                        self.performance_stats.record(
+                            dataset.name, model_name, response
+                        )
+                    else:
+                        missing.append(
+                            {
+                                "dataset": dataset.name,
+                                "model": model_name,
+                                "index": index,
+                                "image_path": data.image_paths[0],
+                                "cache_key": cache_key,
+                            }
+                        )
+                if len(responses) < len(dataset.data):
+                    logger.warning(
+                        f"{model_name} on {dataset.name}: "
+                        f"{len(dataset.data) - len(responses)} of "
+                        f"{len(dataset.data)} samples have no cached response"
+                    )
+                jobs[(dataset.name, model_name)] = (
+                    samples,
+                    responses,
+                    dataset.task,
+                    dataset.name,
+                    self._get_grits_config(dataset),
+                )
+
+        all_scores: dict[str, dict] = {dataset.name: {} for dataset in self.datasets}
+        all_costs: dict[str, dict] = {dataset.name: {} for dataset in self.datasets}
+        with self._scoring_executor() as executor:
+            scorer = ChunkedScorer(executor, self.scoring_chunk_size)
+            jobs = {pair: job for pair, job in jobs.items() if len(job[1]) > 0}
+            for pair, (samples, responses, *args) in jobs.items():
+                scorer.add_pair(pair, samples, *args)
+                for index, response in enumerate(responses):
+                    scorer.add_response(pair, index, response)
+            for dataset_name, model_name in tqdm(jobs, desc="Rescoring"):
+                score, avg_cost = scorer.result((dataset_name, model_name))
+                all_scores[dataset_name][model_name] = score
+                all_costs[dataset_name][model_name] = avg_cost
+        self._write_report(all_scores, all_costs)
+        self._write_performance_report(all_scores, all_costs)
+
+        pd.DataFrame(
+            missing, columns=["dataset", "model", "index", "image_path", "cache_key"]
+        ).to_csv("missing_responses.csv", index=False)
+        if missing:
+            logger.warning(
+                f"{len(missing)} samples have no cached response, see "
+                "missing_responses.csv"
+            )
+        return all_scores, all_costs
+
+    def run_shard(self, shard: Shard):
+        """
+        Send the requests of the items owned by `shard` (and with `sharding.steal`,
+        the items left by the other shards) and cache the responses, see
+        `docext.benchmark.sharding`. No report is written, run `merge` once all the
+        shards are done.
+        """
+        if self.benchmark_config.get("cache_backend", "file") != "file":
+            logger.warning(
+                "The shards share the prediction cache, use cache_backend: file when "
+                "they run on several hosts"
+            )
+        claims = get_claim_dir(self.cache_dir, shard, self.sharding.claim_ttl)
+        own_items = []
+        other_items = []
+        for dataset in self.datasets:
+            for model_name, model_config in self.models.items():
+                template = self._get_template(dataset.task, model_config)
+                for data in dataset.data:
+                    cache_key = self._get_cache_key(
+                        data, template, dataset.task, model_name
+                    )
+                    item = (data, template, dataset.task, model_name, model_config)
+                    if shard.owns(cache_key):
+                        own_items.append((True, cache_key, item))
+                    else:
+                        other_items.append((False, cache_key, item))
+        logger.info(
+            f"Shard {shard.tag}: {len(own_items)} of "
+            f"{len(own_items) + len(other_items)} items"
+        )
+        # the other shards go through their items in order, the stolen items are
+        # taken from the end so they rarely collide
+        items = own_items + (other_items[::-1] if self.sharding.steal else [])
+
+        def process(own: bool, cache_key: str, item: tuple):
+            model_name = item[3]
+            response = self.prediction_cache.get(model_name, cache_key)
+            if not self.ignore_cache and self._is_complete_response(response):
+                return own, "cached"
+            if not claims.claim(model_name, cache_key):
+                # another process is sending it
+                return own, "claimed"
+            try:
+                response = self._process_item(*item)
+            finally:
+                claims.release(model_name, cache_key)
+            return own, "sent" if self._is_complete_response(response) else "failed"
+
+        counts: Counter[tuple[bool, str]] = Counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for status in tqdm(
+                executor.map(lambda args: process(*args), items),
+                total=len(items),
+                desc=f"Shard {shard.tag}",
+            ):
+                counts[status] += 1
+        df_shard = pd.DataFrame(
+            [
+                {
+                    "items": "own" if own else "stolen",
+                    "status": status,
+                    "count": count,
+                }
+                for (own, status), count in sorted(counts.items(), reverse=True)
+            ],
+            columns=["items", "status", "count"],
+        )
+        logger.info(f"Shard {shard.tag}:\n" + df_shard.to_string(index=False))
+        df_shard.to_csv(f"shard_{shard.index}_of_{shard.count}.csv", index=False)
+        if counts[(True, "failed")] + counts[(False, "failed")] > 0:
+            logger.warning(
+                f"Shard {shard.tag}: some requests failed, run the shard again to "
+                "retry them"
+            )
+        return counts
+
+    def merge(self):
+        """
+        Write the reports of a sharded run from the shared prediction cache, see
+        `rescore`. The items still claimed by a running shard are missing.
+        """
+        claims_dir = os.path.join(self.cache_dir, CLAIMS_DIR)
+        if os.path.isdir(claims_dir):
+            active = ClaimDir(
+                claims_dir, owner="merge", ttl=self.sharding.claim_ttl
+            ).active_claims()
+            if active:
+                logger.warning(
+                    f"{len(active)} items are still being sent by a shard, they are "
+                    "missing from the merged reports"
+                )
+        return self.rescore()
+
+    def export_batch(self, output_dir: str = "batches"):
+        """
+        Write the uncached requests of every (model, dataset) pair to
+        `{output_dir}/{model}__{dataset}.jsonl` in the OpenAI batch format, see
+        `docext.benchmark.batch`. Returns the paths of the files.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        paths = []
+        for dataset in self.datasets:
+            for model_name, model_config in self.models.items():
+                template = self._get_template(dataset.task, model_config)
+                cache_keys = [
+                    self._get_cache_key(data, template, dataset.task, model_name)
+                    for data in dataset.data
+                ]
+                cached = (
+                    {}
+                    if self.ignore_cache
+                    else self.prediction_cache.get_many(model_name, cache_keys)
+                )
+                pending = {}
+                for data, cache_key in zip(dataset.data, cache_keys):
+                    # the custom_ids of a batch must be unique
+                    if cache_key in pending or self._is_complete_response(
+                        cached.get(cache_key)
+                    ):
+                        continue
+                    pending[cache_key] = data
+
+                def lines():
+                    # the images are encoded one request at a time
+                    for cache_key, data in pending.items():
+                        messages = self._get_messages(data, template, dataset.task)
+                        messages = change_system_prompt(messages, model_name)
+                        yield batch_request(
+                            cache_key, model_name, messages, model_config
+                        )
+
+                pair_paths = write_batch_files(
+                    os.path.join(
+                        output_dir, f"{model_cache_name(model_name)}__{dataset.name}"
+                    ),
+                    lines(),
+                    max_requests=self.batch_config.get("max_requests_per_file", 50000),
+                    max_bytes=int(
+                        self.batch_config.get("max_file_size_mb", 190) * 2**20
+                    ),
+                )
+                logger.info(
+                    f"{model_name} on {dataset.name}: {len(pending)} uncached "
+                    f"requests in {len(pair_paths)} batch files"
+                )
+                paths.extend(pair_paths)
+        return paths
+
+    def ingest_batch(self, results_path: str, model_name: str | None = None):
+        """
+        Store the responses of a batch results file in the prediction cache, under
+        their `custom_id` (the cache key). The failed requests are not cached, they
+        are exported again by the next `export_batch`.
+        """
+        if model_name is None:
+            assert (
+                len(self.models) == 1
+            ), "--batch_model is required when the config has several models"
+            model_name = next(iter(self.models))
+        assert model_name in self.models, f"{model_name} is not a model of the run"
+        num_cached = 0
+        errors = []
+        for custom_id, body, error in read_batch_results(results_path):
+            if body is None:
+                errors.append({"custom_id": custom_id, "error": error})
+                continue
+            try:
+                response_cost = completion_cost(
+                    completion_response=body, model=model_name
+                )
+            except Exception:
+                response_cost = None
+            response = {
+                **body,
+                "response_cost": response_cost,
+                "token_counter": -1,
+                # the batch service does not report the latency of the requests
+                "performance": None,
+            }
+            self._cache_response(custom_id, model_name, response)
+            num_cached += 1
+        logger.info(f"{model_name}: cached {num_cached} responses of {results_path}")
+        if errors:
+            logger.warning(
+                f"{len(errors)} requests of {results_path} failed, see "
+                "batch_errors.csv"
+            )
+            pd.DataFrame(errors).to_csv("batch_errors.csv", index=False)
+        return num_cached, errors
+
+    def resolution_sweep(self):
+        """
+        Rerun the datasets of `resolution_sweep` in the config with the images at
+        each of its resolutions, and write the accuracy, input tokens, latency and
+        cost of every (model, dataset, resolution) to `resolution_sweep.csv`, and
+        their averages over the datasets to `resolution_curves.csv`.
+        """
+        sweep_config = self.benchmark_config.get("resolution_sweep", None) or {}
+        resolutions = get_resolutions(sweep_config)
+        sweep_datasets = sweep_config.get("datasets", None) or []
+        datasets = [
+            dataset
+            for dataset in self.datasets
+            if not sweep_datasets or dataset.name in sweep_datasets
+        ]
+        assert len(datasets) > 0, "resolution_sweep has no dataset of the run"
+        concurrency = {model_name: self.max_workers for model_name in self.models}
+
+        rows = []
+        with self._scoring_executor() as executor:
+            scorer = ChunkedScorer(executor, self.scoring_chunk_size)
+            performance = {}
+            for resolution in resolutions:
+                performance_stats = PerformanceStats()
+                for dataset in datasets:
+                    for model_name, model_config in self.models.items():
+                        pair = (dataset.name, model_name, resolution.tag)
+                        scorer.add_pair(
+                            pair,
+                            dataset.data,
+                            dataset.task,
+                            dataset.name,
+                            self._get_grits_config(dataset),
+                        )
+
+                        def on_response(index, response, pair=pair):
+                            performance_stats.record(pair[0], pair[1], response)
+                            scorer.add_response(pair, index, response)
+
+                        self._collect_responses(
+                            dataset,
+                            model_name,
+                            model_config,
+                            on_response=on_response,
+                            resolution=resolution,
+                        )
+                df_performance = performance_stats.to_dataframe(concurrency)
+                performance[resolution] = df_performance.set_index(["model", "dataset"])
+
+            for resolution in resolutions:
+                for dataset in datasets:
+                    image_pixels = [
+                        width * height
+                        for data in dataset.data
+                        for width, height in (
+                            image_size(path, resolution) for path in data.image_paths
+                        )
+                    ]
+                    for model_name in self.models:
+                        accuracy, avg_cost = scorer.result(
+                            (dataset.name, model_name, resolution.tag)
+                        )
+                        stats = performance[resolution].loc[(model_name, dataset.name)]
+                        rows.append(
+                            {
+                                "model": model_name,
+                                "dataset": dataset.name,
+                                "resolution": resolution.tag,
+                                "max_size": resolution.max_size,
+                                "max_pixels": resolution.max_pixels,
+                                "image_pixels_mean": np.mean(image_pixels),
+                                "accuracy": accuracy,
+                                "cost": avg_cost,
+                                "input_tokens_mean": stats["input_tokens_mean"],
+                                "output_tokens_mean": stats["output_tokens_mean"],
+                                "latency_p50_s": stats["latency_p50_s"],
+                                "latency_p95_s": stats["latency_p95_s"],
+                            }
+                        )
+
+        df = pd.DataFrame(rows)
+        df.to_csv("resolution_sweep.csv", index=False)
+        df_curves = (
+            df.drop(columns=["dataset"])
+            .groupby(["model", "resolution"], sort=False, dropna=False)
+            .mean(numeric_only=True)
+            .reset_index()
+        )
+        logger.info("RESOLUTION SWEEP:\n" + df_curves.to_string(index=False))
+        df_curves.to_csv("resolution_curves.csv", index=False)
+        return df
+
+    def concurrency_sweep(self):
+        """
+        Send the same samples to the `hosted_vllm/` models at each concurrency level
+        of `concurrency_sweep` in the config, see `docext.benchmark.concurrency`.
+        Writes `concurrency_sweep.csv` and the saturation point of each model to
+        `concurrency_saturation.csv`.
+        """
+        sweep_config = self.benchmark_config.get("concurrency_sweep", None) or {}
+        model_names = sweep_config.get("models", None) or [
+            model_name
+            for model_name in self.models
+            if model_name.startswith("hosted_vllm/")
+        ]
+        assert len(model_names) > 0, "concurrency_sweep needs a hosted_vllm model"
+        dataset_name = sweep_config.get("dataset", None) or self.datasets[0].name
+        datasets = [
+            dataset for dataset in self.datasets if dataset.name == dataset_name
+        ]
+        assert len(datasets) == 1, f"{dataset_name} is not a dataset of the run"
+        dataset = datasets[0]
+        samples = dataset.data[: sweep_config.get("num_samples", 64)]
+        levels = sorted(sweep_config.get("levels", None) or [1, 2, 4, 8, 16, 32, 64])
+
+        rows = []
+        saturation = []
+        for model_name in model_names:
+            model_config = self.benchmark_config[model_name]
+            template = self._get_template(dataset.task, model_config)
+            # the messages are built once, only the requests are timed
+            payloads = [
+                change_system_prompt(
+                    self._get_messages(data, template, dataset.task), model_name
+                )
+                for data in tqdm(samples, desc="Encoding the sweep samples")
+            ]
+            model_rows = []
+            for concurrency in levels:
+                records, wall_time = run_level(
+                    lambda messages: self._get_response(
+                        messages, model_name, model_config, cache_key=None
+                    ),
+                    payloads,
+                    concurrency,
+                )
+                row = summarize_level(model_name, concurrency, records, wall_time)
+                logger.info(
+                    f"{model_name} at concurrency {concurrency}: "
+                    f"{row['throughput_requests_per_s']:.2f} req/s, "
+                    f"p95 {row['latency_p95_s']:.2f}s, "
+                    f"{row['error_rate']:.1%} errors"
+                )
+                model_rows.append(row)
+            rows.extend(model_rows)
+            knee = find_saturation(
+                pd.DataFrame(model_rows),
+                sweep_config.get("throughput_tolerance", 0.95),
+                sweep_config.get("max_error_rate", 0.01),
+                sweep_config.get("min_scaling", 0.5),
+            )
+            saturation.append({"model": model_name, **knee})
+            if knee["saturation_concurrency"] is not None:
+                logger.info(
+                    f"{model_name} saturates at concurrency "
+                    f"{knee['saturation_concurrency']}, use it as max_workers (or "
+                    "the concurrency_limit of the app)"
+                )
+            else:
+                logger.warning(f"{model_name} failed at every concurrency level")
+
+        df = pd.DataFrame(rows, columns=SWEEP_COLUMNS)
+        df.to_csv("concurrency_sweep.csv", index=False)
+        df_saturation = pd.DataFrame(saturation)
+        logger.info("CONCURRENCY SWEEP:\n" + df_saturation.to_string(index=False))
+        df_saturation.to_csv("concurrency_saturation.csv", index=False)
+        return df, df_saturation
+
+    def _write_report(self, all_scores: dict, all_costs: dict):
         df = pd.DataFrame(all_scores)
         df["average"] = df.mean(axis=1)
         df = df[["average"] + list(df.columns[:-1])]
@@ -314,34 +1012,152 @@ class NanonetsIDPBenchmark:
         df_cost = df_cost.sort_index()
         logger.info("COST:\n" + df_cost.to_string())
         df_cost.to_csv("cost.csv", index=True)
-        return all_scores, all_costs
 
-    def _get_prediction_cache_files(self, dataset: BenchmarkDataset, model_name: str):
-        template = self.templates[dataset.task]
-        model_config = self.models[model_name]
-        if model_config.get("template", {}).get(dataset.task, None) is not None:
+    def _write_performance_report(self, all_scores: dict, all_costs: dict):
+        """
+        Write `performance.csv` and the accuracy vs latency / cost Pareto tables,
+        see `docext.benchmark.performance`.
+        """
+        concurrency = {
+            model_name: self._get_concurrency(model_name) for model_name in self.models
+        }
+        df_performance = self.performance_stats.to_dataframe(concurrency)
+        logger.info("PERFORMANCE:\n" + df_performance.to_string(index=False))
+        df_performance.to_csv("performance.csv", index=False)
+
+        accuracy = pd.DataFrame(all_scores).mean(axis=1)
+        cost = pd.DataFrame(all_costs).mean(axis=1)
+        latency = self.performance_stats.model_latencies().reindex(accuracy.index)
+        pareto_table(accuracy, latency, "latency_p50_s").to_csv("pareto_latency.csv")
+        pareto_table(accuracy, cost, "cost").to_csv("pareto_cost.csv")
+
+    def _get_concurrency(self, model_name: str):
+        if self.executor == "async":
+            scheduler = AsyncScheduler(self.provider_limits, self.max_workers)
+            provider = get_provider(model_name, self.models[model_name])
+            return scheduler.limits_for(provider).max_concurrency
+        return self.max_workers
+
+    def _collect_all_responses(
+        self,
+        on_response: Callable[[tuple[str, str], int, dict], None] | None = None,
+        pairs: list[tuple[str, str]] | None = None,
+    ):
+        """
+        Get the responses of all the (dataset, model, sample) items concurrently,
+        with the concurrency and rate limits of each provider. `on_response(pair,
+        index, response)` is called as soon as a response arrives. With `pairs`,
+        only the items of these (dataset, model) pairs are run.
+        """
+        scheduler = AsyncScheduler(self.provider_limits, self.max_workers)
+        items = []
+        item_pairs = []
+        positions = []
+        for dataset in self.datasets:
+            for model_name, model_config in self.models.items():
+                if pairs is not None and (dataset.name, model_name) not in pairs:
+                    continue
+                template = self._get_template(dataset.task, model_config)
+                provider = get_provider(model_name, model_config)
+                for index, data in enumerate(dataset.data):
+                    items.append(
+                        (
+                            provider,
+                            (data, template, dataset.task, model_name, model_config),
+                        )
+                    )
+                    item_pairs.append((dataset.name, model_name))
+                    positions.append(index)
+
+        def process(args: tuple, attempt: int):
+            data, template, task, model_name, model_config = args
+            return self._process_item(
+                data,
+                template,
+                task,
+                model_name,
+                model_config,
+                attempt=attempt,
+                reschedule=True,
+            )
+
+        # the retries go back to the scheduler instead of sleeping in a worker
+        responses = scheduler.run(
+            process,
+            items,
+            on_result=None
+            if on_response is None
+            else lambda i, response: on_response(item_pairs[i], positions[i], response),
+        )
+
+        # responses are in the order of the items, ie: in the order of dataset.data
+        all_responses: dict[tuple[str, str], list[dict]] = {}
+        for pair, response in zip(item_pairs, responses):
+            all_responses.setdefault(pair, []).append(response)
+        return all_responses
+
+    def _get_template(self, task: str, model_config: dict[str, Any]):
+        if model_config.get("template", {}).get(task, None) is not None:
             # override the default template if provided in the model config
-            template = model_config["template"][dataset.task]
+            return model_config["template"][task]
+        return self.templates[task]
 
-        cache_files = []
+    def _get_prediction_cache_files(self, dataset: BenchmarkDataset, model_name: str):
+        template = self._get_template(dataset.task, self.models[model_name])
+
+        cache_keys = []
         questions = []
         for data in tqdm(
             dataset.data,
             desc=f"Running benchmark for {model_name} on {dataset.name}",
             leave=False,
         ):
-            messages = self._get_messages(data, template, dataset.task)
-
             # check if the response is cached
-            hash_messages = hashlib.sha256(str(messages).encode()).hexdigest()
-            cache_file = os.path.join(
-                self.cache_dir,
-                f"{model_name.replace('/', '_')}_{hash_messages}.json",
-            )
-            if os.path.exists(cache_file):
-                cache_files.append(cache_file)
-                questions.append(messages[-1]["content"])
-        return cache_files, questions
+            cache_key = self._get_cache_key(data, template, dataset.task, model_name)
+            if self.prediction_cache.contains(model_name, cache_key):
+                cache_keys.append(cache_key)
+                questions.append(
+                    self._get_messages(
+                        data, template, dataset.task, image_url=get_image_digest_url
+                    )[-1]["content"]
+                )
+        return cache_keys, questions
+
+    def _get_cache_key(
+        self,
+        data: BenchmarkData,
+        template: dict[str, Any],
+        task: str,
+        model_name: str,
+        resolution: Resolution | None = None,
+    ):
+        """
+        Hash of the request with the images replaced by their content digests, so
+        the key is cheap to compute and does not need the base64 encoded images.
+        The messages hold the rendered template and the model specific changes,
+        the model name is part of the cache entry.
+        """
+        messages = self._get_messages(
+            data,
+            template,
+            task,
+            image_url=get_image_digest_url
+            if resolution is None
+            else get_resized_image_digest_url(resolution),
+        )
+        messages = change_system_prompt(messages, model_name)
+        return hashlib.sha256(
+            json.dumps(messages, sort_keys=True, ensure_ascii=False).encode()
+        ).hexdigest()
+
+    @staticmethod
+    def _is_complete_response(response: dict | None) -> TypeGuard[dict]:
+        return (
+            response is not None
+            and len(response["choices"]) > 0
+            # and response["choices"][0]["message"]["content"] not in [None, ""]
+            and response["choices"][0]["finish_reason"] == "stop"
+        )
 
     def _process_item(
         self,
@@ -350,26 +1166,40 @@ class NanonetsIDPBenchmark:
         task: str,
         model_name: str,
         model_config: dict[str, Any],
+        attempt: int = 1,
+        reschedule: bool = False,
+        resolution: Resolution | None = None,
     ):
-        messages = self._get_messages(data, template, task)
+        cache_key = self._get_cache_key(data, template, task, model_name, resolution)
+        if not self.ignore_cache:
+            response = self.prediction_cache.get(model_name, cache_key)
+            if self._is_complete_response(response):
+                CACHE_LOOKUPS.labels("benchmark_prediction", "hit").inc()
+                return response
+
+        # the messages with the encoded images are only built when they are needed
+        if resolution is None:
+            messages = self._get_messages(data, template, task)
+        else:
+            messages = self._get_messages(
+                data, template, task, image_url=get_resized_image_url(resolution)
+            )
         messages = change_system_prompt(messages, model_name)
-        hash_messages = hashlib.sha256(str(messages).encode()).hexdigest()
-        cache_file = os.path.join(
-            self.cache_dir,
-            f"{model_name.replace('/', '_')}_{hash_messages}.json",
-        )
 
-        if os.path.exists(cache_file) and not self.ignore_cache:
-            with open(cache_file) as f:
-                response = json.load(f)
-            if (
-                len(response["choices"]) > 0
-                # and response["choices"][0]["message"]["content"] not in [None, ""]
-                and response["choices"][0]["finish_reason"] == "stop"
-            ):
+        if not self.ignore_cache and self.legacy_cache_keys and resolution is None:
+            legacy_key = hashlib.sha256(str(messages).encode()).hexdigest()
+            response = self.prediction_cache.get(model_name, legacy_key)
+            if self._is_complete_response(response):
+                CACHE_LOOKUPS.labels("benchmark_prediction", "hit").inc()
+                self._cache_response(cache_key, model_name, response)
                 return response
+
+        if attempt == 1:
+            CACHE_LOOKUPS.labels("benchmark_prediction", "miss").inc()
         # get the response from the model and cache it if it is not cached
-        response = self._get_response(messages, model_name, model_config)
+        response = self._get_response_with_retries(
+            messages, model_name, model_config, cache_key, attempt, reschedule
+        )
         # if response is None:
         #     return None
         # if len(response["choices"]) > 0 and response["choices"][0]["finish_reason"] == "stop":
@@ -384,183 +1214,162 @@ class NanonetsIDPBenchmark:
         model_name: str,
         model_config: dict[str, Any],
     ):
-        template = self.templates[dataset.task]
-        if model_config.get("template", {}).get(dataset.task, None) is not None:
-            # override the default template if provided in the model config
-            template = model_config["template"][dataset.task]
+        responses = self._collect_responses(dataset, model_name, model_config)
+        return self._score_responses(dataset, responses)
 
-        pred_with_gt = []
+    def _collect_responses(
+        self,
+        dataset: BenchmarkDataset,
+        model_name: str,
+        model_config: dict[str, Any],
+        on_response: Callable[[int, dict], None] | None = None,
+        resolution: Resolution | None = None,
+        samples: list[BenchmarkData] | None = None,
+    ):
+        """
+        Get the responses of the samples of `dataset` (or of `samples`), in order.
+        `on_response(index, response)` is called for each response as soon as it
+        and the previous ones arrived. With `resolution`, the images are sent
+        downscaled.
+        """
+        template = self._get_template(dataset.task, model_config)
+        samples = dataset.data if samples is None else samples
+        responses = []
         with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            futures = list(
+            for index, response in enumerate(
                 tqdm(
                     executor.map(
-                        self._process_item,
-                        dataset.data,
+                        partial(self._process_item, resolution=resolution),
+                        samples,
                         repeat(template),
                         repeat(dataset.task),
                         repeat(model_name),
                         repeat(model_config),
                     ),
-                    total=len(dataset.data),
+                    total=len(samples),
                     desc=f"Running benchmark for {model_name} on {dataset.name}",
                     leave=False,
                 )
-            )
+            ):
+                responses.append(response)
+                if on_response is not None:
+                    on_response(index, response)
 
-        responses = list(futures)
-        old_num_responses = len(responses)
-        # # save the image paths of the None responses.
-        # for response, data in zip(responses, dataset.data):
-        #     if response is None:
-        #         print(data.image_paths)
-        # dataset.data = [data for data, response in zip(dataset.data, responses) if response is not None]
-        # responses = [response for response in responses if response is not None]
-        # assert len(dataset.data) == len(responses)
-        # if old_num_responses != len(responses):
-        #     logger.info(f"Total responses: Before filtering: {old_num_responses}, after filtering: {len(responses)} for {model_name} on {dataset.name}")
-        total_cost = 0
-        for response, data in zip(responses, dataset.data):
-            total_cost += (
-                response["response_cost"]
-                if response["response_cost"] is not None
-                else 0
-            )
-            # parse the response
-            parsed_response = self._parse_response(response, dataset.task)
-            if dataset.task == "KIE":
-                pred_with_gt.append(
-                    Prediction(
-                        gt=data,
-                        pred=BenchmarkData(
-                            image_paths=data.image_paths,
-                            extraction_type=data.extraction_type,
-                            fields=[
-                                PredField(
-                                    label=label,
-                                    value=value
-                                    if isinstance(value, str)
-                                    else ("" if value is None else json.dumps(value)),
-                                    confidence=-1.0,
-                                )
-                                for label, value in parsed_response.items()
-                            ],
-                        ),
-                    ),
-                )
-            elif dataset.task == "OCR":
-                pred_with_gt.append(
-                    Prediction(
-                        gt=data,
-                        pred=BenchmarkData(
-                            image_paths=data.image_paths,
-                            extraction_type=data.extraction_type,
-                            ocr_text=parsed_response,
-                        ),
-                    ),
-                )
-            elif dataset.task == "VQA":
-                pred_with_gt.append(
-                    Prediction(
-                        gt=data,
-                        pred=BenchmarkData(
-                            image_paths=data.image_paths,
-                            extraction_type=data.extraction_type,
-                            vqa=VQA(
-                                question=data.vqa.question
-                                if data.vqa is not None
-                                else "",
-                                answer=parsed_response,
-                            ),
-                        ),
-                    ),
-                )
+        return responses
 
-            elif dataset.task == "CLASSIFICATION":
-                pred_with_gt.append(
-                    Prediction(
-                        gt=data,
-                        pred=BenchmarkData(
-                            extraction_type=data.extraction_type,
-                            image_paths=data.image_paths,
-                            classification=Classification(
-                                doc_type=parsed_response,
-                                labels=data.classification.labels
-                                if data.classification is not None
-                                else [],
-                            ),
-                        ),
-                    ),
-                )
-            elif dataset.task == "TABLE":
-                parsed_response = (
-                    [parsed_response]
-                    if isinstance(parsed_response, pd.DataFrame)
-                    else parsed_response
-                )
-                pred_with_gt.append(
-                    Prediction(
-                        gt=data,
-                        pred=BenchmarkData(
-                            image_paths=data.image_paths,
-                            extraction_type=data.extraction_type,
-                            tables=[
-                                Table(
-                                    table=table,
-                                    columns=table.columns.tolist(),
-                                )
-                                for table in parsed_response
-                            ],
-                        ),
-                    ),
-                )
+    def _score_responses(self, dataset: BenchmarkDataset, responses: list[dict]):
+        return score_responses(
+            dataset.data,
+            responses,
+            dataset.task,
+            dataset.name,
+            self._get_grits_config(dataset),
+        )
 
-        avg_cost = total_cost / len(responses)
-        if dataset.task == "KIE":
-            return get_kie_metrics(pred_with_gt), avg_cost
-        elif dataset.task == "OCR":
-            return get_ocr_metrics(pred_with_gt), avg_cost
-        elif dataset.task == "VQA":
-            if dataset.name == "docvqa":
-                return (
-                    get_vqa__metric_for_multiple_possible_answers(pred_with_gt),
-                    avg_cost,
-                )
-            else:
-                return get_vqa_metrics(pred_with_gt), avg_cost
-        elif dataset.task == "CLASSIFICATION":
-            return get_classification_metrics(pred_with_gt), avg_cost
-        elif dataset.task == "TABLE":
-            return get_table_metrics(pred_with_gt), avg_cost
-        else:
-            raise ValueError(f"Task {dataset.task} is not supported.")
+    def _scoring_executor(self):
+        if self.scoring_workers == 0:
+            return nullcontext(None)
+        # spawn, forking while the request threads run can deadlock the workers
+        return ProcessPoolExecutor(
+            max_workers=self.scoring_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    def _get_result_key(self, dataset: BenchmarkDataset, model_name: str):
+        if dataset.manifest_hash is None:
+            # the data is not versioned, the pair always runs
+            return None
+        model_config = self.models[model_name]
+        return result_key(
+            model=model_name,
+            model_config=model_config,
+            dataset=dataset.name,
+            manifest_hash=dataset.manifest_hash,
+            num_samples=len(dataset.data),
+            template=self._get_template(dataset.task, model_config),
+            grits=self._get_grits_config(dataset),
+            early_stopping=vars(self.early_stopping)
+            if self.early_stopping.enabled
+            else None,
+        )
+
+    def _get_grits_config(self, dataset: BenchmarkDataset):
+        # per dataset, eg: `grits: {mode: banded, band_width: 8}` for the long tables
+        return (self.benchmark_config.get(dataset.name) or {}).get("grits", None)
 
-    def _get_messages(self, data: BenchmarkData, template: dict[str, Any], task: str):
+    def _get_messages(
+        self,
+        data: BenchmarkData,
+        template: dict[str, Any],
+        task: str,
+        **kwargs: Any,
+    ):
         """
         Get the OpenAI-compatible messages for the given task and data.
         """
         if task == "KIE":
-            return get_KIE_messages(data, template)
+            return get_KIE_messages(data, template, **kwargs)
         elif task == "OCR":
-            return get_OCR_messages(data, template)
+            return get_OCR_messages(data, template, **kwargs)
         elif task == "VQA":
-            return get_VQA_messages(data, template)
+            return get_VQA_messages(data, template, **kwargs)
         elif task == "CLASSIFICATION":
-            return get_CLASSIFICATION_messages(data, template)
+            return get_CLASSIFICATION_messages(data, template, **kwargs)
         elif task == "TABLE":
-            return get_TABLE_messages(data, template)
+            return get_TABLE_messages(data, template, **kwargs)
         else:
             raise ValueError(f"Task {task} is not supported.")
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=10, min=60, max=600),
-    )
+    def _get_response_with_retries(
+        self,
+        messages: list[dict[str, Any]],
+        model_name: str,
+        model_config: dict[str, Any],
+        cache_key: str,
+        attempt: int = 1,
+        reschedule: bool = False,
+    ):
+        """
+        Retry the failed requests according to the class of the error, see
+        `docext.benchmark.retry`. With `reschedule`, the wait is handed to the
+        scheduler by raising `Reschedule` instead of sleeping in the worker.
+        """
+        while True:
+            try:
+                return self._get_response(messages, model_name, model_config, cache_key)
+            except Exception as e:
+                category = classify_error(e)
+                delay = self.retry_policy.next_delay(category, attempt, e)
+                self.retry_stats.record(model_name, category, e, delay, cache_key)
+                if delay is None:
+                    if category == INVALID_REQUEST:
+                        logger.error(
+                            f"Invalid request for {model_name} ({cache_key}): {e}"
+                        )
+                        return failed_response(e, category)
+                    raise
+                logger.warning(
+                    f"{category} error for {model_name} (attempt {attempt}), "
+                    f"retrying in {delay:.1f}s: {e}"
+                )
+                if reschedule:
+                    raise Reschedule(
+                        delay, pause_provider=category == RATE_LIMIT
+                    ) from e
+                time.sleep(delay)
+                attempt += 1
+
     def _get_response(
         self,
         messages: list[dict[str, Any]],
         model_name: str,
         model_config: dict[str, Any],
+        cache_key: str | None,
     ):
+        """
+        Send the request, the response is cached under `cache_key` unless it is
+        None.
+        """
         # import litellm
         # litellm._turn_on_debug()
         # breakpoint()
@@ -572,7 +1381,7 @@ class NanonetsIDPBenchmark:
                 model_config.get("api_base", None) is not None
             ), "api_base must be provided for hosted_vllm models"
 
-        response = completion(
+        request = dict(
             model=model_name,
             messages=messages,
             max_tokens=model_config.get("max_tokens", None),
@@ -587,90 +1396,58 @@ class NanonetsIDPBenchmark:
             if model_name.startswith("hosted_vllm/")
             else None,
         )
-        response_cost = response._hidden_params["response_cost"]
+        started_at = time.time()
+        start = time.perf_counter()
+        ttft = None
+        if model_config.get("stream", False):
+            # streaming gives the time to first token
+            chunks = []
+            for chunk in completion(
+                **request, stream=True, stream_options={"include_usage": True}
+            ):
+                if ttft is None and chunk.choices and chunk.choices[0].delta.content:
+                    ttft = time.perf_counter() - start
+                chunks.append(chunk)
+            latency = time.perf_counter() - start
+            response = stream_chunk_builder(chunks, messages=messages)
+        else:
+            response = completion(**request)
+            latency = time.perf_counter() - start
+        assert response is not None, f"{model_name} returned no response"
+        response_cost = response._hidden_params.get("response_cost", None)
+        if response_cost is None and model_config.get("stream", False):
+            try:
+                response_cost = completion_cost(completion_response=response)
+            except Exception:
+                response_cost = None
         token_counter = (
             response._hidden_params["token_counter"]
             if "token_counter" in response._hidden_params
             else -1
         )
-        response = response.json()
-        response["response_cost"] = response_cost
-        response["token_counter"] = token_counter
+        response_json = response.json()
+        assert isinstance(response_json, dict), f"Unexpected response {response_json}"
+        response_json["response_cost"] = response_cost
+        response_json["token_counter"] = token_counter
+        response_json["performance"] = response_performance(started_at, latency, ttft)
 
-        self._cache_response(messages, model_name, response)
-        return response
+        if cache_key is not None:
+            self._cache_response(cache_key, model_name, response_json)
+        return response_json
 
     def _parse_response(self, response: dict, task: str):
-        if task == "OCR" or task == "VQA" or task == "CLASSIFICATION":
-            # OCR and VQA, Classification task returns a string
-            answer = (
-                response["choices"][0]["message"]["content"]
-                if len(response["choices"]) > 0
-                and response["choices"][0]["message"]["content"]
-                else ""
-            )
-            return answer.strip() if answer else ""
-        elif task == "TABLE":
-            response = response["choices"][0]["message"]["content"]
-
-            # convert the parsed_json to a dataframe
-            try:
-                parsed_json = json_repair.repair_json(
-                    response, ensure_ascii=False, return_objects=True
-                )
-                if isinstance(parsed_json[0], list):
-                    df = pd.concat([pd.DataFrame(item) for item in parsed_json])
-                else:
-                    df = pd.DataFrame(parsed_json)
-                return df
-            except Exception as e:
-                print(f"Error parsing table: {e}")
-                return pd.DataFrame()
-
-        parsed_json = json_repair.repair_json(
-            response["choices"][0]["message"]["content"]
-            if len(response["choices"]) > 0
-            and response["choices"][0]["message"]["content"]
-            else "{}",
-            ensure_ascii=False,
-            return_objects=True,
-        )
-        if isinstance(parsed_json, list):
-            # merge all the keys into a single dict
-            merged_dict = {}
-            for item in parsed_json:
-                if isinstance(item, dict):
-                    for key, value in item.items():
-                        if key not in merged_dict:
-                            merged_dict[key] = value
-                        else:
-                            if isinstance(merged_dict[key], list):
-                                merged_dict[key].append(value)
-                            else:
-                                merged_dict[key] = [merged_dict[key], value]
-                # we ignore the other types of objects, the model should not return them
-            return merged_dict
-
-        if parsed_json == "":
-            return {}  # parsing failed
-        return parsed_json
+        return parse_response(response, task)
 
     def _cache_response(
         self,
-        messages: list[dict[str, Any]],
+        cache_key: str,
         model_name: str,
-        response: str,
+        response: dict,
     ):
         """
-        Cache the response for the given messages and model name.
+        Cache the response for the given cache key and model name.
         """
-        hash_messages = hashlib.sha256(str(messages).encode()).hexdigest()
-        cache_file = os.path.join(
-            self.cache_dir,
-            f"{model_name.replace('/', '_')}_{hash_messages}.json",
-        )
-        with open(cache_file, "w") as f:
-            json.dump(response, f)
+        self.prediction_cache.set(model_name, cache_key, response)
 
     def _validate_benchmark_config(self, benchmark_config: dict):
         # validate tasks
@@ -707,6 +1484,24 @@ class NanonetsIDPBenchmark:
             "document_page_seperator" in benchmark_config["KIE_default_template"]
         ), "document_page_seperator must be in the KIE_default_template"
 
+        # validate the GriTS modes of the table datasets
+        for dataset in TABLE_DATASETS:
+            grits_config = (benchmark_config.get(dataset.name) or {}).get("grits")
+            if grits_config is not None:
+                assert (
+                    grits_config.get("mode", "exact") in GRITS_MODES
+                ), f"{dataset.name} grits mode must be one of {GRITS_MODES}"
+
+        # validate the prediction cache backend
+        assert (
+            benchmark_config.get("cache_backend", "file") in CACHE_BACKENDS
+        ), f"cache_backend must be one of {CACHE_BACKENDS}"
+
+        # validate the executor
+        assert (
+            benchmark_config.get("executor", "threads") in EXECUTORS
+        ), f"executor must be one of {EXECUTORS}"
+
         # validate models
         assert "models" in benchmark_config, "models must be in the benchmark config"
         assert len(benchmark_config["models"]) > 0, "models must be non-empty"
@@ -716,8 +1511,91 @@ class NanonetsIDPBenchmark:
             ), f"{model} config must be in the benchmark config"
 
 
-if __name__ == "__main__":
-    benchmark = NanonetsIDPBenchmark(
-        benchmark_config_path="/home/paperspace/projects/docext/configs/benchmark.yaml",
+def parse_args(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Nanonets IDP benchmark")
+    parser.add_argument(
+        "--config",
+        type=str,
+        default="configs/benchmark.yaml",
+        help="Path to the benchmark config.",
+    )
+    parser.add_argument(
+        "--rescore",
+        action="store_true",
+        help="Rebuild accuracy.csv and cost.csv from the cached responses, without "
+        "sending any request.",
+    )
+    parser.add_argument(
+        "--shard",
+        type=str,
+        default=None,
+        help="Run only the shard i/N (0 <= i < N) of the requests and cache the "
+        "responses, the shards share the cache_dir. See docext/benchmark/sharding.py.",
+    )
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        help="Write the reports of a sharded run from the cached responses.",
+    )
+    parser.add_argument(
+        "--export_batch",
+        type=str,
+        default=None,
+        metavar="OUTPUT_DIR",
+        help="Write the uncached requests to OpenAI batch files in OUTPUT_DIR. See "
+        "docext/benchmark/batch.py.",
+    )
+    parser.add_argument(
+        "--ingest_batch",
+        type=str,
+        default=None,
+        metavar="RESULTS",
+        help="Store the responses of a batch results file in the prediction cache.",
+    )
+    parser.add_argument(
+        "--batch_model",
+        type=str,
+        default=None,
+        help="Model of the --ingest_batch results, defaults to the only model of "
+        "the config.",
     )
-    benchmark.run_benchmark()
+    parser.add_argument(
+        "--concurrency_sweep",
+        action="store_true",
+        help="Send the same samples to the hosted_vllm models at increasing "
+        "concurrency and write concurrency_sweep.csv and "
+        "concurrency_saturation.csv.",
+    )
+    parser.add_argument(
+        "--resolution_sweep",
+        action="store_true",
+        help="Rerun the `resolution_sweep` datasets at each image resolution and "
+        "write resolution_sweep.csv and resolution_curves.csv.",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None):
+    args = parse_args(argv)
+    shard = None if args.shard is None else Shard.parse(args.shard)
+    benchmark = NanonetsIDPBenchmark(benchmark_config_path=args.config)
+    if shard is not None:
+        benchmark.run_shard(shard)
+    elif args.merge:
+        benchmark.merge()
+    elif args.export_batch is not None:
+        benchmark.export_batch(args.export_batch)
+    elif args.ingest_batch is not None:
+        benchmark.ingest_batch(args.ingest_batch, args.batch_model)
+    elif args.rescore:
+        benchmark.rescore()
+    elif args.resolution_sweep:
+        benchmark.resolution_sweep()
+    elif args.concurrency_sweep:
+        benchmark.concurrency_sweep()
+    else:
+        benchmark.run_benchmark()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+"""
+Prediction cache backends for the benchmark.
+
+Every model response is cached under `(model_name, key)`, where the key is a hash of
+the request. Two backends are available, selected with `cache_backend` in the
+benchmark config:
+    file    one `{model}_{key}.json` file per response in `{cache_dir}/prediction_cache`
+    sqlite  a single `{cache_dir}/prediction_cache.db` file with zlib compressed responses
+
+Migrate an existing file cache to SQLite with:
+    python -m docext.benchmark.cache --cache_dir ./docext_benchmark_cache
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+from collections.abc import Iterable
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+from loguru import logger
+from tqdm import tqdm
+
+CACHE_BACKENDS = ["file", "sqlite"]
+
+# SQLite limits the number of host parameters of a query
+_BULK_READ_SIZE = 500
+
+
+def model_cache_name(model_name: str):
+    # the file layout flattens the model name, the other backends reuse it so
+    # migrated entries stay addressable
+    return model_name.replace("/", "_")
+
+
+class PredictionCache:
+    def get(self, model_name: str, key: str) -> dict[str, Any] | None:
+        raise NotImplementedError
+
+    def set(self, model_name: str, key: str, response: dict[str, Any]):
+        raise NotImplementedError
+
+    def contains(self, model_name: str, key: str) -> bool:
+        return self.get(model_name, key) is not None
+
+    def get_many(
+        self, model_name: str, keys: Iterable[str]
+    ) -> dict[str, dict[str, Any]]:
+        """
+        Return the cached responses of `keys`, missing keys are left out.
+        """
+        responses = {}
+        for key in keys:
+            response = self.get(model_name, key)
+            if response is not None:
+                responses[key] = response
+        return responses
+
+    def set_many(self, items: Iterable[tuple[str, str, dict[str, Any]]]):
+        for model_name, key, response in items:
+            self.set(model_name, key, response)
+
+    def items(self) -> Iterator[tuple[str, str, dict[str, Any]]]:
+        """
+        Iterate over all `(model, key, response)` entries. `model` is the
+        flattened model name, see `model_cache_name`.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class FilePredictionCache(PredictionCache):
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def path(self, model_name: str, key: str):
+        return os.path.join(
+            self.cache_dir, f"{model_cache_name(model_name)}_{key}.json"
+        )
+
+    def get(self, model_name: str, key: str):
+        try:
+            with open(self.path(model_name, key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def set(self, model_name: str, key: str, response: dict[str, Any]):
+        # write to a temporary file first, a crash must not leave a truncated entry
+        path = self.path(model_name, key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(response, f)
+        os.replace(tmp_path, path)
+
+    def contains(self, model_name: str, key: str):
+        return os.path.exists(self.path(model_name, key))
+
+    def items(self):
+        for file_name in sorted(os.listdir(self.cache_dir)):
+            if not file_name.endswith(".json"):
+                continue
+            # the key is a hex digest, the model name may contain "_"
+            model, key = file_name[: -len(".json")].rsplit("_", 1)
+            with open(os.path.join(self.cache_dir, file_name)) as f:
+                yield model, key, json.load(f)
+
+
+class SQLitePredictionCache(PredictionCache):
+    """
+    Single-file cache. Responses are stored as zlib compressed JSON. The threads
+    borrow a connection from a pool of at most `pool_size` connections, so the
+    short-lived worker threads of the benchmark do not leave connections open.
+    Writes are serialized in process so the `max_workers` threads do not spin on
+    SQLite's busy timeout.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        compression_level: int = 6,
+        timeout: float = 60.0,
+        pool_size: int = 8,
+    ):
+        assert pool_size > 0, "pool_size must be positive"
+        self.db_path = db_path
+        self.compression_level = compression_level
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._write_lock = threading.Lock()
+        self._pool_lock = threading.Lock()
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._connections: list[sqlite3.Connection] = []
+        dirname = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(dirname, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS predictions (
+                    model TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    response BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (model, key)
+                ) WITHOUT ROWID
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        # WAL + NORMAL is durable against process crashes, only an OS crash
+        # can lose the last transactions
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection of the pool, a new one is opened while the pool has
+        less than `pool_size` connections, otherwise wait for an idle one.
+        """
+        conn: sqlite3.Connection | None = None
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._pool_lock:
+                if len(self._connections) < self.pool_size:
+                    conn = self._connect()
+                    self._connections.append(conn)
+        if conn is None:
+            conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    @property
+    def num_connections(self) -> int:
+        return len(self._connections)
+
+    def _encode(self, response: dict[str, Any]):
+        return zlib.compress(
+            json.dumps(response, ensure_ascii=False).encode("utf-8"),
+            self.compression_level,
+        )
+
+    @staticmethod
+    def _decode(blob: bytes):
+        return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+    def get(self, model_name: str, key: str):
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT response FROM predictions WHERE model = ? AND key = ?",
+                (model_cache_name(model_name), key),
+            ).fetchone()
+        return None if row is None else self._decode(row[0])
+
+    def contains(self, model_name: str, key: str):
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM predictions WHERE model = ? AND key = ?",
+                (model_cache_name(model_name), key),
+            ).fetchone()
+        return row is not None
+
+    def get_many(self, model_name: str, keys: Iterable[str]):
+        keys = list(keys)
+        responses = {}
+        for i in range(0, len(keys), _BULK_READ_SIZE):
+            chunk = keys[i : i + _BULK_READ_SIZE]
+            with self._connection() as conn:
+                rows = conn.execute(
+                    f"SELECT key, response FROM predictions WHERE model = ? "
+                    f"AND key IN ({','.join('?' * len(chunk))})",
+                    (model_cache_name(model_name), *chunk),
+                ).fetchall()
+            responses.update({key: self._decode(blob) for key, blob in rows})
+        return responses
+
+    def set(self, model_name: str, key: str, response: dict[str, Any]):
+        self.set_many([(model_name, key, response)])
+
+    def set_many(self, items: Iterable[tuple[str, str, dict[str, Any]]]):
+        # compress outside of the lock
+        rows = [
+            (model_cache_name(model_name), key, self._encode(response), time.time())
+            for model_name, key, response in items
+        ]
+        with self._connection() as conn, self._write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO predictions (model, key, response, created_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def items(self):
+        # a dedicated connection, the caller may write to the cache while iterating
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout)
+        try:
+            for model, key, blob in conn.execute(
+                "SELECT model, key, response FROM predictions ORDER BY model, key"
+            ):
+                yield model, key, self._decode(blob)
+        finally:
+            conn.close()
+
+    def __len__(self):
+        with self._connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+
+    def close(self):
+        with self._pool_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+            self._idle = queue.LifoQueue()
+
+
+def get_prediction_cache(backend: str, cache_dir: str) -> PredictionCache:
+    """
+    Create the prediction cache of the benchmark rooted at `cache_dir`.
+    """
+    assert backend in CACHE_BACKENDS, f"cache_backend must be one of {CACHE_BACKENDS}"
+    if backend == "sqlite":
+        return SQLitePredictionCache(os.path.join(cache_dir, "prediction_cache.db"))
+    return FilePredictionCache(os.path.join(cache_dir, "prediction_cache"))
+
+
+def migrate_cache(
+    source: PredictionCache, destination: PredictionCache, batch_size: int = 1000
+):
+    """
+    Copy all entries of `source` to `destination`, eg: from the file cache to SQLite.
+    """
+    num_entries = 0
+    batch = []
+    for item in tqdm(source.items(), desc="Migrating prediction cache"):
+        batch.append(item)
+        if len(batch) >= batch_size:
+            destination.set_many(batch)
+            num_entries += len(batch)
+            batch = []
+    if batch:
+        destination.set_many(batch)
+        num_entries += len(batch)
+    return num_entries
+
+
+def parse_args(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        description="DocExt benchmark: migrate the prediction cache between backends",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default="./docext_benchmark_cache",
+        help="`cache_dir` of the benchmark config.",
+    )
+    parser.add_argument("--source", type=str, default="file", choices=CACHE_BACKENDS)
+    parser.add_argument(
+        "--destination", type=str, default="sqlite", choices=CACHE_BACKENDS
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None):
+    args = parse_args(argv)
+    assert args.source != args.destination, "source and destination must differ"
+    source = get_prediction_cache(args.source, args.cache_dir)
+    destination = get_prediction_cache(args.destination, args.cache_dir)
+    start = time.perf_counter()
+    num_entries = migrate_cache(source, destination)
+    source.close()
+    destination.close()
+    logger.info(
+        f"Migrated {num_entries} entries from {args.source} to {args.destination} "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Concurrency sweep for self-hosted model servers.
+
+The same samples are sent to a `hosted_vllm/` model at increasing client
+concurrency levels, without retries and without the prediction cache:
+
+    concurrency_sweep:
+      models: []  # empty: all the hosted_vllm models of the run
+      dataset: nanonets_kie
+      num_samples: 64
+      levels: [1, 2, 4, 8, 16, 32, 64]
+      throughput_tolerance: 0.95
+      min_scaling: 0.5
+      max_error_rate: 0.01
+
+Each level reports the throughput, the latency percentiles and the error rate.
+The saturation point is the lowest level with at most `max_error_rate` errors that
+reaches `throughput_tolerance` of the peak throughput, or after which the
+throughput grows by less than `min_scaling` of the concurrency increase (the
+client overhead of each request keeps the throughput growing slowly past the
+server's batch size): more concurrency only adds queueing latency there, it is
+the recommended `max_workers` of the benchmark (and `concurrency_limit` of the
+app).
+"""
+from __future__ import annotations
+
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+from docext.benchmark.retry import classify_error
+
+SWEEP_COLUMNS = [
+    "model",
+    "concurrency",
+    "requests",
+    "errors",
+    "error_rate",
+    "wall_time_s",
+    "throughput_requests_per_s",
+    "throughput_output_tokens_per_s",
+    "latency_p50_s",
+    "latency_p95_s",
+    "latency_p99_s",
+]
+
+
+def run_level(
+    send: Callable[[Any], dict], payloads: list[Any], concurrency: int
+) -> tuple[list[dict[str, Any]], float]:
+    """
+    Send all `payloads` with `concurrency` requests in flight, returns a record
+    per request and the wall time of the level.
+    """
+
+    def timed_send(payload):
+        start = time.perf_counter()
+        try:
+            response = send(payload)
+        except Exception as e:
+            return {
+                "latency_s": time.perf_counter() - start,
+                "error": classify_error(e),
+                "output_tokens": 0,
+            }
+        usage = response.get("usage") or {}
+        return {
+            "latency_s": time.perf_counter() - start,
+            "error": None,
+            "output_tokens": usage.get("completion_tokens") or 0,
+        }
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        records = list(executor.map(timed_send, payloads))
+    return records, time.perf_counter() - start
+
+
+def summarize_level(
+    model_name: str, concurrency: int, records: list[dict[str, Any]], wall_time: float
+) -> dict[str, Any]:
+    ok = [record for record in records if record["error"] is None]
+    latencies = np.array([record["latency_s"] for record in ok], dtype=np.float64)
+    percentiles = (
+        np.percentile(latencies, [50, 95, 99]) if len(latencies) > 0 else [np.nan] * 3
+    )
+    return {
+        "model": model_name,
+        "concurrency": concurrency,
+        "requests": len(records),
+        "errors": len(records) - len(ok),
+        "error_rate": (len(records) - len(ok)) / len(records),
+        "wall_time_s": wall_time,
+        "throughput_requests_per_s": len(ok) / wall_time,
+        "throughput_output_tokens_per_s": sum(record["output_tokens"] for record in ok)
+        / wall_time,
+        "latency_p50_s": percentiles[0],
+        "latency_p95_s": percentiles[1],
+        "latency_p99_s": percentiles[2],
+    }
+
+
+def find_saturation(
+    df: pd.DataFrame,
+    throughput_tolerance: float = 0.95,
+    max_error_rate: float = 0.01,
+    min_scaling: float = 0.5,
+) -> dict[str, Any]:
+    """
+    The saturation point of one model: the lowest concurrency with an acceptable
+    error rate that reaches `throughput_tolerance` of the peak throughput, or
+    whose next level scales the throughput by less than `min_scaling` of the
+    concurrency increase, eg: 2x the concurrency for less than 1.5x the throughput
+    with 0.5.
+    """
+    healthy = df[df["error_rate"] <= max_error_rate].sort_values("concurrency")
+    if len(healthy) == 0:
+        return {
+            "saturation_concurrency": None,
+            "peak_throughput_requests_per_s": np.nan,
+            "latency_p95_s_at_saturation": np.nan,
+        }
+    concurrency = healthy["concurrency"].to_numpy(dtype=np.float64)
+    throughput = healthy["throughput_requests_per_s"].to_numpy(dtype=np.float64)
+    peak = throughput.max()
+    knee_index = len(healthy) - 1
+    for i in range(len(healthy)):
+        if throughput[i] >= throughput_tolerance * peak:
+            knee_index = i
+            break
+        if i + 1 < len(healthy) and concurrency[i + 1] > concurrency[i]:
+            scaling = (throughput[i + 1] / throughput[i] - 1) / (
+                concurrency[i + 1] / concurrency[i] - 1
+            )
+            if scaling < min_scaling:
+                knee_index = i
+                break
+    knee = healthy.iloc[knee_index]
+    return {
+        "saturation_concurrency": int(knee["concurrency"]),
+        "peak_throughput_requests_per_s": peak,
+        "latency_p95_s_at_saturation": knee["latency_p95_s"],
+    }
@@ -0,0 +1,89 @@
+"""
+Sequential sampling with early stopping for the benchmark runs.
+
+With `early_stopping.enabled`, the samples of each (model, dataset) pair are sent
+in random batches of `batch_size`. After each batch a bootstrap confidence
+interval of the metric is computed over the samples seen so far, and the pair
+stops once it has `min_samples` samples and the interval is narrower than
+`ci_width`. The samples are shuffled with the same seed for all the models of a
+dataset, so the models are compared on the same samples.
+
+The stopping point and the interval of every pair are written to `early_stop.csv`.
+"""
+from __future__ import annotations
+
+import zlib
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+
+from docext.benchmark.vlm_datasets.ds import BenchmarkData
+
+
+@dataclass
+class EarlyStopping:
+    enabled: bool = False
+    batch_size: int = 50
+    min_samples: int = 100
+    ci_width: float = 0.04
+    confidence: float = 0.95
+    num_bootstrap: int = 1000
+    seed: int = 0
+
+    @classmethod
+    def from_config(cls, config: dict[str, Any] | None):
+        policy = cls()
+        for key, value in (config or {}).items():
+            assert hasattr(policy, key), f"Unknown early_stopping config {key}"
+            setattr(policy, key, value)
+        assert policy.batch_size > 0, "early_stopping batch_size must be positive"
+        assert 0 < policy.confidence < 1, "early_stopping confidence must be in (0, 1)"
+        return policy
+
+    def sample_order(self, dataset_name: str, num_samples: int) -> np.ndarray:
+        rng = np.random.default_rng([self.seed, zlib.crc32(dataset_name.encode())])
+        return rng.permutation(num_samples)
+
+    def is_converged(self, num_samples: int, low: float, high: float) -> bool:
+        return num_samples >= self.min_samples and high - low <= self.ci_width
+
+
+def sample_ratios(
+    scores: np.ndarray, data: list[BenchmarkData], task: str
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Numerator and denominator of the metric for each sample of a `score_chunk`
+    result, the metric is `sum(numerators) / sum(denominators)`. The KIE scores
+    are per field, they are summed per sample.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if task != "KIE":
+        return scores, np.ones(len(scores))
+    counts = np.array([len(sample.fields or []) for sample in data])
+    sample_ids = np.repeat(np.arange(len(data)), counts)
+    return (
+        np.bincount(sample_ids, weights=scores, minlength=len(data)),
+        counts.astype(np.float64),
+    )
+
+
+def bootstrap_interval(
+    numerators: np.ndarray,
+    denominators: np.ndarray,
+    confidence: float = 0.95,
+    num_bootstrap: int = 1000,
+    seed: int = 0,
+) -> tuple[float, float]:
+    """
+    Percentile bootstrap interval of `sum(numerators) / sum(denominators)`, the
+    samples are resampled with replacement.
+    """
+    rng = np.random.default_rng(seed)
+    indices = rng.integers(0, len(numerators), size=(num_bootstrap, len(numerators)))
+    totals = denominators[indices].sum(axis=1)
+    estimates = numerators[indices].sum(axis=1) / np.where(totals > 0, totals, np.nan)
+    low, high = np.nanpercentile(
+        estimates, [50 * (1 - confidence), 50 * (1 + confidence)]
+    )
+    return float(low), float(high)
@@ -0,0 +1,176 @@
+"""
+Packed image store for the benchmark datasets.
+
+With `packed_images: true` in the benchmark config, the images of each dataset are
+packed into a single `{cache_dir}/{dataset}/images.pack` file:
+
+    [image bytes ...][base64 of the images ...][index json][footer]
+
+The index maps the image path (relative to the dataset dir) to the offsets of its
+bytes and base64 payload, its sha256 and the size and mtime of the loose file it
+was packed from. The file is memory-mapped, `encode_image` and `file_digest` read
+from it instead of opening, reading and encoding every image. Copying the pack and
+the dataset manifest is enough to move a prepared dataset to another machine.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+from collections.abc import Iterable
+from typing import Any
+
+from loguru import logger
+
+PACK_FILE = "images.pack"
+_MAGIC = b"DXIMGPK1"
+_FOOTER = struct.Struct("<Q8s")
+
+# absolute image path -> (store, name), filled by `register_image_store`
+_registry: dict[str, tuple[PackedImageStore, str]] = {}
+_registry_lock = threading.Lock()
+
+
+class PackedImageStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        index_offset, magic = _FOOTER.unpack(self._mmap[-_FOOTER.size :])
+        assert magic == _MAGIC, f"{path} is not an image pack"
+        # name -> [offset, length, b64_offset, b64_length, sha256, size, mtime_ns]
+        self.index: dict[str, list] = json.loads(
+            self._mmap[index_offset : len(self._mmap) - _FOOTER.size]
+        )
+
+    def name(self, image_path: str) -> str:
+        return os.path.relpath(os.path.abspath(image_path), self.root)
+
+    def __contains__(self, image_path: str) -> bool:
+        return self.name(image_path) in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def read(self, name: str) -> bytes:
+        offset, length = self.index[name][:2]
+        return self._mmap[offset : offset + length]
+
+    def read_b64(self, name: str) -> str:
+        b64_offset, b64_length = self.index[name][2:4]
+        return self._mmap[b64_offset : b64_offset + b64_length].decode("ascii")
+
+    def digest(self, name: str) -> str:
+        return self.index[name][4]
+
+    def is_current(self, image_paths: Iterable[str]) -> bool:
+        """
+        True if all `image_paths` are packed and the loose files that still exist
+        did not change since.
+        """
+        for image_path in image_paths:
+            entry = self.index.get(self.name(image_path))
+            if entry is None:
+                return False
+            try:
+                stat = os.stat(image_path)
+            except FileNotFoundError:
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (entry[5], entry[6]):
+                return False
+        return True
+
+    def close(self):
+        self._mmap.close()
+
+    @classmethod
+    def build(cls, dataset_dir: str, image_paths: Iterable[str]) -> PackedImageStore:
+        """
+        Pack the loose `image_paths` into `{dataset_dir}/images.pack`.
+        """
+        path = os.path.join(dataset_dir, PACK_FILE)
+        root = os.path.abspath(dataset_dir)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        b64_tmp_path = f"{path}.{os.getpid()}.b64.tmp"
+        index: dict[str, list[Any]] = {}
+        offset = 0
+        b64_offset = 0
+        with open(tmp_path, "wb") as f, open(b64_tmp_path, "wb") as b64_f:
+            for image_path in dict.fromkeys(image_paths):
+                name = os.path.relpath(os.path.abspath(image_path), root)
+                stat = os.stat(image_path)
+                with open(image_path, "rb") as image_file:
+                    image_bytes = image_file.read()
+                b64 = base64.b64encode(image_bytes)
+                f.write(image_bytes)
+                b64_f.write(b64)
+                index[name] = [
+                    offset,
+                    len(image_bytes),
+                    b64_offset,
+                    len(b64),
+                    hashlib.sha256(image_bytes).hexdigest(),
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                ]
+                offset += len(image_bytes)
+                b64_offset += len(b64)
+            # the base64 section follows the image bytes
+            b64_f.flush()
+            with open(b64_tmp_path, "rb") as b64_in:
+                shutil.copyfileobj(b64_in, f)
+            for entry in index.values():
+                entry[2] += offset
+            index_offset = offset + b64_offset
+            f.write(json.dumps(index).encode())
+            f.write(_FOOTER.pack(index_offset, _MAGIC))
+        os.remove(b64_tmp_path)
+        os.replace(tmp_path, path)
+        return cls(path)
+
+
+def open_image_store(dataset_dir: str) -> PackedImageStore | None:
+    path = os.path.join(dataset_dir, PACK_FILE)
+    if not os.path.exists(path):
+        return None
+    try:
+        return PackedImageStore(path)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable image pack {path}: {e}")
+        return None
+
+
+def register_image_store(store: PackedImageStore):
+    """
+    Serve the images of `store` to `encode_image` and `file_digest`.
+    """
+    with _registry_lock:
+        for name in store.index:
+            _registry[os.path.join(store.root, name)] = (store, name)
+
+
+def lookup_packed_image(image_path: str) -> tuple[PackedImageStore, str] | None:
+    if not _registry:
+        return None
+    return _registry.get(os.path.abspath(image_path))
+
+
+def pack_dataset_images(dataset_dir: str, image_paths: list[str]) -> PackedImageStore:
+    """
+    Open the image pack of a dataset, (re)building it when it is missing or out of
+    date, and register it.
+    """
+    store = open_image_store(dataset_dir)
+    if store is None or not store.is_current(image_paths):
+        if store is not None:
+            store.close()
+        logger.info(f"Packing {len(set(image_paths))} images in {dataset_dir}")
+        store = PackedImageStore.build(dataset_dir, image_paths)
+    register_image_store(store)
+    return store
@@ -1,9 +1,13 @@
 from __future__ import annotations
 
+import numpy as np
+
 from docext.benchmark.vlm_datasets.ds import Prediction
 
 
-def get_classification_metrics(pred_with_gt: list[Prediction]):
+def get_classification_metrics(
+    pred_with_gt: list[Prediction], return_scores: bool = False
+):
     exact_matches = []
     for prediction in pred_with_gt:
         gt = prediction.gt
@@ -23,4 +27,7 @@ def get_classification_metrics(pred_with_gt: list[Prediction]):
         )  # we convert to string to handle numbers
         exact_matches.append(exact_match)
 
-    return sum(exact_matches) / len(exact_matches)
+    metric = sum(exact_matches) / len(exact_matches)
+    if return_scores:
+        return metric, np.array(exact_matches, dtype=bool)
+    return metric
@@ -2,12 +2,20 @@
 from __future__ import annotations
 
 import itertools
+import re
 import xml.etree.ElementTree as ET
 from collections import defaultdict
 from difflib import SequenceMatcher
 
 import numpy as np
 from fitz import Rect
+from pandas.io.formats.format import DataFrameFormatter
+from pandas.io.formats.html import HTMLFormatter
+from pandas.io.formats.printing import pprint_thing
+
+# characters that are not allowed in XML 1.0, `html_to_cells` fails to parse them
+_INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+_SPAN_ATTRIBUTE = re.compile(r'\b(colspan|rowspan)="(\d+)"')
 
 
 def compute_fscore(num_true_positives, num_true, num_positives):
@@ -231,6 +239,185 @@ def lcs_similarity(string1, string2):
     return 2 * len(lcs) / (len(string1) + len(string2))
 
 
+def lcs_similarity_matrix(true_strings, pred_strings):
+    """
+    `lcs_similarity` of every (true, pred) pair as a float array. Each unique pair
+    of strings is compared once, and `SequenceMatcher` keeps the preprocessing of
+    the pred string across the true strings. Equal strings, empty strings and
+    strings without a common character skip the matcher, they give the same
+    values as `lcs_similarity`.
+    """
+    unique_true = list(dict.fromkeys(true_strings))
+    unique_pred = list(dict.fromkeys(pred_strings))
+    true_chars = [set(string) for string in unique_true]
+    similarities = np.empty((len(unique_true), len(unique_pred)))
+    matcher = SequenceMatcher(None)
+    for pred_idx, pred_string in enumerate(unique_pred):
+        matcher.set_seq2(pred_string)
+        pred_chars = set(pred_string)
+        for true_idx, true_string in enumerate(unique_true):
+            if true_string == pred_string:
+                similarity = 1.0
+            elif true_chars[true_idx].isdisjoint(pred_chars):
+                # also covers a single empty string, there is no matching block
+                similarity = 0.0
+            else:
+                matcher.set_seq1(true_string)
+                num_matching = sum(
+                    block.size for block in matcher.get_matching_blocks()
+                )
+                similarity = 2 * num_matching / (len(true_string) + len(pred_string))
+            similarities[true_idx, pred_idx] = similarity
+    true_ids = {string: idx for idx, string in enumerate(unique_true)}
+    pred_ids = {string: idx for idx, string in enumerate(unique_pred)}
+    return similarities[
+        np.ix_(
+            [true_ids[string] for string in true_strings],
+            [pred_ids[string] for string in pred_strings],
+        )
+    ]
+
+
+def lcs_similarity_pairs(true_strings, pred_strings):
+    """
+    `lcs_similarity` of each (true_strings[i], pred_strings[i]) pair as a float
+    array, with the same shortcuts as `lcs_similarity_matrix`.
+    """
+    scored = {}
+    similarities = np.empty(len(true_strings))
+    order = sorted(range(len(pred_strings)), key=lambda i: pred_strings[i])
+    matcher = SequenceMatcher(None)
+    current_pred = None
+    # grouped by pred string, the matcher keeps its preprocessing
+    for i in order:
+        pair = (true_strings[i], pred_strings[i])
+        similarity = scored.get(pair)
+        if similarity is None:
+            true_string, pred_string = pair
+            if true_string == pred_string:
+                similarity = 1.0
+            elif set(true_string).isdisjoint(pred_string):
+                similarity = 0.0
+            else:
+                if pred_string != current_pred:
+                    matcher.set_seq2(pred_string)
+                    current_pred = pred_string
+                matcher.set_seq1(true_string)
+                num_matching = sum(
+                    block.size for block in matcher.get_matching_blocks()
+                )
+                similarity = 2 * num_matching / (len(true_string) + len(pred_string))
+            scored[pair] = similarity
+        similarities[i] = similarity
+    return similarities
+
+
+def lcs_similarity_upper_bound(true_lengths, pred_lengths):
+    """
+    Upper bound of `lcs_similarity` from the string lengths only: the common
+    subsequence is at most as long as the shorter string.
+    """
+    total = true_lengths + pred_lengths
+    shorter = np.minimum(true_lengths, pred_lengths)
+    return np.where(total > 0, 2 * shorter / np.maximum(total, 1), 1.0)
+
+
+def band_mask(true_length, pred_length, band_width):
+    """
+    Boolean [true_index, pred_index] mask of the index pairs within `band_width`
+    of the diagonal, the diagonal is scaled when the lengths differ.
+    """
+    scale = (pred_length - 1) / (true_length - 1) if true_length > 1 else 0.0
+    true_indices = np.arange(true_length)[:, None]
+    pred_indices = np.arange(pred_length)[None, :]
+    return np.abs(pred_indices - true_indices * scale) <= band_width
+
+
+def align_dp(rewards, return_pointers=False):
+    """
+    Vectorized `align_1d` over the last two axes of `rewards`, the leading axes
+    are independent alignments computed together. The cells of an anti-diagonal
+    do not depend on each other, so the table is filled one anti-diagonal at a
+    time. Returns the DP score tables, and the traceback pointers (same
+    convention and tie-breaking as `align_1d`) with `return_pointers`.
+    """
+    *batch_shape, sequence1_length, sequence2_length = rewards.shape
+    scores = np.zeros((*batch_shape, sequence1_length + 1, sequence2_length + 1))
+    if return_pointers:
+        pointers = np.zeros(scores.shape)
+        pointers[..., 1:, 0] = -1
+        pointers[..., 0, 1:] = 1
+    for diagonal in range(2, sequence1_length + sequence2_length + 1):
+        seq1_idx = np.arange(
+            max(1, diagonal - sequence2_length), min(sequence1_length, diagonal - 1) + 1
+        )
+        seq2_idx = diagonal - seq1_idx
+        diag_score = (
+            scores[..., seq1_idx - 1, seq2_idx - 1]
+            + rewards[..., seq1_idx - 1, seq2_idx - 1]
+        )
+        skip_seq2_score = scores[..., seq1_idx, seq2_idx - 1]
+        skip_seq1_score = scores[..., seq1_idx - 1, seq2_idx]
+        max_score = np.maximum(np.maximum(diag_score, skip_seq1_score), skip_seq2_score)
+        scores[..., seq1_idx, seq2_idx] = max_score
+        if return_pointers:
+            pointers[..., seq1_idx, seq2_idx] = np.where(
+                diag_score == max_score,
+                0,
+                np.where(skip_seq1_score == max_score, -1, 1),
+            )
+    if return_pointers:
+        return scores, pointers
+    return scores
+
+
+def align_2d_outer_fast(rewards):
+    """
+    `align_2d_outer` on a reward tensor indexed as [trow, tcol, prow, pcol]. All
+    the inner row alignments are computed in one batch.
+    """
+    # inner alignment of true row i with pred row j over the columns
+    inner_scores = align_dp(rewards.transpose(0, 2, 1, 3))[..., -1, -1]
+    scores, pointers = align_dp(inner_scores, return_pointers=True)
+    aligned_true_indices, aligned_pred_indices = traceback(pointers)
+    return aligned_true_indices, aligned_pred_indices, scores[-1, -1]
+
+
+def factored_2dmss_fast(rewards):
+    """
+    `factored_2dmss` on a precomputed reward tensor indexed as
+    [trow, tcol, prow, pcol], eg: from `lcs_similarity_matrix`.
+    """
+    true_shape = rewards.shape[:2]
+    pred_shape = rewards.shape[2:]
+    num_pos = pred_shape[0] * pred_shape[1]
+    num_true = true_shape[0] * true_shape[1]
+
+    true_row_nums, pred_row_nums, row_pos_match_score = align_2d_outer_fast(rewards)
+    true_column_nums, pred_column_nums, col_pos_match_score = align_2d_outer_fast(
+        rewards.transpose(1, 0, 3, 2)
+    )
+
+    pos_match_score_upper_bound = min(row_pos_match_score, col_pos_match_score)
+    upper_bound_score, _, _ = compute_fscore(
+        pos_match_score_upper_bound, num_pos, num_true
+    )
+
+    # summed in the same order as `factored_2dmss`, the score is bit-identical
+    matched_rewards = rewards[
+        np.ix_(true_row_nums, true_column_nums, pred_row_nums, pred_column_nums)
+    ]
+    positive_match_score = sum(
+        matched_rewards[i, j, i, j]
+        for i in range(len(true_row_nums))
+        for j in range(len(true_column_nums))
+    )
+
+    fscore, precision, recall = compute_fscore(positive_match_score, num_true, num_pos)
+
+    return fscore, precision, recall, upper_bound_score
+
+
 def iou(bbox1, bbox2):
     """
     Compute the intersection-over-union of two bounding boxes.
@@ -438,12 +625,72 @@ def grits_loc(true_bbox_grid, pred_bbox_grid):
 def grits_con(true_text_grid, pred_text_grid):
     """
     Compute GriTS_Con given two matrices of cell text strings.
+
+    Reference implementation, `grits_con_fast` gives identical scores.
     """
     return factored_2dmss(
         true_text_grid, pred_text_grid, reward_function=lcs_similarity
     )
 
 
+def grits_con_fast(true_text_grid, pred_text_grid):
+    """
+    Compute GriTS_Con given two matrices of cell text strings, with a reward
+    tensor and the vectorized DP.
+    """
+    similarities = lcs_similarity_matrix(
+        true_text_grid.ravel().tolist(), pred_text_grid.ravel().tolist()
+    )
+    rewards = similarities.reshape(true_text_grid.shape + pred_text_grid.shape)
+    return factored_2dmss_fast(rewards)
+
+
+def grits_con_banded(true_text_grid, pred_text_grid, band_width):
+    """
+    Approximate GriTS_Con for large tables. Only the cells whose row pair and
+    column pair are both within `band_width` of the diagonal are compared, the
+    other rewards are 0 for the alignment. The returned `upper_bound_score` is
+    computed with the length bound of `lcs_similarity` outside of the band, the
+    exact GriTS_Con is at most this value.
+    """
+    true_shape = true_text_grid.shape
+    pred_shape = pred_text_grid.shape
+    if min(true_shape + pred_shape) == 0:
+        return grits_con_fast(true_text_grid, pred_text_grid)
+    in_band = (
+        band_mask(true_shape[0], pred_shape[0], band_width)[:, None, :, None]
+        & band_mask(true_shape[1], pred_shape[1], band_width)[None, :, None, :]
+    )
+    true_rows, true_columns, pred_rows, pred_columns = np.nonzero(in_band)
+    rewards = np.zeros(in_band.shape)
+    rewards[in_band] = lcs_similarity_pairs(
+        true_text_grid[true_rows, true_columns].tolist(),
+        pred_text_grid[pred_rows, pred_columns].tolist(),
+    )
+    fscore, precision, recall, _ = factored_2dmss_fast(rewards)
+
+    true_lengths = np.fromiter(map(len, true_text_grid.ravel()), dtype=np.int64)
+    pred_lengths = np.fromiter(map(len, pred_text_grid.ravel()), dtype=np.int64)
+    upper_bound_rewards = np.where(
+        in_band,
+        rewards,
+        lcs_similarity_upper_bound(
+            true_lengths.reshape(true_shape)[:, :, None, None],
+            pred_lengths.reshape(pred_shape)[None, None, :, :],
+        ),
+    )
+    _, _, row_pos_match_score = align_2d_outer_fast(upper_bound_rewards)
+    _, _, col_pos_match_score = align_2d_outer_fast(
+        upper_bound_rewards.transpose(1, 0, 3, 2)
+    )
+    upper_bound_score, _, _ = compute_fscore(
+        min(row_pos_match_score, col_pos_match_score),
+        pred_shape[0] * pred_shape[1],
+        true_shape[0] * true_shape[1],
+    )
+    return fscore, precision, recall, upper_bound_score
+
+
 def html_to_cells(table_html):
     """
     Parse an HTML representation of a table into a list of cells.
@@ -507,37 +754,141 @@ def html_to_cells(table_html):
     return table_cells
 
 
-def grits_from_html(true_html, pred_html):
+class _CellCapture(HTMLFormatter):
     """
-    Compute GriTS_Con and GriTS_Top for two HTML sequences.
+    Runs the layout of `DataFrame.to_html` and records the text and the spans of
+    each cell instead of writing the markup.
     """
 
-    # Convert HTML to list of cells
-    true_cells = html_to_cells(true_html)
-    pred_cells = html_to_cells(pred_html)
+    def __init__(self, formatter):
+        super().__init__(formatter)
+        self.rows = []
+
+    def write_tr(self, line, *args, **kwargs):
+        self.rows.append([])
+        super().write_tr(line, *args, **kwargs)
+
+    def _write_cell(self, s, kind="td", indent=0, tags=None):
+        spans = dict(_SPAN_ATTRIBUTE.findall(tags or ""))
+        # the text as parsed back from the escaped markup
+        text = pprint_thing(s, escape_chars={}).strip()
+        self.rows[-1].append(
+            (
+                text,
+                int(spans.get("colspan", 1)),
+                int(spans.get("rowspan", 1)),
+                kind == "th",
+            )
+        )
 
+
+def rows_to_cells(rows):
+    """
+    Place the `(text, colspan, rowspan, is_header)` cells of each table row on the
+    grid, the same way as `html_to_cells`.
+    """
+    table_cells = []
+    occupied_columns_by_row = defaultdict(set)
+    for current_row, row in enumerate(rows):
+        for cell_text, colspan, rowspan, is_header in row:
+            row_nums = list(range(current_row, current_row + rowspan))
+            if occupied_columns_by_row[current_row]:
+                max_occupied_column = max(occupied_columns_by_row[current_row])
+                current_column = min(
+                    set(range(max_occupied_column + 2)).difference(
+                        occupied_columns_by_row[current_row]
+                    )
+                )
+            else:
+                current_column = 0
+            column_nums = list(range(current_column, current_column + colspan))
+            for row_num in row_nums:
+                occupied_columns_by_row[row_num].update(column_nums)
+            table_cells.append(
+                {
+                    "row_nums": row_nums,
+                    "column_nums": column_nums,
+                    "is_column_header": is_header,
+                    "cell_text": cell_text,
+                }
+            )
+    return table_cells
+
+
+def df_to_cells(df):
+    """
+    The cells of `html_to_cells(df.to_html())` without rendering and parsing the
+    HTML. Returns None if the cell texts would not survive the XML round trip
+    unchanged, the caller then falls back to the HTML path.
+    """
+    # the defaults of `DataFrame.to_html`
+    capture = _CellCapture(DataFrameFormatter(df, bold_rows=True, escape=True))
+    capture.render()
+    rows = []
+    for row in capture.rows:
+        cells = []
+        for text, colspan, rowspan, is_header in row:
+            if _INVALID_XML_CHARS.search(text):
+                return None
+            # XML parsers normalize the line endings
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+            cells.append((text, colspan, rowspan, is_header))
+        rows.append(cells)
+    return rows_to_cells(rows)
+
+
+def grits_from_cells(
+    true_cells, pred_cells, reference=False, band_width=None, return_upper_bound=False
+):
+    """
+    Compute GriTS_Con for two lists of cells. With `band_width`, use the banded
+    approximation, see `grits_con_banded`. With `return_upper_bound`, return
+    `(fscore, upper_bound_score)`.
+    """
     # Convert lists of cells to matrices of grid cells
     true_text_grid = np.array(cells_to_grid(true_cells, key="cell_text"), dtype=object)
     pred_text_grid = np.array(cells_to_grid(pred_cells, key="cell_text"), dtype=object)
 
     # Compute GriTS_Con (text content)  for ground truth and predicted matrices
-    fscore, _, _, _ = grits_con(true_text_grid, pred_text_grid)
+    if reference:
+        fscore, _, _, upper_bound_score = grits_con(true_text_grid, pred_text_grid)
+    elif band_width is not None:
+        fscore, _, _, upper_bound_score = grits_con_banded(
+            true_text_grid, pred_text_grid, band_width
+        )
+    else:
+        fscore, _, _, upper_bound_score = grits_con_fast(true_text_grid, pred_text_grid)
+    if return_upper_bound:
+        return fscore, upper_bound_score
     return fscore
 
 
-def grits_from_df(true_df, pred_df):
+def grits_from_html(true_html, pred_html, reference=False, **kwargs):
     """
-    Compute GriTS_Con and GriTS_Top for two dataframes.
+    Compute GriTS_Con and GriTS_Top for two HTML sequences. With `reference`, use
+    the original (slow) implementation.
     """
-    return grits_from_html(true_df.to_html(), pred_df.to_html())
 
-
-if __name__ == "__main__":
-    import pandas as pd
-
-    true_df = pd.DataFrame(np.random.randint(0, 4, size=(2, 2)))
-    pred_df = pd.DataFrame(np.random.randint(0, 4, size=(2, 2)))
-    print(true_df.to_string())
-    print("-" * 100)
-    print(pred_df.to_string())
-    print(grits_from_df(true_df, pred_df))
+    # Convert HTML to list of cells
+    true_cells = html_to_cells(true_html)
+    pred_cells = html_to_cells(pred_html)
+    return grits_from_cells(true_cells, pred_cells, reference=reference, **kwargs)
+
+
+def grits_from_df(true_df, pred_df, reference=False, **kwargs):
+    """
+    Compute GriTS_Con and GriTS_Top for two dataframes. The cells are built from
+    the dataframes directly, with the same layout as their `to_html`. The keyword
+    arguments are passed to `grits_from_cells`.
+    """
+    if reference:
+        return grits_from_html(
+            true_df.to_html(), pred_df.to_html(), reference=True, **kwargs
+        )
+    true_cells = df_to_cells(true_df)
+    if true_cells is None:
+        true_cells = html_to_cells(true_df.to_html())
+    pred_cells = df_to_cells(pred_df)
+    if pred_cells is None:
+        pred_cells = html_to_cells(pred_df.to_html())
+    return grits_from_cells(true_cells, pred_cells, **kwargs)
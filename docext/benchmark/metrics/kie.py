@@ -2,31 +2,35 @@ from __future__ import annotations
 
 from typing import List
 
-from Levenshtein import distance as edit_distance
-from tqdm import tqdm
-
+from docext.benchmark.metrics.similarity import normalized_similarities
 from docext.benchmark.vlm_datasets.ds import Prediction
 
 
-def get_kie_metrics(predictions: list[Prediction]):
+def _pred_values_by_label(prediction: Prediction) -> dict[str, str]:
+    # the first predicted field of a label wins, as in `_get_pred_field_by_label`
+    values: dict[str, str] = {}
+    if prediction.pred is None or prediction.pred.fields is None:
+        return values
+    for pred_field in prediction.pred.fields:
+        values.setdefault(pred_field.label, str(pred_field.value))
+    return values
+
+
+def get_kie_metrics(predictions: list[Prediction], return_scores: bool = False):
     """
-    Get the metrics for the predictions.
+    Get the metrics for the predictions. With `return_scores`, also return the
+    score of every ground truth field, in the order of the predictions.
     """
-    edit_distances = []
-    for pred in tqdm(predictions, desc="Computing KIE metrics", leave=False):
-        gt_fields = pred.gt.fields
-        for gt_field in gt_fields:
-            pred_field = pred._get_pred_field_by_label(gt_field.label)
-            if pred_field is None or pred_field == "":
-                pred_value = ""
-            else:
-                pred_value = pred_field.value
-            pred_value = str(pred_value)
-            gt_value = str(gt_field.value)
-            dist = edit_distance(pred_value, gt_value)
-            max_len = max(len(pred_value), len(gt_value))
-            if max_len == 0:
-                edit_distances.append(1.0)
-            else:
-                edit_distances.append(1 - (dist / max_len))
-    return sum(edit_distances) / len(edit_distances)
+    pred_values = []
+    gt_values = []
+    for pred in predictions:
+        assert pred.gt is not None and pred.gt.fields is not None
+        values_by_label = _pred_values_by_label(pred)
+        for gt_field in pred.gt.fields:
+            pred_values.append(values_by_label.get(gt_field.label, ""))
+            gt_values.append(str(gt_field.value))
+    scores = normalized_similarities(pred_values, gt_values)
+    metric = float(scores.sum()) / len(scores)
+    if return_scores:
+        return metric, scores
+    return metric
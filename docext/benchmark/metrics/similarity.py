@@ -0,0 +1,70 @@
+"""
+Batch normalized Levenshtein similarity for the string metrics.
+
+The metrics collect all their (prediction, ground truth) string pairs and score
+them in one call. With `rapidfuzz` installed (`pip install docext[benchmark]`) the
+pairs are scored natively on all cores, otherwise the unique pairs are scored with
+`Levenshtein`.
+"""
+from __future__ import annotations
+
+import numpy as np
+from Levenshtein import distance as edit_distance
+
+try:
+    from rapidfuzz.distance import Levenshtein as rf_levenshtein
+    from rapidfuzz.process import cpdist
+
+    HAS_RAPIDFUZZ = True
+except ImportError:
+    HAS_RAPIDFUZZ = False
+
+
+def normalized_similarities(preds: list[str], gts: list[str]) -> np.ndarray:
+    """
+    `1 - edit_distance / max(len(pred), len(gt))` of each pair, 1.0 when both
+    strings are empty.
+    """
+    assert len(preds) == len(gts), "preds and gts must have the same length"
+    if len(preds) == 0:
+        return np.zeros(0, dtype=np.float64)
+    if HAS_RAPIDFUZZ:
+        return cpdist(
+            preds,
+            gts,
+            scorer=rf_levenshtein.normalized_similarity,
+            dtype=np.float64,
+            workers=-1,
+        )
+
+    # empty answers and repeated values are common, score each pair once
+    scored: dict[tuple[str, str], float] = {}
+    similarities = np.empty(len(preds), dtype=np.float64)
+    for i, pair in enumerate(zip(preds, gts)):
+        similarity = scored.get(pair)
+        if similarity is None:
+            pred, gt = pair
+            max_len = max(len(pred), len(gt))
+            similarity = 1 - edit_distance(pred, gt) / max_len if max_len > 0 else 1.0
+            scored[pair] = similarity
+        similarities[i] = similarity
+    return similarities
+
+
+def best_similarities(
+    preds: list[str], gts: list[list[str]], default: float = 0.0
+) -> np.ndarray:
+    """
+    Best similarity of each prediction to any of its ground truths, `default`
+    when a prediction has no ground truth.
+    """
+    counts = np.fromiter((len(answers) for answers in gts), dtype=np.int64)
+    flat_preds = [pred for pred, answers in zip(preds, gts) for _ in answers]
+    flat_gts = [answer for answers in gts for answer in answers]
+    similarities = normalized_similarities(flat_preds, flat_gts)
+    best = np.full(len(preds), default, dtype=np.float64)
+    has_answers = counts > 0
+    if has_answers.any():
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[has_answers]
+        best[has_answers] = np.maximum.reduceat(similarities, starts)
+    return best
@@ -1,13 +1,25 @@
 from __future__ import annotations
 
 import numpy as np
+from loguru import logger
 
 from docext.benchmark.metrics.grits import grits_from_df
 from docext.benchmark.vlm_datasets.ds import Prediction
 
+GRITS_MODES = ["exact", "banded"]
 
-def get_table_metrics(pred_with_gt: list[Prediction]):
+
+def get_table_scores(
+    pred_with_gt: list[Prediction], grits_config: dict | None = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    GriTS_Con and the upper bound of the exact GriTS_Con of every table. With
+    `grits_config={"mode": "banded", "band_width": 8}` the banded approximation is
+    used.
+    """
+    band_width = _get_band_width(grits_config)
     metrics_list = []
+    upper_bounds = []
     for prediction in pred_with_gt:
         gt = prediction.gt
         pred = prediction.pred
@@ -17,6 +29,39 @@ def get_table_metrics(pred_with_gt: list[Prediction]):
         pred_answer = (
             pred.tables[0].table if pred is not None and pred.tables is not None else ""
         )
-        metrics = grits_from_df(gt_answer, pred_answer)
+        metrics, upper_bound = grits_from_df(
+            gt_answer, pred_answer, band_width=band_width, return_upper_bound=True
+        )
         metrics_list.append(metrics)
-    return np.mean(metrics_list)
+        upper_bounds.append(upper_bound)
+    return np.array(metrics_list, dtype=np.float64), np.array(
+        upper_bounds, dtype=np.float64
+    )
+
+
+def summarize_table_scores(
+    scores: np.ndarray, upper_bounds: np.ndarray, grits_config: dict | None = None
+):
+    """
+    Mean GriTS_Con, the mean upper bound of the exact score is logged in the
+    banded mode.
+    """
+    band_width = _get_band_width(grits_config)
+    if band_width is not None and len(scores) > 0:
+        logger.info(
+            f"Banded GriTS (band_width={band_width}): {np.mean(scores):.4f}, "
+            f"the exact score is at most {np.mean(upper_bounds):.4f}"
+        )
+    return np.mean(scores)
+
+
+def get_table_metrics(pred_with_gt: list[Prediction], grits_config: dict | None = None):
+    scores, upper_bounds = get_table_scores(pred_with_gt, grits_config)
+    return summarize_table_scores(scores, upper_bounds, grits_config)
+
+
+def _get_band_width(grits_config: dict | None):
+    grits_config = grits_config or {}
+    mode = grits_config.get("mode", "exact")
+    assert mode in GRITS_MODES, f"grits mode must be one of {GRITS_MODES}"
+    return grits_config.get("band_width", 8) if mode == "banded" else None
@@ -2,13 +2,18 @@ from __future__ import annotations
 
 from typing import List
 
-from Levenshtein import distance as edit_distance
-
+from docext.benchmark.metrics.similarity import best_similarities
+from docext.benchmark.metrics.similarity import normalized_similarities
 from docext.benchmark.vlm_datasets.ds import Prediction
 
 
-def get_vqa_metrics(pred_with_gt: list[Prediction], strip_page: bool = False):
-    exact_matches = []
+def get_vqa_metrics(
+    pred_with_gt: list[Prediction],
+    strip_page: bool = False,
+    return_scores: bool = False,
+):
+    pred_answers = []
+    gt_answers = []
     for prediction in pred_with_gt:
         gt = prediction.gt
         pred = prediction.pred
@@ -22,19 +27,21 @@ def get_vqa_metrics(pred_with_gt: list[Prediction], strip_page: bool = False):
         # exact_match = str(gt_answer) == str(
         #     pred_answer
         # )  # we convert to string to handle numbers
-        # exact_matches.append(exact_match)
-        dist = edit_distance(pred_answer, gt_answer)
-        max_len = max(len(pred_answer), len(gt_answer))
-        if max_len == 0:
-            exact_matches.append(1.0)
-        else:
-            exact_matches.append(1 - (dist / max_len))
+        pred_answers.append(pred_answer)
+        gt_answers.append(gt_answer)
 
-    return sum(exact_matches) / len(exact_matches)
+    scores = normalized_similarities(pred_answers, gt_answers)
+    metric = float(scores.sum()) / len(scores)
+    if return_scores:
+        return metric, scores
+    return metric
 
 
-def get_vqa__metric_for_multiple_possible_answers(pred_with_gt: list[Prediction]):
-    exact_matches = []
+def get_vqa__metric_for_multiple_possible_answers(
+    pred_with_gt: list[Prediction], return_scores: bool = False
+):
+    pred_answers = []
+    all_gt_answers = []
     for prediction in pred_with_gt:
         gt = prediction.gt
         pred = prediction.pred
@@ -44,15 +51,12 @@ def get_vqa__metric_for_multiple_possible_answers(pred_with_gt: list[Prediction]
         gt_answers = gt.vqa.answer if gt is not None and gt.vqa is not None else ""
         if not isinstance(gt_answers, list):
             gt_answers = [gt_answers]
-
-        best_match = 0.0
-        for gt_answer in gt_answers:
-            gt_answer = str(gt_answer)
-            dist = edit_distance(pred_answer, gt_answer)
-            max_len = max(len(pred_answer), len(gt_answer))
-            if max_len == 0:
-                best_match = 1.0
-            else:
-                best_match = max(best_match, 1 - (dist / max_len))
-        exact_matches.append(best_match)
-    return sum(exact_matches) / len(exact_matches)
+        pred_answers.append(pred_answer)
+        all_gt_answers.append([str(gt_answer) for gt_answer in gt_answers])
+
+    # the best match over the possible answers of each question
+    scores = best_similarities(pred_answers, all_gt_answers)
+    metric = float(scores.sum()) / len(scores)
+    if return_scores:
+        return metric, scores
+    return metric
@@ -0,0 +1,201 @@
+"""
+Latency and throughput of the benchmark requests.
+
+Every response fetched from a model is cached with a `performance` entry:
+
+    {"latency_s": 3.2, "ttft_s": 0.4, "started_at": ..., "finished_at": ...}
+
+`ttft_s` (time to first token) is only measured for the models configured with
+`stream: true`, the token counts are read from the `usage` of the response. The
+responses of a run are collected in `PerformanceStats`, which writes:
+
+    performance.csv     p50/p95 latency and TTFT, output tokens/s and throughput
+                        per (model, dataset)
+    pareto_latency.csv  average accuracy vs p50 latency of each model
+    pareto_cost.csv     average accuracy vs average cost of each model
+
+The throughput columns only count the requests sent during the run, the cached
+responses of earlier runs have latencies but were not sent at the configured
+concurrency.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+PERFORMANCE_COLUMNS = [
+    "model",
+    "dataset",
+    "concurrency",
+    "requests",
+    "timed_requests",
+    "latency_p50_s",
+    "latency_p95_s",
+    "ttft_p50_s",
+    "ttft_p95_s",
+    "input_tokens_mean",
+    "output_tokens_mean",
+    "output_tokens_per_s_p50",
+    "run_requests",
+    "throughput_requests_per_s",
+    "throughput_output_tokens_per_s",
+]
+
+
+def response_performance(started_at: float, latency: float, ttft: float | None):
+    return {
+        "latency_s": latency,
+        "ttft_s": ttft,
+        "started_at": started_at,
+        "finished_at": started_at + latency,
+    }
+
+
+class PerformanceStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.records: list[dict[str, Any]] = []
+
+    def record(self, dataset_name: str, model_name: str, response: dict | None):
+        if response is None:
+            return
+        performance = response.get("performance") or {}
+        usage = response.get("usage") or {}
+        record = {
+            "model": model_name,
+            "dataset": dataset_name,
+            "latency_s": performance.get("latency_s"),
+            "ttft_s": performance.get("ttft_s"),
+            "started_at": performance.get("started_at"),
+            "finished_at": performance.get("finished_at"),
+            "input_tokens": usage.get("prompt_tokens"),
+            "output_tokens": usage.get("completion_tokens"),
+        }
+        with self._lock:
+            self.records.append(record)
+
+    def records_for(self, dataset_name: str, model_name: str) -> list[dict]:
+        with self._lock:
+            return [
+                record
+                for record in self.records
+                if record["dataset"] == dataset_name and record["model"] == model_name
+            ]
+
+    def add_records(self, records: list[dict[str, Any]]):
+        """
+        Add the records of earlier runs, eg: from the results store.
+        """
+        with self._lock:
+            self.records.extend(records)
+
+    def to_dataframe(self, concurrency: dict[str, int] | None = None):
+        """
+        Latency and throughput per (model, dataset), `concurrency` maps the models
+        to the number of requests they were sent with in parallel.
+        """
+        concurrency = concurrency or {}
+        df = pd.DataFrame(
+            self.records,
+            columns=[
+                "model",
+                "dataset",
+                "latency_s",
+                "ttft_s",
+                "started_at",
+                "finished_at",
+                "input_tokens",
+                "output_tokens",
+            ],
+        ).astype(
+            {
+                column: np.float64
+                for column in [
+                    "latency_s",
+                    "ttft_s",
+                    "started_at",
+                    "finished_at",
+                    "input_tokens",
+                    "output_tokens",
+                ]
+            }
+        )
+        # decoding speed, without the time to first token when it is known
+        decode_time = df["latency_s"] - df["ttft_s"].fillna(0.0)
+        df["output_tokens_per_s"] = df["output_tokens"] / decode_time.where(
+            decode_time > 0
+        )
+
+        rows = []
+        for (model_name, dataset_name), group in df.groupby(
+            ["model", "dataset"], sort=True
+        ):
+            run = group[group["started_at"] >= self.started_at]
+            window = run["finished_at"].max() - run["started_at"].min()
+            has_window = len(run) > 0 and window > 0
+            rows.append(
+                {
+                    "model": model_name,
+                    "dataset": dataset_name,
+                    "concurrency": concurrency.get(model_name),
+                    "requests": len(group),
+                    "timed_requests": int(group["latency_s"].notna().sum()),
+                    "latency_p50_s": group["latency_s"].quantile(0.5),
+                    "latency_p95_s": group["latency_s"].quantile(0.95),
+                    "ttft_p50_s": group["ttft_s"].quantile(0.5),
+                    "ttft_p95_s": group["ttft_s"].quantile(0.95),
+                    "input_tokens_mean": group["input_tokens"].mean(),
+                    "output_tokens_mean": group["output_tokens"].mean(),
+                    "output_tokens_per_s_p50": group["output_tokens_per_s"].quantile(
+                        0.5
+                    ),
+                    "run_requests": len(run),
+                    "throughput_requests_per_s": len(run) / window
+                    if has_window
+                    else np.nan,
+                    "throughput_output_tokens_per_s": run["output_tokens"].sum()
+                    / window
+                    if has_window
+                    else np.nan,
+                }
+            )
+        return pd.DataFrame(rows, columns=PERFORMANCE_COLUMNS)
+
+    def model_latencies(self) -> pd.Series:
+        """
+        p50 latency of each model over all its requests.
+        """
+        df = pd.DataFrame(self.records, columns=["model", "latency_s"])
+        return (
+            df.astype({"latency_s": np.float64})
+            .groupby("model")["latency_s"]
+            .quantile(0.5)
+        )
+
+
+def pareto_table(accuracy: pd.Series, cost: pd.Series, cost_name: str):
+    """
+    Accuracy against a cost (latency, price) per model, sorted by cost. A model is
+    `pareto_optimal` when no other model is at least as accurate for less.
+    """
+    df = pd.DataFrame({"accuracy": accuracy, cost_name: cost})
+    df.index.name = "model"
+    df = df.sort_values(by=[cost_name, "accuracy"], ascending=[True, False])
+    pareto_optimal = []
+    best_accuracy = -np.inf
+    for accuracy_value, cost_value in zip(df["accuracy"], df[cost_name]):
+        is_optimal = (
+            not np.isnan(cost_value)
+            and not np.isnan(accuracy_value)
+            and accuracy_value > best_accuracy
+        )
+        if is_optimal:
+            best_accuracy = accuracy_value
+        pareto_optimal.append(is_optimal)
+    df["pareto_optimal"] = pareto_optimal
+    return df
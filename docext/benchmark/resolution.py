@@ -0,0 +1,126 @@
+"""
+Image resolutions of the resolution sweep.
+
+The sweep reruns the selected datasets with the images downscaled to a longest side
+(`sizes`) or to a number of pixels (`pixel_budgets`), see `resolution_sweep` in
+the benchmark config:
+
+    resolution_sweep:
+      datasets: [nanonets_kie, chartqa]
+      sizes: [512, 768, 1024, 1536]
+      pixel_budgets: [262144, 1048576]
+
+The images are resized when the messages are built, the prepared datasets are
+reused as is. Images are never upscaled, and the resolution is part of the cache
+key of every request.
+"""
+from __future__ import annotations
+
+import base64
+import io
+import math
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
+
+from PIL import Image
+
+from docext.benchmark.tasks import get_image_encoding_type
+from docext.benchmark.utils import encode_image
+from docext.benchmark.utils import file_digest
+
+
+@dataclass(frozen=True)
+class Resolution:
+    max_size: int | None = None
+    max_pixels: int | None = None
+
+    @property
+    def tag(self) -> str:
+        if self.max_size is not None:
+            return f"max_size={self.max_size}"
+        return f"max_pixels={self.max_pixels}"
+
+    def target_size(self, width: int, height: int) -> tuple[int, int]:
+        """
+        Size of a `width` x `height` image at this resolution, the aspect ratio is
+        kept and the image is not upscaled.
+        """
+        if self.max_size is not None:
+            scale = self.max_size / max(width, height)
+        else:
+            assert (
+                self.max_pixels is not None
+            ), "Resolution needs max_size or max_pixels"
+            scale = math.sqrt(self.max_pixels / (width * height))
+        if scale >= 1:
+            return width, height
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def get_resolutions(sweep_config: dict[str, Any]) -> list[Resolution]:
+    resolutions = [
+        Resolution(max_size=size) for size in sweep_config.get("sizes", None) or []
+    ] + [
+        Resolution(max_pixels=pixels)
+        for pixels in sweep_config.get("pixel_budgets", None) or []
+    ]
+    assert len(resolutions) > 0, "resolution_sweep needs sizes or pixel_budgets"
+    for resolution in resolutions:
+        limit = resolution.max_size or resolution.max_pixels
+        assert limit is not None and limit > 0, f"{resolution.tag} must be positive"
+    return resolutions
+
+
+def image_size(image_path: str, resolution: Resolution) -> tuple[int, int]:
+    # only the header is read
+    with Image.open(image_path) as image:
+        return resolution.target_size(*image.size)
+
+
+def encode_resized_image(image_path: str, resolution: Resolution) -> str:
+    """
+    Base64 of the image at `resolution`, the original encoding when it is already
+    small enough.
+    """
+    with Image.open(image_path) as image:
+        size = resolution.target_size(*image.size)
+        if size == image.size:
+            return encode_image(image_path)
+        image_format = image.format
+        resized = image.resize(size, Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    if image_format == "JPEG":
+        resized.convert("RGB").save(buffer, format="JPEG", quality=95)
+    else:
+        resized.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def get_resized_image_url(resolution: Resolution) -> Callable[[str], str]:
+    """
+    `image_url` of the message builders for the images at `resolution`.
+    """
+
+    def image_url(image_path: str) -> str:
+        return (
+            f"{get_image_encoding_type(image_path)},"
+            f"{encode_resized_image(image_path, resolution)}"
+        )
+
+    return image_url
+
+
+def get_resized_image_digest_url(resolution: Resolution) -> Callable[[str], str]:
+    """
+    Stand-in for `get_resized_image_url` used to build the cache keys, the
+    resolution is part of the key.
+    """
+
+    def image_url(image_path: str) -> str:
+        return (
+            f"{get_image_encoding_type(image_path)},"
+            f"sha256:{file_digest(image_path)}@{resolution.tag}"
+        )
+
+    return image_url
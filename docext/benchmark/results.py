@@ -0,0 +1,120 @@
+"""
+Results store of the benchmark.
+
+The score, the average cost and the request timings of every (dataset, model) pair
+are stored in `{cache_dir}/results.db`, under a key that hashes everything the
+score depends on:
+
+    the model name and config, the dataset manifest (see `manifest_hash`), the
+    rendered template config, the GriTS and early stopping configs and
+    `METRIC_VERSION`
+
+`run_benchmark` only runs the pairs without a stored result for their current key,
+eg: after adding a model to the config, and merges the stored results of the
+other pairs into the reports. Pairs with failed requests are not stored, they are
+run again next time. Set `incremental: false` to run all the pairs.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from docext.benchmark.scoring import METRIC_VERSION
+
+RESULTS_FILE = "results.db"
+
+
+def result_key(**components: Any) -> str:
+    return hashlib.sha256(
+        json.dumps(
+            {"metric_version": METRIC_VERSION, **components},
+            sort_keys=True,
+            default=str,
+        ).encode()
+    ).hexdigest()
+
+
+class ResultsStore:
+    def __init__(self, db_path: str, timeout: float = 60.0):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(
+            db_path, timeout=timeout, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                dataset TEXT NOT NULL,
+                model TEXT NOT NULL,
+                result_key TEXT NOT NULL,
+                score REAL,
+                cost REAL,
+                num_samples INTEGER NOT NULL,
+                performance TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (dataset, model)
+            ) WITHOUT ROWID
+            """
+        )
+
+    def get(self, dataset_name: str, model_name: str, key: str) -> dict | None:
+        """
+        The stored result of the pair, None if it is missing or stale.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT score, cost, num_samples, performance FROM results "
+                "WHERE dataset = ? AND model = ? AND result_key = ?",
+                (dataset_name, model_name, key),
+            ).fetchone()
+        if row is None:
+            return None
+        score, cost, num_samples, performance = row
+        return {
+            "score": score,
+            "cost": cost,
+            "num_samples": num_samples,
+            "performance": json.loads(performance),
+        }
+
+    def set(
+        self,
+        dataset_name: str,
+        model_name: str,
+        key: str,
+        score: float,
+        cost: float,
+        num_samples: int,
+        performance: list[dict[str, Any]],
+    ):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (dataset, model, result_key, score, "
+                "cost, num_samples, performance, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    dataset_name,
+                    model_name,
+                    key,
+                    float(score),
+                    float(cost),
+                    num_samples,
+                    json.dumps(performance),
+                    time.time(),
+                ),
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def get_results_store(cache_dir: str) -> ResultsStore:
+    return ResultsStore(os.path.join(cache_dir, RESULTS_FILE))
@@ -0,0 +1,182 @@
+"""
+Retry policy for the benchmark requests.
+
+Failures are classified and each class is retried differently:
+    rate_limit       wait for the Retry-After header (or back off) and retry
+    timeout          timeouts and connection resets, retried quickly
+    server_error     5xx and unknown errors, exponential backoff with full jitter
+    invalid_request  4xx, fail immediately, the sample is recorded and scored as empty
+"""
+from __future__ import annotations
+
+import email.utils
+import random
+import threading
+import time
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Any
+
+import pandas as pd
+
+RATE_LIMIT = "rate_limit"
+TIMEOUT = "timeout"
+SERVER_ERROR = "server_error"
+INVALID_REQUEST = "invalid_request"
+ERROR_CATEGORIES = [RATE_LIMIT, TIMEOUT, SERVER_ERROR, INVALID_REQUEST]
+
+
+def classify_error(error: BaseException) -> str:
+    # litellm maps the provider errors to the openai exception classes, match on
+    # the class names so the other clients (requests, httpx) are covered as well
+    names = {cls.__name__ for cls in type(error).__mro__}
+    status_code = getattr(error, "status_code", None)
+    if "RateLimitError" in names or status_code == 429:
+        return RATE_LIMIT
+    if names & {
+        "Timeout",
+        "APITimeoutError",
+        "TimeoutError",
+        "APIConnectionError",
+        "ConnectionError",
+    }:
+        return TIMEOUT
+    if status_code == 408:
+        return TIMEOUT
+    if isinstance(status_code, int) and 400 <= status_code < 500:
+        return INVALID_REQUEST
+    return SERVER_ERROR
+
+
+def get_retry_after(error: BaseException) -> float | None:
+    """
+    Seconds to wait from the `Retry-After` header of the error response, if any.
+    """
+    headers = getattr(error, "headers", None) or {}
+    response = getattr(error, "response", None)
+    if response is not None and getattr(response, "headers", None) is not None:
+        headers = {**dict(response.headers), **dict(headers)}
+    headers = {key.lower(): value for key, value in headers.items()}
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    # HTTP date format
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: dict[str, int] = field(
+        default_factory=lambda: {
+            RATE_LIMIT: 8,
+            TIMEOUT: 4,
+            SERVER_ERROR: 5,
+            INVALID_REQUEST: 1,
+        }
+    )
+    timeout_delay: float = 1.0
+    base_delay: float = 2.0
+    max_delay: float = 120.0
+
+    @classmethod
+    def from_config(cls, config: dict[str, Any] | None):
+        config = dict(config or {})
+        policy = cls()
+        policy.max_attempts.update(config.pop("max_attempts", None) or {})
+        for key, value in config.items():
+            assert hasattr(policy, key), f"Unknown retry config {key}"
+            setattr(policy, key, value)
+        return policy
+
+    def next_delay(
+        self, category: str, attempt: int, error: BaseException
+    ) -> float | None:
+        """
+        Seconds to wait before attempt `attempt + 1`, or None to give up.
+        """
+        if attempt >= self.max_attempts.get(category, 1):
+            return None
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        if category == RATE_LIMIT:
+            retry_after = get_retry_after(error)
+            if retry_after is not None:
+                return retry_after
+            return random.uniform(backoff / 2, backoff)
+        if category == TIMEOUT:
+            return self.timeout_delay * attempt
+        # full jitter, the workers that failed together do not retry together
+        return random.uniform(0, backoff)
+
+
+class RetryStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts: dict[tuple[str, str], dict[str, float]] = {}
+        self.failed_requests: list[dict[str, Any]] = []
+
+    def record(
+        self,
+        model_name: str,
+        category: str,
+        error: BaseException,
+        delay: float | None,
+        sample: str | None = None,
+    ):
+        with self._lock:
+            counts = self.counts.setdefault(
+                (model_name, category),
+                {"errors": 0, "retries": 0, "gave_up": 0, "wait_s": 0.0},
+            )
+            counts["errors"] += 1
+            if delay is None:
+                counts["gave_up"] += 1
+                self.failed_requests.append(
+                    {
+                        "model": model_name,
+                        "category": category,
+                        "sample": sample,
+                        "error": f"{type(error).__name__}: {error}"[:1000],
+                    }
+                )
+            else:
+                counts["retries"] += 1
+                counts["wait_s"] += delay
+
+    def to_dataframe(self):
+        return pd.DataFrame(
+            [
+                {"model": model_name, "category": category, **counts}
+                for (model_name, category), counts in sorted(self.counts.items())
+            ],
+            columns=["model", "category", "errors", "retries", "gave_up", "wait_s"],
+        )
+
+
+def failed_response(error: BaseException, category: str):
+    """
+    Placeholder for a request that will not be retried, scored as an empty answer.
+    It is not cached, so the next run sends the request again.
+    """
+    return {
+        "choices": [],
+        "response_cost": None,
+        "error": {
+            "category": category,
+            "type": type(error).__name__,
+            "message": str(error)[:1000],
+        },
+    }
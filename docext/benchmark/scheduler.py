@@ -0,0 +1,223 @@
+"""
+Asyncio scheduler for the benchmark requests.
+
+All (model, dataset, sample) work items of a run are scheduled together. Each
+provider (the `api_base` of hosted models, otherwise the litellm prefix of the
+model name, eg: `openrouter`, `gemini`) gets its own concurrency cap and token
+bucket rate limit, so a slow provider does not hold back the others:
+
+    executor: async
+    provider_limits:
+      default: {max_concurrency: 4}
+      openrouter: {max_concurrency: 8, requests_per_second: 2}
+      http://localhost:8000/v1: {max_concurrency: 32}
+
+A work item that has to be retried raises `Reschedule`; it goes back to the queue of
+its provider and its worker moves on to the next item instead of sleeping.
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import time
+from collections import deque
+from collections.abc import Callable
+from collections.abc import Coroutine
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Any
+
+from tqdm import tqdm
+
+EXECUTORS = ["threads", "async"]
+
+
+def get_provider(model_name: str, model_config: dict[str, Any]) -> str:
+    if model_config.get("api_base", None) is not None:
+        return model_config["api_base"]
+    if "/" in model_name:
+        return model_name.split("/", 1)[0]
+    # litellm routes the bare model names (gpt-4o, o4-mini, ...) to openai
+    return "openai"
+
+
+class Reschedule(Exception):
+    """
+    Retry the work item after `delay` seconds. With `pause_provider`, eg: for rate
+    limits, no request is sent to the provider until then.
+    """
+
+    def __init__(self, delay: float, pause_provider: bool = False):
+        super().__init__(f"Retry in {delay:.1f}s")
+        self.delay = delay
+        self.pause_provider = pause_provider
+
+
+@dataclass
+class ProviderLimits:
+    max_concurrency: int = 4
+    requests_per_second: float | None = None
+    burst: int | None = None
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int | None = None):
+        assert rate > 0, "requests_per_second must be positive"
+        self.rate = rate
+        self.capacity = float(burst if burst is not None else max(1, int(rate)))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # the lock makes the waiters take the tokens in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass
+class _ProviderQueue:
+    pending: deque
+    bucket: TokenBucket | None
+    # (ready_at, index, payload) of the rescheduled items
+    delayed: list = field(default_factory=list)
+    paused_until: float = 0.0
+    in_flight: int = 0
+
+
+class AsyncScheduler:
+    def __init__(
+        self,
+        provider_limits: dict[str, dict[str, Any]] | None = None,
+        default_max_concurrency: int = 4,
+    ):
+        provider_limits = dict(provider_limits or {})
+        default = provider_limits.pop("default", {})
+        self.default_limits = ProviderLimits(
+            **{"max_concurrency": default_max_concurrency, **default}
+        )
+        self.provider_limits = {
+            provider: ProviderLimits(**{**vars(self.default_limits), **limits})
+            for provider, limits in provider_limits.items()
+        }
+
+    def limits_for(self, provider: str) -> ProviderLimits:
+        return self.provider_limits.get(provider, self.default_limits)
+
+    def run(
+        self,
+        fn: Callable[[Any, int], Any],
+        items: list[tuple[str, Any]],
+        desc: str = "Running benchmark",
+        on_result: Callable[[int, Any], None] | None = None,
+    ) -> list[Any]:
+        """
+        Call `fn(payload, attempt)` in worker threads for every `(provider, payload)`
+        item and return the results in the order of `items`. `on_result(index,
+        result)` is called as soon as an item finishes. The first exception other
+        than `Reschedule` is raised after the running calls finish.
+        """
+        return asyncio.run(self._run(fn, items, desc, on_result))
+
+    async def _run(
+        self,
+        fn: Callable,
+        items: list[tuple[str, Any]],
+        desc: str,
+        on_result: Callable[[int, Any], None] | None = None,
+    ):
+        pending: dict[str, deque[tuple[int, Any]]] = {}
+        for index, (provider, payload) in enumerate(items):
+            pending.setdefault(provider, deque()).append((index, payload))
+
+        results: list[Any] = [None] * len(items)
+        attempts = [1] * len(items)
+        errors: list[BaseException] = []
+        progress = tqdm(total=len(items), desc=desc)
+        max_threads = sum(
+            self.limits_for(provider).max_concurrency for provider in pending
+        )
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=max(max_threads, 1))
+
+        async def next_item(queue: _ProviderQueue):
+            while not errors:
+                now = time.monotonic()
+                if queue.delayed and queue.delayed[0][0] <= now:
+                    _, index, payload = heapq.heappop(queue.delayed)
+                    return index, payload
+                if queue.pending:
+                    return queue.pending.popleft()
+                if queue.delayed:
+                    await asyncio.sleep(queue.delayed[0][0] - now)
+                elif queue.in_flight > 0:
+                    # the running items may still be rescheduled
+                    await asyncio.sleep(0.05)
+                else:
+                    return None
+            return None
+
+        async def worker(queue: _ProviderQueue):
+            # a fixed number of workers per provider, instead of a task per item,
+            # keeps the memory flat for runs with hundreds of thousands of items
+            while True:
+                item = await next_item(queue)
+                if item is None:
+                    return
+                index, payload = item
+                pause = queue.paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                if queue.bucket is not None:
+                    await queue.bucket.acquire()
+                queue.in_flight += 1
+                try:
+                    results[index] = await loop.run_in_executor(
+                        executor, fn, payload, attempts[index]
+                    )
+                    progress.update(1)
+                    if on_result is not None:
+                        on_result(index, results[index])
+                except Reschedule as reschedule:
+                    attempts[index] += 1
+                    ready_at = time.monotonic() + reschedule.delay
+                    heapq.heappush(queue.delayed, (ready_at, index, payload))
+                    if reschedule.pause_provider:
+                        queue.paused_until = max(queue.paused_until, ready_at)
+                except Exception as e:
+                    errors.append(e)
+                    return
+                finally:
+                    queue.in_flight -= 1
+
+        workers: list[Coroutine[Any, Any, None]] = []
+        for provider, provider_pending in pending.items():
+            limits = self.limits_for(provider)
+            queue = _ProviderQueue(
+                pending=provider_pending,
+                bucket=TokenBucket(limits.requests_per_second, limits.burst)
+                if limits.requests_per_second is not None
+                else None,
+            )
+            workers.extend(
+                worker(queue)
+                for _ in range(min(limits.max_concurrency, len(provider_pending)))
+            )
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            progress.close()
+            executor.shutdown(wait=True)
+        if errors:
+            raise errors[0]
+        return results
@@ -0,0 +1,357 @@
+"""
+Parsing and scoring of the benchmark responses.
+
+The functions are module level so they can run in worker processes, both for a
+regular benchmark run and for `--rescore`, which rebuilds the leaderboard from the
+prediction cache without sending any request. `ChunkedScorer` scores the responses
+in chunks in a process pool while the responses are still being collected.
+"""
+from __future__ import annotations
+
+import json
+import threading
+from concurrent.futures import Executor
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any
+
+import json_repair
+import numpy as np
+import pandas as pd
+
+from docext.benchmark.metrics.classification import get_classification_metrics
+from docext.benchmark.metrics.kie import get_kie_metrics
+from docext.benchmark.metrics.ocr import get_ocr_metrics
+from docext.benchmark.metrics.tables import get_table_metrics
+from docext.benchmark.metrics.tables import get_table_scores
+from docext.benchmark.metrics.tables import summarize_table_scores
+from docext.benchmark.metrics.vqa import get_vqa__metric_for_multiple_possible_answers
+from docext.benchmark.metrics.vqa import get_vqa_metrics
+from docext.benchmark.vlm_datasets.ds import BenchmarkData
+from docext.benchmark.vlm_datasets.ds import Classification
+from docext.benchmark.vlm_datasets.ds import PredField
+from docext.benchmark.vlm_datasets.ds import Prediction
+from docext.benchmark.vlm_datasets.ds import Table
+from docext.benchmark.vlm_datasets.ds import VQA
+
+# bump when the parsing or a metric changes, the stored results are recomputed
+METRIC_VERSION = 1
+
+
+def parse_response(response: dict, task: str):
+    """
+    Parse the answer of a model response: a string for OCR, VQA and
+    CLASSIFICATION, a dict of fields for KIE and a dataframe for TABLE.
+    """
+    if task == "OCR" or task == "VQA" or task == "CLASSIFICATION":
+        # OCR and VQA, Classification task returns a string
+        answer = (
+            response["choices"][0]["message"]["content"]
+            if len(response["choices"]) > 0
+            and response["choices"][0]["message"]["content"]
+            else ""
+        )
+        return answer.strip() if answer else ""
+    elif task == "TABLE":
+        if len(response["choices"]) == 0:
+            return pd.DataFrame()
+        response = response["choices"][0]["message"]["content"]
+
+        # convert the parsed_json to a dataframe
+        try:
+            parsed_json = json_repair.repair_json(
+                response, ensure_ascii=False, return_objects=True
+            )
+            if isinstance(parsed_json[0], list):
+                df = pd.concat([pd.DataFrame(item) for item in parsed_json])
+            else:
+                df = pd.DataFrame(parsed_json)
+            return df
+        except Exception as e:
+            print(f"Error parsing table: {e}")
+            return pd.DataFrame()
+
+    parsed_json = json_repair.repair_json(
+        response["choices"][0]["message"]["content"]
+        if len(response["choices"]) > 0 and response["choices"][0]["message"]["content"]
+        else "{}",
+        ensure_ascii=False,
+        return_objects=True,
+    )
+    if isinstance(parsed_json, list):
+        # merge all the keys into a single dict
+        merged_dict = {}
+        for item in parsed_json:
+            if isinstance(item, dict):
+                for key, value in item.items():
+                    if key not in merged_dict:
+                        merged_dict[key] = value
+                    else:
+                        if isinstance(merged_dict[key], list):
+                            merged_dict[key].append(value)
+                        else:
+                            merged_dict[key] = [merged_dict[key], value]
+            # we ignore the other types of objects, the model should not return them
+        return merged_dict
+
+    if parsed_json == "":
+        return {}  # parsing failed
+    return parsed_json
+
+
+def build_prediction(data: BenchmarkData, parsed_response, task: str) -> Prediction:
+    """
+    Pair the ground truth `data` with the prediction built from `parsed_response`.
+    """
+    if task == "KIE":
+        return Prediction(
+            gt=data,
+            pred=BenchmarkData(
+                image_paths=data.image_paths,
+                extraction_type=data.extraction_type,
+                fields=[
+                    PredField(
+                        label=label,
+                        value=value
+                        if isinstance(value, str)
+                        else ("" if value is None else json.dumps(value)),
+                        confidence=-1.0,
+                    )
+                    for label, value in parsed_response.items()
+                ],
+            ),
+        )
+    elif task == "OCR":
+        return Prediction(
+            gt=data,
+            pred=BenchmarkData(
+                image_paths=data.image_paths,
+                extraction_type=data.extraction_type,
+                ocr_text=parsed_response,
+            ),
+        )
+    elif task == "VQA":
+        return Prediction(
+            gt=data,
+            pred=BenchmarkData(
+                image_paths=data.image_paths,
+                extraction_type=data.extraction_type,
+                vqa=VQA(
+                    question=data.vqa.question if data.vqa is not None else "",
+                    answer=parsed_response,
+                ),
+            ),
+        )
+    elif task == "CLASSIFICATION":
+        return Prediction(
+            gt=data,
+            pred=BenchmarkData(
+                extraction_type=data.extraction_type,
+                image_paths=data.image_paths,
+                classification=Classification(
+                    doc_type=parsed_response,
+                    labels=data.classification.labels
+                    if data.classification is not None
+                    else [],
+                ),
+            ),
+        )
+    elif task == "TABLE":
+        parsed_response = (
+            [parsed_response]
+            if isinstance(parsed_response, pd.DataFrame)
+            else parsed_response
+        )
+        return Prediction(
+            gt=data,
+            pred=BenchmarkData(
+                image_paths=data.image_paths,
+                extraction_type=data.extraction_type,
+                tables=[
+                    Table(
+                        table=table,
+                        columns=table.columns.tolist(),
+                    )
+                    for table in parsed_response
+                ],
+            ),
+        )
+    else:
+        raise ValueError(f"Task {task} is not supported.")
+
+
+def get_metrics(
+    pred_with_gt: list[Prediction],
+    task: str,
+    dataset_name: str,
+    grits_config: dict | None = None,
+    return_scores: bool = False,
+):
+    """
+    The metric of the task. With `return_scores`, also the per-sample scores (per
+    field for KIE), not supported for TABLE, see `get_table_scores`.
+    """
+    assert not (return_scores and task == "TABLE"), "use get_table_scores"
+    if task == "KIE":
+        return get_kie_metrics(pred_with_gt, return_scores=return_scores)
+    elif task == "OCR":
+        return get_ocr_metrics(pred_with_gt, return_scores=return_scores)
+    elif task == "VQA":
+        if dataset_name == "docvqa":
+            return get_vqa__metric_for_multiple_possible_answers(
+                pred_with_gt, return_scores=return_scores
+            )
+        else:
+            return get_vqa_metrics(pred_with_gt, return_scores=return_scores)
+    elif task == "CLASSIFICATION":
+        return get_classification_metrics(pred_with_gt, return_scores=return_scores)
+    elif task == "TABLE":
+        return get_table_metrics(pred_with_gt, grits_config)
+    else:
+        raise ValueError(f"Task {task} is not supported.")
+
+
+def score_chunk(
+    data: list[BenchmarkData],
+    responses: list[dict],
+    task: str,
+    dataset_name: str,
+    grits_config: dict | None = None,
+):
+    """
+    Parse and score a chunk of responses. Returns the per-sample scores (per field
+    for KIE), the GriTS upper bounds for TABLE (None otherwise) and the cost of
+    each response, merged with `merge_chunks`.
+    """
+    pred_with_gt = [
+        build_prediction(sample, parse_response(response, task), task)
+        for response, sample in zip(responses, data)
+    ]
+    costs = [
+        response["response_cost"] if response["response_cost"] is not None else 0
+        for response in responses
+    ]
+    if task == "TABLE":
+        scores, upper_bounds = get_table_scores(pred_with_gt, grits_config)
+        return scores, upper_bounds, costs
+    _, scores = get_metrics(pred_with_gt, task, dataset_name, return_scores=True)
+    return scores, None, costs
+
+
+def merge_chunks(chunks: list[tuple], task: str, grits_config: dict | None = None):
+    """
+    Merge the `score_chunk` results, in the order of the samples, into the metric
+    and the average cost per response. The result is the same as scoring all the
+    samples at once.
+    """
+    scores = np.concatenate([chunk[0] for chunk in chunks])
+    total_cost = 0
+    num_responses = 0
+    for _, _, costs in chunks:
+        for cost in costs:
+            total_cost += cost
+        num_responses += len(costs)
+    avg_cost = total_cost / num_responses
+    if task == "TABLE":
+        upper_bounds = np.concatenate([chunk[1] for chunk in chunks])
+        return summarize_table_scores(scores, upper_bounds, grits_config), avg_cost
+    if task == "CLASSIFICATION":
+        return int(scores.sum()) / len(scores), avg_cost
+    return float(scores.sum()) / len(scores), avg_cost
+
+
+def score_responses(
+    data: list[BenchmarkData],
+    responses: list[dict],
+    task: str,
+    dataset_name: str,
+    grits_config: dict | None = None,
+):
+    """
+    Score the `responses` against the ground truth `data`, returns the metric and
+    the average cost per response. `grits_config` selects the GriTS mode of the
+    table datasets.
+    """
+    chunk = score_chunk(data, responses, task, dataset_name, grits_config)
+    return merge_chunks([chunk], task, grits_config)
+
+
+@dataclass
+class _PairChunks:
+    data: list[BenchmarkData]
+    task: str
+    dataset_name: str
+    grits_config: dict | None
+    responses: list
+    received: list[int]
+    futures: list[Future | None]
+
+
+class ChunkedScorer:
+    """
+    Scores the responses of (dataset, model) pairs in chunks of `chunk_size`
+    samples while they are still being collected. A chunk is submitted to the
+    process pool as soon as all of its responses arrived, and the chunks are merged
+    in sample order, so the scores do not depend on the completion order. Without
+    an executor the chunks are scored inline.
+    """
+
+    def __init__(self, executor: Executor | None = None, chunk_size: int = 64):
+        assert chunk_size > 0, "scoring_chunk_size must be positive"
+        self.executor = executor
+        self.chunk_size = chunk_size
+        self._pairs: dict[Any, _PairChunks] = {}
+        self._lock = threading.Lock()
+
+    def add_pair(
+        self,
+        pair: Any,
+        data: list[BenchmarkData],
+        task: str,
+        dataset_name: str,
+        grits_config: dict | None = None,
+    ):
+        num_chunks = -(-len(data) // self.chunk_size)
+        self._pairs[pair] = _PairChunks(
+            data=data,
+            task=task,
+            dataset_name=dataset_name,
+            grits_config=grits_config,
+            responses=[None] * len(data),
+            received=[0] * num_chunks,
+            futures=[None] * num_chunks,
+        )
+
+    def add_response(self, pair: Any, index: int, response: dict):
+        chunks = self._pairs[pair]
+        chunk_index = index // self.chunk_size
+        start = chunk_index * self.chunk_size
+        end = min(start + self.chunk_size, len(chunks.data))
+        with self._lock:
+            chunks.responses[index] = response
+            chunks.received[chunk_index] += 1
+            if chunks.received[chunk_index] < end - start:
+                return
+        args = (
+            chunks.data[start:end],
+            chunks.responses[start:end],
+            chunks.task,
+            chunks.dataset_name,
+            chunks.grits_config,
+        )
+        if self.executor is None:
+            future: Future = Future()
+            future.set_result(score_chunk(*args))
+        else:
+            future = self.executor.submit(score_chunk, *args)
+        chunks.futures[chunk_index] = future
+
+    def result(self, pair: Any):
+        """
+        The metric and the average cost of `pair`, once all its responses were added.
+        """
+        chunks = self._pairs.pop(pair)
+        futures = [future for future in chunks.futures if future is not None]
+        assert len(futures) == len(chunks.futures), f"{pair} has missing responses"
+        results = [future.result() for future in futures]
+        return merge_chunks(results, chunks.task, chunks.grits_config)
@@ -0,0 +1,147 @@
+"""
+Sharded benchmark runs.
+
+Several processes, on one or several hosts sharing `cache_dir`, split one run with
+`--shard i/N` (0 <= i < N). Every (dataset, model, sample) item is owned by the
+shard `int(cache_key[:16], 16) % N`, so the assignment does not depend on the host,
+the order of the datasets or the number of samples of the other datasets. The
+shards only fill the prediction cache, the reports are written by `--merge` once
+they are done:
+
+    python -m docext.benchmark.benchmark --shard 0/2   # host A, api key 1
+    python -m docext.benchmark.benchmark --shard 1/2   # host B, api key 2
+    python -m docext.benchmark.benchmark --merge
+
+Before an item is sent, its shard takes a claim: a lock file created with
+`O_EXCL` in `{cache_dir}/claims`, which works on NFS and other shared volumes.
+With `sharding.steal`, a shard that is done with its own items takes the unclaimed
+and uncached items of the other shards, so a fast GPU box helps out a slow API.
+The claims of a crashed process expire after `sharding.claim_ttl` seconds.
+"""
+from __future__ import annotations
+
+import os
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from docext.benchmark.cache import model_cache_name
+
+CLAIMS_DIR = "claims"
+
+
+@dataclass(frozen=True)
+class Shard:
+    index: int
+    count: int
+
+    @classmethod
+    def parse(cls, spec: str):
+        index, _, count = spec.partition("/")
+        assert index.isdigit() and count.isdigit(), f"--shard must be i/N, got {spec}"
+        shard = cls(int(index), int(count))
+        assert 0 <= shard.index < shard.count, f"--shard {spec}: i must be in [0, N)"
+        return shard
+
+    @property
+    def tag(self) -> str:
+        return f"{self.index}/{self.count}"
+
+    def owns(self, cache_key: str) -> bool:
+        # the cache keys are sha256 hex digests, ie: uniformly distributed
+        return int(cache_key[:16], 16) % self.count == self.index
+
+
+@dataclass
+class ShardingConfig:
+    steal: bool = True
+    claim_ttl: float = 3600.0
+
+    @classmethod
+    def from_config(cls, config: dict[str, Any] | None):
+        sharding = cls()
+        for key, value in (config or {}).items():
+            assert hasattr(sharding, key), f"Unknown sharding config {key}"
+            setattr(sharding, key, value)
+        assert sharding.claim_ttl > 0, "sharding claim_ttl must be positive"
+        return sharding
+
+
+class ClaimDir:
+    """
+    Lock files of the items being sent, `{model}_{cache_key}.claim` holds the
+    owner. A claim is released once the response is cached.
+    """
+
+    def __init__(self, claims_dir: str, owner: str, ttl: float = 3600.0):
+        self.claims_dir = claims_dir
+        self.owner = owner
+        self.ttl = ttl
+        os.makedirs(self.claims_dir, exist_ok=True)
+
+    def path(self, model_name: str, key: str):
+        return os.path.join(
+            self.claims_dir, f"{model_cache_name(model_name)}_{key}.claim"
+        )
+
+    def claim(self, model_name: str, key: str) -> bool:
+        path = self.path(model_name, key)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._expire(path):
+                    return False
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(self.owner)
+            return True
+        return False
+
+    def release(self, model_name: str, key: str):
+        try:
+            os.remove(self.path(model_name, key))
+        except FileNotFoundError:
+            pass
+
+    def active_claims(self) -> list[str]:
+        now = time.time()
+        claims = []
+        for file_name in sorted(os.listdir(self.claims_dir)):
+            if not file_name.endswith(".claim"):
+                continue
+            try:
+                mtime = os.path.getmtime(os.path.join(self.claims_dir, file_name))
+            except FileNotFoundError:
+                continue
+            if now - mtime <= self.ttl:
+                claims.append(file_name)
+        return claims
+
+    def _expire(self, path: str) -> bool:
+        """
+        Remove the claim at `path` if it is older than `ttl`, returns whether it was
+        removed. The claim is renamed first so only one process removes it, a
+        race with a fresh claim can at worst send an item twice.
+        """
+        try:
+            if time.time() - os.path.getmtime(path) <= self.ttl:
+                return False
+            stale_path = f"{path}.{self.owner}.{threading.get_ident()}.stale"
+            os.replace(path, stale_path)
+            os.remove(stale_path)
+        except FileNotFoundError:
+            # released or expired by another process in the meantime
+            pass
+        return True
+
+
+def get_claim_dir(cache_dir: str, shard: Shard, ttl: float) -> ClaimDir:
+    owner = f"{socket.gethostname()}.{os.getpid()}"
+    return ClaimDir(
+        os.path.join(cache_dir, CLAIMS_DIR),
+        owner=f"{owner}.shard{shard.index}of{shard.count}",
+        ttl=ttl,
+    )
@@ -13,9 +13,11 @@ please refer to the README for instructions.
 """
 from __future__ import annotations
 
+from collections.abc import Callable
 from typing import Any
 
 from docext.benchmark.utils import encode_image
+from docext.benchmark.utils import file_digest
 from docext.benchmark.vlm_datasets.chartqa import ChartQA
 from docext.benchmark.vlm_datasets.checkbox import DeathSe43_44_checkbox
 from docext.benchmark.vlm_datasets.docile import Docile
@@ -104,7 +106,23 @@ def get_image_encoding_type(image_path: str) -> str:
         raise ValueError(f"Unsupported image format: {image_path}")
 
 
-def get_TABLE_messages(data: BenchmarkData, template: dict[str, Any]):
+def get_image_url(image_path: str) -> str:
+    return f"{get_image_encoding_type(image_path)},{encode_image(image_path)}"
+
+
+def get_image_digest_url(image_path: str) -> str:
+    """
+    Stand-in for `get_image_url` used to build cache keys: the image is identified
+    by its content digest instead of its base64 encoding.
+    """
+    return f"{get_image_encoding_type(image_path)},sha256:{file_digest(image_path)}"
+
+
+def get_TABLE_messages(
+    data: BenchmarkData,
+    template: dict[str, Any],
+    image_url: Callable[[str], str] = get_image_url,
+):
     system_prompt = template["system_prompt"]
     document_page_seperator = template["document_page_seperator"]
     image_paths = data.image_paths
@@ -126,9 +144,7 @@ def get_TABLE_messages(data: BenchmarkData, template: dict[str, Any]):
                 },
                 {
                     "type": "image_url",
-                    "image_url": {
-                        "url": f"{get_image_encoding_type(filepath)},{encode_image(filepath)}",
-                    },
+                    "image_url": {"url": image_url(filepath)},
                 },
             ],
         }
@@ -143,7 +159,11 @@ def get_TABLE_messages(data: BenchmarkData, template: dict[str, Any]):
     return messages
 
 
-def get_CLASSIFICATION_messages(data: BenchmarkData, template: dict[str, Any]):
+def get_CLASSIFICATION_messages(
+    data: BenchmarkData,
+    template: dict[str, Any],
+    image_url: Callable[[str], str] = get_image_url,
+):
     image_paths = data.image_paths
     labels = data.classification.labels if data.classification is not None else []
     assert len(labels) > 0, "No labels found in the data"
@@ -160,9 +180,7 @@ def get_CLASSIFICATION_messages(data: BenchmarkData, template: dict[str, Any]):
                 },
                 {
                     "type": "image_url",
-                    "image_url": {
-                        "url": f"{get_image_encoding_type(filepath)},{encode_image(filepath)}",
-                    },
+                    "image_url": {"url": image_url(filepath)},
                 },
             ],
         }
@@ -177,7 +195,11 @@ def get_CLASSIFICATION_messages(data: BenchmarkData, template: dict[str, Any]):
     return messages
 
 
-def get_VQA_messages(data: BenchmarkData, template: dict[str, Any]):
+def get_VQA_messages(
+    data: BenchmarkData,
+    template: dict[str, Any],
+    image_url: Callable[[str], str] = get_image_url,
+):
     system_prompt = template["system_prompt"]
     document_page_seperator = template["document_page_seperator"]
     image_paths = data.image_paths
@@ -197,9 +219,7 @@ def get_VQA_messages(data: BenchmarkData, template: dict[str, Any]):
                 },
                 {
                     "type": "image_url",
-                    "image_url": {
-                        "url": f"{get_image_encoding_type(filepath)},{encode_image(filepath)}",
-                    },
+                    "image_url": {"url": image_url(filepath)},
                 },
             ],
         }
@@ -214,7 +234,11 @@ def get_VQA_messages(data: BenchmarkData, template: dict[str, Any]):
     return messages
 
 
-def get_OCR_messages(data: BenchmarkData, template: dict[str, Any]):
+def get_OCR_messages(
+    data: BenchmarkData,
+    template: dict[str, Any],
+    image_url: Callable[[str], str] = get_image_url,
+):
     system_prompt = template["system_prompt"]
     user_prompt = template["user_prompt"]
     image_paths = data.image_paths
@@ -226,9 +250,7 @@ def get_OCR_messages(data: BenchmarkData, template: dict[str, Any]):
             "content": [
                 {
                     "type": "image_url",
-                    "image_url": {
-                        "url": f"{get_image_encoding_type(image_path)},{encode_image(image_path)}",
-                    },
+                    "image_url": {"url": image_url(image_path)},
                 },
             ],
         },
@@ -240,7 +262,11 @@ def get_OCR_messages(data: BenchmarkData, template: dict[str, Any]):
     ]
 
 
-def get_KIE_messages(data: BenchmarkData, template: dict[str, Any]):
+def get_KIE_messages(
+    data: BenchmarkData,
+    template: dict[str, Any],
+    image_url: Callable[[str], str] = get_image_url,
+):
     system_prompt = template["system_prompt"]
     document_page_seperator = template["document_page_seperator"]
     image_paths = data.image_paths
@@ -263,9 +289,7 @@ def get_KIE_messages(data: BenchmarkData, template: dict[str, Any]):
                 },
                 {
                     "type": "image_url",
-                    "image_url": {
-                        "url": f"{get_image_encoding_type(filepath)},{encode_image(filepath)}",
-                    },
+                    "image_url": {"url": image_url(filepath)},
                 },
             ],
         }
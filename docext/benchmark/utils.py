@@ -1,9 +1,14 @@
 from __future__ import annotations
 
 import base64
+import hashlib
+import os
+import threading
 
 import yaml
 
+from docext.benchmark.image_store import lookup_packed_image
+
 
 def load_yaml(path: str) -> dict:
     with open(path) as f:
@@ -11,5 +16,33 @@ def load_yaml(path: str) -> dict:
 
 
 def encode_image(image_path):
+    packed = lookup_packed_image(image_path)
+    if packed is not None:
+        store, name = packed
+        return store.read_b64(name)
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode("utf-8")
+
+
+_file_digests: dict[tuple[str, int, int], str] = {}
+_file_digests_lock = threading.Lock()
+
+
+def file_digest(path: str) -> str:
+    """
+    sha256 of the file content, memoized by path, mtime and size so the images of
+    a dataset are read once per run.
+    """
+    packed = lookup_packed_image(path)
+    if packed is not None:
+        store, name = packed
+        return store.digest(name)
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    digest = _file_digests.get(memo_key)
+    if digest is None:
+        with open(path, "rb") as f:
+            digest = hashlib.file_digest(f, "sha256").hexdigest()
+        with _file_digests_lock:
+            _file_digests[memo_key] = digest
+    return digest
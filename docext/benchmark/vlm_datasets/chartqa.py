@@ -10,7 +10,6 @@ from __future__ import annotations
 import os
 
 from datasets import load_dataset
-from tqdm import tqdm
 
 from docext.benchmark.vlm_datasets.ds import BenchmarkData
 from docext.benchmark.vlm_datasets.ds import BenchmarkDataset
@@ -30,8 +29,10 @@ class ChartQA(BenchmarkDataset):
         cache_dir: str | None = None,
     ):
         cache_dir = self._get_cache_dir(self.name, cache_dir)
-        data: list[BenchmarkData] = self._load_data(
-            hf_name, test_split, max_samples, cache_dir
+        data: list[BenchmarkData] = self._load_or_build_data(
+            cache_dir,
+            {"hf_name": hf_name, "test_split": test_split, "max_samples": max_samples},
+            lambda: self._load_data(hf_name, test_split, max_samples, cache_dir),
         )
         super().__init__(self.name, data, cache_dir)
 
@@ -49,20 +50,21 @@ class ChartQA(BenchmarkDataset):
             else test_data
         )
 
+        queries, labels = [], []
+
+        def image_jobs():
+            for i, row in enumerate(
+                self._iter_rows(test_data, ["image", "query", "label"])
+            ):
+                queries.append(row["query"])
+                labels.append(row["label"])
+                yield row["image"], os.path.join(cache_dir, f"{i}")
+
+        image_paths = self._prepare_images(image_jobs(), total=len(test_data))
+
         data = []
-        for i in tqdm(
-            range(len(test_data)), desc=f"{self.name}: Converting data", leave=False
-        ):
-            data_point = test_data[i]
-            image, query, label = (
-                data_point["image"],
-                data_point["query"],
-                data_point["label"],
-            )
+        for image_path, query, label in zip(image_paths, queries, labels):
             label = label[0]  # there is only one label always in the dataset
-            # save the image
-            image_path = os.path.join(cache_dir, f"{i}.png")
-            image.save(image_path)
             data.append(
                 BenchmarkData(
                     image_paths=[image_path],
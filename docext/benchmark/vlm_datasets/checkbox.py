@@ -41,7 +41,11 @@ class DeathSe43_44_checkbox(BenchmarkDataset):
         cache_dir: str | None = None,
     ):
         cache_dir = self._get_cache_dir(self.name, cache_dir)
-        data = self._load_data(hf_name, test_split, max_samples, cache_dir)
+        data = self._load_or_build_data(
+            cache_dir,
+            {"hf_name": hf_name, "test_split": test_split, "max_samples": max_samples},
+            lambda: self._load_data(hf_name, test_split, max_samples, cache_dir),
+        )
         super().__init__(self.name, data, cache_dir)
 
     def _get_kie_data(self, ground_truth: str) -> dict:
@@ -93,22 +97,29 @@ class DeathSe43_44_checkbox(BenchmarkDataset):
             test_data = test_data.select(range(max_samples))
 
         ## convert the data to the format of the BenchmarkDataset
+        ground_truths = []
+
+        def image_jobs():
+            for i, row in enumerate(
+                self._iter_rows(test_data, ["image", "ground_truth"])
+            ):
+                ground_truths.append(row["ground_truth"])
+                yield row["image"], os.path.join(cache_dir, f"{i}")
+
+        image_paths = self._prepare_images(image_jobs(), total=len(test_data))
+
         data = []
-        for i in tqdm(
-            range(len(test_data)),
+        for image_path, ground_truth in tqdm(
+            zip(image_paths, ground_truths),
+            total=len(image_paths),
             desc=f"{self.name}: Converting data",
             leave=False,
         ):
-            data_point = test_data[i]
-            image, ground_truth = data_point["image"], data_point["ground_truth"]
             gt_answer = self._get_kie_data(ground_truth)
             gt_answer_object = [
                 Field(label=k, value=v, description=FIELDS_DESCRIPTIONS.get(k, None))
                 for k, v in gt_answer.items()
             ]
-            # save the image
-            image_path = os.path.join(cache_dir, f"{i}.png")
-            image.save(image_path)
             data.append(
                 BenchmarkData(
                     image_paths=[image_path],
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import hashlib
 import os
 from typing import Optional
 
@@ -28,15 +29,59 @@ class Docile(BenchmarkDataset):
     ):
         cache_dir = self._get_cache_dir(self.name, cache_dir)
         ## convert the data to the format of the BenchmarkDataset
-        data = self._convert_data(
-            annot_path,
-            annotations_root,
-            pdf_root,
-            max_samples,
+        data = self._load_or_build_data(
             cache_dir,
+            {
+                "annot_path": os.path.abspath(annot_path),
+                "annotations_root": annotations_root,
+                "pdf_root": pdf_root,
+                "max_samples": max_samples,
+            },
+            lambda: self._convert_data(
+                annot_path,
+                annotations_root,
+                pdf_root,
+                max_samples,
+                cache_dir,
+            ),
+            source_hash=self._source_hash(
+                annot_path, annotations_root, pdf_root, max_samples
+            ),
         )
         super().__init__(self.name, data, cache_dir)
 
+    def _source_hash(
+        self,
+        annot_path: str,
+        annotations_root: str | None = None,
+        pdf_root: str | None = None,
+        max_samples: int | None = None,
+    ):
+        """
+        Hash of the size and modification time of the annotation and pdf files, a
+        stat per file instead of reading or rasterizing them.
+        """
+        data_ids = load_json(annot_path)
+        if max_samples is not None and max_samples > 0:
+            data_ids = data_ids[:max_samples]
+        annotations_root = annotations_root or os.path.join(
+            os.path.dirname(annot_path),
+            "annotations",
+        )
+        pdf_root = pdf_root or os.path.join(os.path.dirname(annot_path), "pdfs")
+        paths = [annot_path]
+        for id in data_ids:
+            paths.append(os.path.join(annotations_root, f"{id}.json"))
+            paths.append(os.path.join(pdf_root, f"{id}.pdf"))
+        digest = hashlib.sha256()
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+            except FileNotFoundError:
+                digest.update(f"{path}:missing\n".encode())
+        return digest.hexdigest()
+
     def _convert_data(
         self,
         annot_path: str,
@@ -1,20 +1,98 @@
 from __future__ import annotations
 
+import hashlib
 import io
+import json
 import os
+import pickle
 import random
+import time
+from collections import deque
+from collections.abc import Callable
+from collections.abc import Iterable
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
+from typing import Any
 from typing import Union
 
 import pandas as pd
+from datasets import Dataset
+from datasets import Image as HFImage
 from loguru import logger
 from PIL import Image
 from pydantic import BaseModel
 from pydantic import ConfigDict
 from tqdm import tqdm
 
+from docext.benchmark.image_store import open_image_store
+from docext.benchmark.image_store import register_image_store
 from docext.benchmark.vlm_datasets.utils import convert_pdf2image
 
+# bump when the conversion of any dataset changes, the existing manifests are rebuilt
+# 2: PNG sources are written as they are instead of being re-encoded
+MANIFEST_VERSION = 2
+MANIFEST_FILE = "manifest.pkl"
+
+# encoded images in these formats are written as they are when they need no resize or
+# rotation, the others are re-encoded as PNG
+PASSTHROUGH_FORMATS = {"PNG"}
+
+
+def resize_image(image: Image.Image, max_size: int = 1024):
+    width, height = image.size
+    if width > max_size or height > max_size:
+        image = image.resize((max_size, max_size))
+    return image
+
+
+def prepare_image(
+    source: bytes | dict | Image.Image,
+    path_stem: str,
+    max_size: int | None = None,
+    rotation: float | None = None,
+) -> str:
+    """
+    Write a dataset image to `path_stem` + extension and return the path. `source`
+    is the encoded image, a `datasets.Image(decode=False)` value ({"bytes", "path"})
+    or a decoded image. Runs in the worker processes of `_prepare_images`.
+    """
+    image_bytes: bytes | None = None
+    if isinstance(source, dict):
+        image_bytes = source.get("bytes")
+        if image_bytes is None:
+            with open(source["path"], "rb") as f:
+                image_bytes = f.read()
+    elif isinstance(source, bytes):
+        image_bytes = source
+
+    # opening only reads the header, the pixels are decoded when they are needed
+    image: Image.Image
+    if image_bytes is not None:
+        image = Image.open(io.BytesIO(image_bytes))
+    else:
+        assert isinstance(source, Image.Image), f"Unsupported image {type(source)}"
+        image = source
+    needs_resize = max_size is not None and max(image.size) > max_size
+    if (
+        image_bytes is not None
+        and not needs_resize
+        and not rotation
+        and image.format in PASSTHROUGH_FORMATS
+    ):
+        image_path = f"{path_stem}.png"
+        with open(image_path, "wb") as f:
+            f.write(image_bytes)
+        return image_path
+
+    if max_size is not None and needs_resize:
+        image = resize_image(image, max_size)
+    if rotation:
+        image = image.rotate(rotation, expand=True)
+    image_path = f"{path_stem}.png"
+    image.save(image_path)
+    return image_path
+
 
 class ExtractionType(Enum):
     FIELD = "field"
@@ -97,6 +175,10 @@ class Prediction(BaseModel):
 
 class BenchmarkDataset:
     task: str
+    # processes used to prepare the images, defaults to the number of cores
+    num_workers: int | None = None
+    # identifies the converted data, set when the manifest is loaded or built
+    manifest_hash: str | None = None
 
     def __init__(
         self,
@@ -132,6 +214,154 @@ class BenchmarkDataset:
             os.makedirs(cache_dir, exist_ok=True)
         return cache_dir
 
+    def _config_hash(self, config: dict[str, Any]) -> str:
+        config = {"dataset": type(self).__qualname__, "name": self.name, **config}
+        return hashlib.sha256(
+            json.dumps(config, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def _load_or_build_data(
+        self,
+        cache_dir: str,
+        config: dict[str, Any],
+        build: Callable[[], list[BenchmarkData]],
+        source_hash: str | None = None,
+    ) -> list[BenchmarkData]:
+        """
+        Load the converted data from the manifest in `cache_dir`, or call `build` and
+        write the manifest. The manifest is rebuilt when `MANIFEST_VERSION`, the hash
+        of `config` or `source_hash` change, or when an image is missing. Delete
+        `{cache_dir}/manifest.pkl` to force a rebuild.
+        """
+        manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+        config_hash = self._config_hash(config)
+        start = time.perf_counter()
+        manifest = None
+        try:
+            with open(manifest_path, "rb") as f:
+                manifest = pickle.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"{self.name}: ignoring unreadable manifest: {e}")
+
+        if (
+            manifest is not None
+            and manifest.get("version") == MANIFEST_VERSION
+            and manifest.get("config_hash") == config_hash
+            and manifest.get("source_hash") == source_hash
+        ):
+            data = manifest["data"]
+            # the images may only be in the image pack, eg: after copying the
+            # manifest and the pack to another machine
+            image_store = open_image_store(cache_dir)
+            image_paths = {path for sample in data for path in sample.image_paths}
+            missing = [path for path in image_paths if not os.path.exists(path)]
+            if image_store is not None and missing:
+                if all(path in image_store for path in missing):
+                    register_image_store(image_store)
+                    missing = []
+            if not missing:
+                logger.info(
+                    f"{self.name}: loaded {len(data)} samples from the manifest in "
+                    f"{time.perf_counter() - start:.2f}s"
+                )
+                self.manifest_hash = self._manifest_hash(manifest)
+                return data
+            logger.info(f"{self.name}: images are missing, rebuilding the manifest")
+        elif manifest is not None:
+            logger.info(f"{self.name}: dataset config changed, rebuilding the manifest")
+
+        data = build()
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "config_hash": config_hash,
+            "source_hash": source_hash,
+            "created_at": time.time(),
+            "data": data,
+        }
+        # write to a temporary file first, a crash must not leave a truncated manifest
+        tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(manifest, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, manifest_path)
+        self.manifest_hash = self._manifest_hash(manifest)
+        return data
+
+    @staticmethod
+    def _manifest_hash(manifest: dict[str, Any]) -> str:
+        # a rebuilt manifest gets a new hash, even if the config did not change
+        return hashlib.sha256(
+            json.dumps(
+                [
+                    manifest["version"],
+                    manifest["config_hash"],
+                    manifest["source_hash"],
+                    manifest["created_at"],
+                ]
+            ).encode()
+        ).hexdigest()
+
+    def _iter_rows(
+        self, dataset: Dataset, columns: list[str], batch_size: int = 256
+    ) -> Iterator[dict[str, Any]]:
+        """
+        Iterate over the rows of `dataset` in batches. Image columns are not
+        decoded, their values are `{"bytes", "path"}` dicts for `prepare_image`.
+        """
+        for column in columns:
+            if isinstance(dataset.features[column], HFImage):
+                dataset = dataset.cast_column(column, HFImage(decode=False))
+        for batch in dataset.select_columns(columns).iter(batch_size=batch_size):
+            for values in zip(*(batch[column] for column in columns)):
+                yield dict(zip(columns, values))
+
+    def _process_map(
+        self,
+        fn: Callable,
+        jobs: Iterable[tuple],
+        total: int | None = None,
+        desc: str | None = None,
+    ) -> list[Any]:
+        """
+        `[fn(*job) for job in jobs]` in a process pool. `jobs` is consumed lazily
+        with a bounded number of jobs in flight, so the encoded images of a whole
+        split are not held in memory.
+        """
+        num_workers = self.num_workers or os.cpu_count() or 1
+        progress = tqdm(total=total, desc=desc, leave=False)
+        results = []
+        if num_workers == 1 or (total is not None and total < 2 * num_workers):
+            for job in jobs:
+                results.append(fn(*job))
+                progress.update(1)
+            progress.close()
+            return results
+
+        with ProcessPoolExecutor(max_workers=num_workers) as pool:
+            in_flight: deque = deque()
+            for job in jobs:
+                in_flight.append(pool.submit(fn, *job))
+                if len(in_flight) >= 4 * num_workers:
+                    results.append(in_flight.popleft().result())
+                    progress.update(1)
+            while in_flight:
+                results.append(in_flight.popleft().result())
+                progress.update(1)
+        progress.close()
+        return results
+
+    def _prepare_images(
+        self, jobs: Iterable[tuple], total: int | None = None
+    ) -> list[str]:
+        """
+        Write the images of `jobs`, `(source, path_stem, max_size, rotation)` tuples
+        of `prepare_image` arguments, in parallel and return their paths in order.
+        """
+        return self._process_map(
+            prepare_image, jobs, total, desc=f"{self.name}: Preparing images"
+        )
+
     def bytes_to_image(self, image_bytes: bytes):
         return Image.open(io.BytesIO(image_bytes))
 
@@ -143,17 +373,15 @@ class BenchmarkDataset:
         return self.dataset_name
 
     def _convert_pdf_to_images(self, pdf_paths: list[str], cache_dir: str):
-        pdf2image_mapping = {}
-        for pdf_path in tqdm(
-            pdf_paths,
+        outdir = os.path.join(cache_dir, "pdf_images")
+        os.makedirs(outdir, exist_ok=True)
+        all_save_paths = self._process_map(
+            convert_pdf2image,
+            ((pdf_path, outdir) for pdf_path in pdf_paths),
+            total=len(pdf_paths),
             desc=f"{self.name}: Converting pdfs to images",
-            leave=False,
-        ):
-            outdir = os.path.join(cache_dir, "pdf_images")
-            os.makedirs(outdir, exist_ok=True)
-            save_paths = convert_pdf2image(pdf_path, outdir)
-            pdf2image_mapping[pdf_path] = save_paths
-        return pdf2image_mapping
+        )
+        return dict(zip(pdf_paths, all_save_paths))
 
     def vis_random_sample(self):
         import matplotlib.pyplot as plt
@@ -204,7 +432,4 @@ class BenchmarkDataset:
         return list(set(all_fields))
 
     def resize_image(self, image: Image.Image, max_size: int = 1024):
-        width, height = image.size
-        if width > max_size or height > max_size:
-            image = image.resize((max_size, max_size))
-        return image
+        return resize_image(image, max_size)
@@ -41,7 +41,16 @@ class NanonetsLongDocBench(BenchmarkDataset):
     ):
         cache_dir = self._get_cache_dir(self.name, cache_dir)
         self.additional_docs_count = additional_docs_count
-        data = self._load_data(hf_name, test_split, max_samples, cache_dir)
+        data = self._load_or_build_data(
+            cache_dir,
+            {
+                "hf_name": hf_name,
+                "test_split": test_split,
+                "max_samples": max_samples,
+                "additional_docs_count": additional_docs_count,
+            },
+            lambda: self._load_data(hf_name, test_split, max_samples, cache_dir),
+        )
         super().__init__(self.name, data, cache_dir)
 
     def _get_kie_data(self, ground_truth: str) -> dict:
@@ -93,28 +102,34 @@ class NanonetsLongDocBench(BenchmarkDataset):
             max_samples = min(max_samples, len(test_data))
             test_data = test_data.select(range(max_samples))
 
-        additional_docs_image_paths = []
-        for i in tqdm(
-            range(len(additional_docs)),
-            desc=f"{self.name}: Converting additional docs",
-            leave=False,
-        ):
-            data_point = additional_docs[i]
-            image = data_point["image"]
-            image_path = os.path.join(cache_dir, f"additional_docs_{i}.png")
-            image = self.resize_image(image)
-            image.save(image_path)
-            additional_docs_image_paths.append(image_path)
+        additional_docs_image_paths = self._prepare_images(
+            (
+                (row["image"], os.path.join(cache_dir, f"additional_docs_{i}"), 1024)
+                for i, row in enumerate(self._iter_rows(additional_docs, ["image"]))
+            ),
+            total=len(additional_docs),
+        )
+        ground_truths = []
+
+        def image_jobs():
+            for i, row in enumerate(
+                self._iter_rows(test_data, ["image", "ground_truth"])
+            ):
+                ground_truths.append(row["ground_truth"])
+                yield row["image"], os.path.join(cache_dir, f"{i}"), 1024
+
+        image_paths = self._prepare_images(image_jobs(), total=len(test_data))
 
         ## convert the data to the format of the BenchmarkDataset
         data = []
-        for i in tqdm(
-            range(len(test_data)),
-            desc=f"{self.name}: Converting data",
-            leave=False,
+        for i, (image_path, ground_truth) in enumerate(
+            tqdm(
+                zip(image_paths, ground_truths),
+                total=len(image_paths),
+                desc=f"{self.name}: Converting data",
+                leave=False,
+            )
         ):
-            data_point = test_data[i]
-            image, ground_truth = data_point["image"], data_point["ground_truth"]
             gt_answer = self._get_kie_data(ground_truth)
 
             # select a random field to ask
@@ -130,10 +145,6 @@ class NanonetsLongDocBench(BenchmarkDataset):
             random_image_order = random.sample(
                 additional_docs_image_paths, self.additional_docs_count
             )
-            # save the image
-            image_path = os.path.join(cache_dir, f"{i}.png")
-            image = self.resize_image(image)
-            image.save(image_path)
 
             # Create 4 different lists with test image inserted at different positions
             insertion_points = [30, 60]
@@ -12,7 +12,6 @@ import os
 
 from datasets import Dataset
 from datasets import load_dataset
-from tqdm import tqdm
 
 from docext.benchmark.vlm_datasets.ds import BenchmarkData
 from docext.benchmark.vlm_datasets.ds import BenchmarkDataset
@@ -32,8 +31,10 @@ class NanonetsCls(BenchmarkDataset):
         cache_dir: str | None = None,
     ):
         cache_dir = self._get_cache_dir(self.name, cache_dir)
-        data: list[BenchmarkData] = self._load_data(
-            hf_name, test_split, max_samples, cache_dir
+        data: list[BenchmarkData] = self._load_or_build_data(
+            cache_dir,
+            {"hf_name": hf_name, "test_split": test_split, "max_samples": max_samples},
+            lambda: self._load_data(hf_name, test_split, max_samples, cache_dir),
         )
         super().__init__(self.name, data, cache_dir)
 
@@ -42,17 +43,13 @@ class NanonetsCls(BenchmarkDataset):
     ):
         if max_samples is None or max_samples <= 0:
             return dataset
-        sampled_data = []
+        # read the label column once, indexing the rows would decode the images
+        labels = dataset["label"]
+        sampled_ids = []
         for class_label in class_labels:
-            class_ids = [
-                i for i in range(len(dataset)) if dataset[i]["label"] == class_label
-            ]
-            sorted_class_ids = sorted(class_ids)
-            if len(class_ids) > max_samples:
-                sampled_data.extend(dataset.select(sorted_class_ids[:max_samples]))
-            else:
-                sampled_data.extend(dataset.select(sorted_class_ids))
-        return sampled_data
+            class_ids = [i for i, label in enumerate(labels) if label == class_label]
+            sampled_ids.extend(class_ids[:max_samples])
+        return dataset.select(sampled_ids)
 
     def _load_data(
         self,
@@ -69,23 +66,22 @@ class NanonetsCls(BenchmarkDataset):
             else test_data
         )
 
-        data = []
-        for i in tqdm(
-            range(len(test_data)), desc=f"{self.name}: Converting data", leave=False
-        ):
-            data_point = test_data[i]
-            images, label = (
-                [self.bytes_to_image(image) for image in data_point["image"]],
-                data_point["label"],
-            )
-            # save the image
-            image_paths = []
-            for j, image in enumerate(images):
-                image_path = os.path.join(cache_dir, f"{i}_{j}.png")
-                image = self.resize_image(image)
-                image.save(image_path)
-                image_paths.append(image_path)
+        labels, num_pages = [], []
+
+        def image_jobs():
+            for i, row in enumerate(self._iter_rows(test_data, ["image", "label"])):
+                labels.append(row["label"])
+                num_pages.append(len(row["image"]))
+                for j, image in enumerate(row["image"]):
+                    yield image, os.path.join(cache_dir, f"{i}_{j}"), 1024
 
+        all_image_paths = self._prepare_images(image_jobs())
+
+        data = []
+        start = 0
+        for label, pages in zip(labels, num_pages):
+            image_paths = all_image_paths[start : start + pages]
+            start += pages
             data.append(
                 BenchmarkData(
                     image_paths=image_paths,
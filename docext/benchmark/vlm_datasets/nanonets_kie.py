@@ -12,8 +12,6 @@ from __future__ import annotations
 
 import os
 
-from tqdm import tqdm
-
 from datasets import Dataset
 from datasets import load_dataset
 from docext.benchmark.vlm_datasets.ds import BenchmarkData
@@ -34,8 +32,10 @@ class NanonetsKIE(BenchmarkDataset):
         cache_dir: str | None = None,
     ):
         cache_dir = self._get_cache_dir(self.name, cache_dir)
-        data: list[BenchmarkData] = self._load_data(
-            hf_name, test_split, max_samples, cache_dir
+        data: list[BenchmarkData] = self._load_or_build_data(
+            cache_dir,
+            {"hf_name": hf_name, "test_split": test_split, "max_samples": max_samples},
+            lambda: self._load_data(hf_name, test_split, max_samples, cache_dir),
         )
         super().__init__(self.name, data, cache_dir)
 
@@ -51,19 +51,20 @@ class NanonetsKIE(BenchmarkDataset):
             max_samples = min(max_samples, len(test_data))
             test_data = test_data.select(range(max_samples))
 
-        data = []
-        for i in tqdm(
-            range(len(test_data)), desc=f"{self.name}: Converting data", leave=False
-        ):
-            data_point = test_data[i]
-            image, label = (
-                self.bytes_to_image(data_point["image"]),
-                data_point["annotations"],
-            )
-            # save the image
-            image_path = os.path.join(cache_dir, f"{i}.png")
-            image.save(image_path)
+        labels = []
 
+        def image_jobs():
+            for i, row in enumerate(
+                self._iter_rows(test_data, ["image", "annotations"])
+            ):
+                labels.append(row["annotations"])
+                yield row["image"], os.path.join(cache_dir, f"{i}")
+
+        # the images are written as they are, without a decode and png encode
+        image_paths = self._prepare_images(image_jobs(), total=len(test_data))
+
+        data = []
+        for image_path, label in zip(image_paths, labels):
             data.append(
                 BenchmarkData(
                     image_paths=[image_path],
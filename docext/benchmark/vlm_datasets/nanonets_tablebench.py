@@ -25,8 +25,10 @@ class NanonetsTableBench(BenchmarkDataset):
         cache_dir: str | None = None,
     ):
         cache_dir = self._get_cache_dir(self.name, cache_dir)
-        data: list[BenchmarkData] = self._load_data(
-            hf_name, test_split, max_samples, cache_dir
+        data: list[BenchmarkData] = self._load_or_build_data(
+            cache_dir,
+            {"hf_name": hf_name, "test_split": test_split, "max_samples": max_samples},
+            lambda: self._load_data(hf_name, test_split, max_samples, cache_dir),
         )
         super().__init__(self.name, data, cache_dir)
 
@@ -44,19 +46,25 @@ class NanonetsTableBench(BenchmarkDataset):
         if max_samples and max_samples > 0:
             max_samples = min(max_samples, len(test_data))
             test_data = test_data.select(range(max_samples))
+        annotations = []
+
+        def image_jobs():
+            for i, row in enumerate(
+                self._iter_rows(test_data, ["images", "annotation"])
+            ):
+                annotations.append(row["annotation"])
+                yield row["images"], os.path.join(cache_dir, f"{i}")
+
+        image_paths = self._prepare_images(image_jobs(), total=len(test_data))
+
         data = []
-        for i in tqdm(
-            range(len(test_data)), desc=f"{self.name}: Converting data", leave=False
+        for image_path, annotation in tqdm(
+            zip(image_paths, annotations),
+            total=len(image_paths),
+            desc=f"{self.name}: Converting data",
+            leave=False,
         ):
-            data_point = test_data[i]
-            image, label = (
-                self.bytes_to_image(data_point["images"]),
-                self.parse_annotations(data_point["annotation"]),
-            )
-            # save the image
-            image_path = os.path.join(cache_dir, f"{i}.png")
-            image.save(image_path)
-
+            label = self.parse_annotations(annotation)
             data.append(
                 BenchmarkData(
                     image_paths=[image_path],
@@ -11,8 +11,6 @@ import os
 import random
 from typing import Optional
 
-from tqdm import tqdm
-
 from datasets import load_dataset
 from docext.benchmark.vlm_datasets.ds import BenchmarkData
 from docext.benchmark.vlm_datasets.ds import BenchmarkDataset
@@ -33,8 +31,15 @@ class OCRHandwritingHAT2023(BenchmarkDataset):
     ):
         cache_dir = self._get_cache_dir(self.name, cache_dir)
         self.rotation = rotation
-        data: list[BenchmarkData] = self._load_data(
-            hf_name, test_split, max_samples, cache_dir
+        data: list[BenchmarkData] = self._load_or_build_data(
+            cache_dir,
+            {
+                "hf_name": hf_name,
+                "test_split": test_split,
+                "max_samples": max_samples,
+                "rotation": rotation,
+            },
+            lambda: self._load_data(hf_name, test_split, max_samples, cache_dir),
         )
         super().__init__(self.name, data, cache_dir)
 
@@ -51,21 +56,21 @@ class OCRHandwritingHAT2023(BenchmarkDataset):
             if max_samples and max_samples > 0
             else test_data
         )
-        data = []
-        for i in tqdm(
-            range(len(test_data)), desc=f"{self.name}: Converting data", leave=False
-        ):
-            data_point = test_data[i]
-            image, ocr_text = data_point["image"], data_point["text"]
+        ocr_texts = []
 
-            if self.rotation:
-                random.seed(i)
-                small_angle = random.choice(range(-5, 5))
-                image = image.rotate(small_angle, expand=True)
+        def image_jobs():
+            for i, row in enumerate(self._iter_rows(test_data, ["image", "text"])):
+                ocr_texts.append(row["text"])
+                rotation = None
+                if self.rotation:
+                    random.seed(i)
+                    rotation = random.choice(range(-5, 5))
+                yield row["image"], os.path.join(cache_dir, f"{i}"), None, rotation
 
-            # save the image
-            image_path = os.path.join(cache_dir, f"{i}.png")
-            image.save(image_path)
+        image_paths = self._prepare_images(image_jobs(), total=len(test_data))
+
+        data = []
+        for image_path, ocr_text in zip(image_paths, ocr_texts):
             data.append(
                 BenchmarkData(
                     image_paths=[image_path],
@@ -5,6 +5,11 @@ import os
 import requests
 from litellm import completion
 
+from docext.core.metrics import record_usage
+from docext.core.metrics import VLM_REQUESTS
+from docext.core.trace import Span
+from docext.core.trace import stage
+
 
 def sync_request(
     messages: list[dict],
@@ -12,6 +17,7 @@ def sync_request(
     max_tokens: int = 12000,
     num_completions: int = 1,
     format: dict | None = None,
+    span: Span | None = None,
 ):
     vlm_url = os.getenv("VLM_MODEL_URL", "")
     if vlm_url == "":
@@ -47,5 +53,13 @@ def sync_request(
         if any("json" in m.get("text", "").lower() for m in messages if isinstance(m, dict)):
             completion_args["response_format"] = {"type": "json_object"}
 
-    response = completion(**completion_args)
-    return response.json()
+    try:
+        with stage("request", span, model=model_name):
+            response = completion(**completion_args)
+    except Exception:
+        VLM_REQUESTS.labels(model_name, "error").inc()
+        raise
+    VLM_REQUESTS.labels(model_name, "success").inc()
+    response = response.json()
+    record_usage(model_name, response.get("usage"))
+    return response
@@ -1,6 +1,9 @@
 from __future__ import annotations
 
+from collections.abc import Sequence
+from concurrent.futures import Future
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import Dict
 from typing import Union
 
@@ -11,8 +14,12 @@ from loguru import logger
 
 from docext.core.client import sync_request
 from docext.core.confidence import get_fields_confidence_score_messages_numeric
+from docext.core.metrics import IN_FLIGHT
 from docext.core.prompts import get_fields_messages
 from docext.core.prompts import get_tables_messages
+from docext.core.trace import Span
+from docext.core.trace import stage
+from docext.core.trace import Trace
 from docext.core.utils import convert_files_to_images
 from docext.core.utils import resize_images
 from docext.core.utils import validate_fields_and_tables
@@ -23,12 +30,14 @@ def extract_fields_from_documents(
     file_paths: list[str],
     model_name: str,
     fields: list[dict],
+    span: Span | None = None,
 ):
     if len(fields) == 0:
         return pd.DataFrame()
     field_names = [field["name"] for field in fields]
     fields_description = [field.get("description", "") for field in fields]
-    messages = get_fields_messages(field_names, fields_description, file_paths)
+    with stage("encode", span):
+        messages = get_fields_messages(field_names, fields_description, file_paths)
 
     format_fields = {
         "type": "object",
@@ -36,9 +45,9 @@ def extract_fields_from_documents(
     }
 
     logger.info(f"Sending request to {model_name}")
-    response = sync_request(messages, model_name, format=format_fields)["choices"][0][
-        "message"
-    ]["content"]
+    response = sync_request(messages, model_name, format=format_fields, span=span)[
+        "choices"
+    ][0]["message"]["content"]
     logger.info(f"Response: {response}")
 
     # conf score
@@ -60,11 +69,13 @@ def extract_fields_from_documents(
         messages,
         model_name,
         format=format_fields_conf_score,
+        span=span,
     )["choices"][0]["message"]["content"]
     logger.info(f"Response conf score: {response_conf_score}")
 
-    extracted_fields = json_repair.loads(response)
-    conf_scores = json_repair.loads(response_conf_score)
+    with stage("parse", span):
+        extracted_fields = json_repair.loads(response)
+        conf_scores = json_repair.loads(response_conf_score)
 
     logger.info(f"Extracted fields: {extracted_fields}")
     logger.info(f"Conf scores: {conf_scores}")
@@ -102,6 +113,7 @@ def extract_tables_from_documents(
     file_paths: list[str],
     model_name: str,
     columns: list[dict],
+    span: Span | None = None,
 ):
     if len(columns) == 0:
         return pd.DataFrame()
@@ -109,10 +121,13 @@ def extract_tables_from_documents(
     columns_description = [
         column.get("description", "") for column in columns if column["type"] == "table"
     ]
-    messages = get_tables_messages(columns_names, columns_description, file_paths)
+    with stage("encode", span):
+        messages = get_tables_messages(columns_names, columns_description, file_paths)
 
     logger.info(f"Sending request to {model_name}")
-    response = sync_request(messages, model_name)["choices"][0]["message"]["content"]
+    response = sync_request(messages, model_name, span=span)["choices"][0]["message"][
+        "content"
+    ]
     logger.info(f"Response: {response}")
 
     try:
@@ -143,7 +158,8 @@ def extract_tables_from_documents(
 
         first_table = "\n".join(cleaned_lines)
 
-        df = mdpd.from_md(first_table)
+        with stage("parse", span):
+            df = mdpd.from_md(first_table)
 
         # Validate column count
         if len(df.columns) != len(columns_names):
@@ -171,43 +187,72 @@ def extract_tables_from_documents(
         return pd.DataFrame(columns=columns_names)
 
 
+def _end_span(span: Span, future: Future):
+    span.end()
+
+
+def _attach_trace(fields_df: pd.DataFrame, trace: Trace | None):
+    if trace is not None:
+        trace.end()
+        fields_df.attrs["trace"] = trace
+    return fields_df
+
+
 def extract_information(
-    file_inputs: list[tuple],
+    file_inputs: Sequence[tuple | str],
     model_name: str,
     max_img_size: int,
     fields_and_tables: dict[str, list[dict]] | pd.DataFrame,
+    trace: Trace | None = None,
 ):
-    fields_and_tables = validate_fields_and_tables(fields_and_tables)
-    if len(fields_and_tables["fields"]) == 0 and len(fields_and_tables["tables"]) == 0:
-        return pd.DataFrame(), pd.DataFrame()
-    file_paths: list[str] = [
-        file_input[0] if isinstance(file_input, tuple) else file_input
-        for file_input in file_inputs
-    ]
-    validate_file_paths(file_paths)
-    file_paths = convert_files_to_images(file_paths)
-    resize_images(file_paths, max_img_size)
-
-    # call fields and tables extraction in parallel
-    with ThreadPoolExecutor() as executor:
-        future_fields = executor.submit(
-            extract_fields_from_documents,
-            file_paths,
-            model_name,
-            fields_and_tables["fields"],
-        )
-        future_tables = executor.submit(
-            extract_tables_from_documents,
-            file_paths,
-            model_name,
-            fields_and_tables["tables"],
-        )
+    """
+    Extract fields and tables from the documents. Pass a `Trace` to record the
+    time spent in each stage, the trace is also attached to `fields_df.attrs["trace"]`.
+    """
+    with IN_FLIGHT.labels("extract").track_inprogress():
+        fields_and_tables = validate_fields_and_tables(fields_and_tables)
+        if len(fields_and_tables["fields"]) == 0 and len(fields_and_tables["tables"]) == 0:
+            return _attach_trace(pd.DataFrame(), trace), pd.DataFrame()
+        file_paths: list[str] = [
+            file_input[0] if isinstance(file_input, tuple) else file_input
+            for file_input in file_inputs
+        ]
+        validate_file_paths(file_paths)
+        with stage("rasterize", trace):
+            file_paths = convert_files_to_images(file_paths)
+        with stage("resize", trace):
+            resize_images(file_paths, max_img_size)
 
-        fields_df = future_fields.result()
-        tables_df = future_tables.result()
-    
-    # Group fields by document_index for better display
-    if not fields_df.empty and 'document_index' in fields_df.columns:
-        fields_df = fields_df.sort_values(['document_index', 'fields'])
-    
-    return fields_df, tables_df
+        # call fields and tables extraction in parallel
+        fields_span = trace.add_child("fields") if trace is not None else None
+        tables_span = trace.add_child("tables") if trace is not None else None
+        with ThreadPoolExecutor() as executor:
+            future_fields = executor.submit(
+                extract_fields_from_documents,
+                file_paths,
+                model_name,
+                fields_and_tables["fields"],
+                fields_span,
+            )
+            future_tables = executor.submit(
+                extract_tables_from_documents,
+                file_paths,
+                model_name,
+                fields_and_tables["tables"],
+                tables_span,
+            )
+            for future, span in [
+                (future_fields, fields_span),
+                (future_tables, tables_span),
+            ]:
+                if span is not None:
+                    future.add_done_callback(partial(_end_span, span))
+
+            fields_df = future_fields.result()
+            tables_df = future_tables.result()
+
+        # Group fields by document_index for better display
+        if not fields_df.empty and 'document_index' in fields_df.columns:
+            fields_df = fields_df.sort_values(['document_index', 'fields'])
+
+        return _attach_trace(fields_df, trace), tables_df
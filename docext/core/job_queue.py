@@ -0,0 +1,225 @@
+"""
+Durable local job queue for batch extraction and pdf2md conversion.
+
+Jobs are stored in a single SQLite file, so the queue survives crashes of the
+producer and the workers, and can be shared by several `docext worker`
+processes on the same host (or on a shared volume).
+
+A worker claims a job by leasing it for `visibility_timeout` seconds. If the
+worker dies, the lease expires and the job becomes visible to other workers
+again. Failed jobs are retried until `max_attempts` is reached.
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+JOB_KINDS = ["extract", "pdf2md"]
+
+
+@dataclass
+class Job:
+    id: int
+    kind: str
+    payload: dict[str, Any]
+    status: str
+    attempts: int
+    max_attempts: int
+    progress: dict[str, Any]
+    result: Any = None
+    error: str | None = None
+
+
+class JobQueue:
+    def __init__(self, db_path: str, timeout: float = 30.0):
+        self.db_path = db_path
+        self.timeout = timeout
+        dirname = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(dirname, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    visible_at REAL NOT NULL,
+                    lease_owner TEXT,
+                    progress TEXT NOT NULL DEFAULT '{}',
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status_visible ON jobs (status, visible_at)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        # a new connection per call keeps the queue safe to use from multiple
+        # threads and processes. `isolation_level=None` lets us control the
+        # transactions explicitly with `BEGIN IMMEDIATE`.
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, kind: str, payload: dict[str, Any], max_attempts: int = 3):
+        assert kind in JOB_KINDS, f"Job kind must be one of {JOB_KINDS}"
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, payload, status, max_attempts, visible_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload), QUEUED, max_attempts, now, now, now),
+            )
+            return cursor.lastrowid
+
+    def claim(self, worker_id: str, visibility_timeout: float = 600.0) -> Job | None:
+        """
+        Lease the oldest visible job. A job is visible if it is queued and its
+        retry delay has passed, or if it is running but its lease has expired.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # jobs whose lease expired on their last attempt will not be retried
+                conn.execute(
+                    "UPDATE jobs SET status = ?, lease_owner = NULL, error = ?, updated_at = ? "
+                    "WHERE status = ? AND visible_at <= ? AND attempts >= max_attempts",
+                    (FAILED, "Lease expired on the last attempt", now, RUNNING, now),
+                )
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE status IN (?, ?) AND visible_at <= ? "
+                    "ORDER BY id LIMIT 1",
+                    (QUEUED, RUNNING, now),
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_owner = ?, "
+                        "visible_at = ?, updated_at = ? WHERE id = ?",
+                        (RUNNING, worker_id, now + visibility_timeout, now, row[0]),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return self.get(row[0])
+
+    def heartbeat(self, job_id: int, worker_id: str, visibility_timeout: float):
+        """
+        Extend the lease of a running job. Returns False if the lease was lost.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET visible_at = ?, updated_at = ? "
+                "WHERE id = ? AND status = ? AND lease_owner = ?",
+                (now + visibility_timeout, now, job_id, RUNNING, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def save_progress(self, job_id: int, worker_id: str, progress: dict[str, Any]):
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET progress = ?, updated_at = ? "
+                "WHERE id = ? AND status = ? AND lease_owner = ?",
+                (json.dumps(progress), time.time(), job_id, RUNNING, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: int, worker_id: str, result: Any):
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = NULL, lease_owner = NULL, "
+                "updated_at = ? WHERE id = ? AND status = ? AND lease_owner = ?",
+                (DONE, json.dumps(result), time.time(), job_id, RUNNING, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, job_id: int, worker_id: str, error: str, retry_delay: float = 0.0):
+        """
+        Record a failed attempt. The job is requeued after `retry_delay` seconds
+        until it runs out of attempts, then it is marked as failed.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts < max_attempts THEN ? ELSE ? END, "
+                "visible_at = ?, lease_owner = NULL, error = ?, updated_at = ? "
+                "WHERE id = ? AND status = ? AND lease_owner = ?",
+                (
+                    QUEUED,
+                    FAILED,
+                    now + retry_delay,
+                    error,
+                    now,
+                    job_id,
+                    RUNNING,
+                    worker_id,
+                ),
+            )
+            return cursor.rowcount == 1
+
+    def requeue_failed(self):
+        """
+        Give all failed jobs a fresh set of attempts.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, attempts = 0, visible_at = ?, updated_at = ? "
+                "WHERE status = ?",
+                (QUEUED, time.time(), time.time(), FAILED),
+            )
+            return cursor.rowcount
+
+    def get(self, job_id: int) -> Job | None:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, kind, payload, status, attempts, max_attempts, progress, result, error "
+                "FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return Job(
+            id=row[0],
+            kind=row[1],
+            payload=json.loads(row[2]),
+            status=row[3],
+            attempts=row[4],
+            max_attempts=row[5],
+            progress=json.loads(row[6]),
+            result=json.loads(row[7]) if row[7] is not None else None,
+            error=row[8],
+        )
+
+    def stats(self) -> dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        counts = {status: 0 for status in [QUEUED, RUNNING, DONE, FAILED]}
+        counts.update({status: count for status, count in rows})
+        return counts
@@ -0,0 +1,368 @@
+"""
+Minimal Prometheus-style metrics registry for docext.
+
+The metrics are plain in-process counters, gauges and histograms, rendered in the
+Prometheus text exposition format by `REGISTRY.render()` and served on `/metrics`
+by `start_metrics_server`. Recording a value is a dict lookup and a few additions
+under a lock, so it is cheap enough for the streaming hot path.
+"""
+from __future__ import annotations
+
+import bisect
+import functools
+import inspect
+import threading
+import time
+from collections.abc import Callable
+from collections.abc import Iterator
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from loguru import logger
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    25.0,
+    60.0,
+    120.0,
+    300.0,
+)
+
+
+def _escape_label_value(value: str):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_names: tuple[str, ...], label_values: tuple[str, ...]):
+    if not label_names:
+        return ""
+    pairs = [
+        f'{name}="{_escape_label_value(str(value))}"'
+        for name, value in zip(label_names, label_values)
+    ]
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+    suffix = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str, **kwargs: str):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        assert len(values) == len(
+            self.labelnames
+        ), f"{self.name} expects labels {self.labelnames}"
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name}{self.suffix} {self.documentation}",
+            f"# TYPE {self.name}{self.suffix} {self.type_name}",
+        ]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    type_name = "counter"
+    suffix = "_total"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for key, child in list(self._children.items()):
+            yield f"{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0.0
+        self.function: Callable[[], float] | None = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """
+        Compute the value when the metrics are scraped, eg: the length of a queue.
+        """
+        self.function = function
+
+    def get(self):
+        if self.function is not None:
+            try:
+                return float(self.function())
+            except Exception:
+                return float("nan")
+        return self.value
+
+    @contextmanager
+    def track_inprogress(self):
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def _samples(self):
+        for key, child in list(self._children.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.get())}"
+
+
+class _HistogramChild:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last bucket is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _samples(self):
+        for key, child in list(self._children.items()):
+            with child._lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(
+                    self.labelnames + ("le",), key + (_format_value(bound),)
+                )
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            # registering the same name again returns the existing metric, this
+            # keeps module reloads (eg: in notebooks) from failing
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))  # type: ignore[return-value]
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))  # type: ignore[return-value]
+
+    def histogram(
+        self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))  # type: ignore[return-value]
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_LATENCY = REGISTRY.histogram(
+    "docext_stage_latency_seconds",
+    "Latency of each processing stage (rasterize, resize, encode, request, ttft, decode, parse).",
+    ("stage",),
+)
+VLM_REQUESTS = REGISTRY.counter(
+    "docext_vlm_requests",
+    "VLM requests by model and outcome.",
+    ("model", "outcome"),
+)
+VLM_TOKENS = REGISTRY.counter(
+    "docext_vlm_tokens",
+    "Prompt (in) and completion (out) tokens by model.",
+    ("model", "direction"),
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "docext_cache_lookups",
+    "Cache lookups by cache and result (hit or miss).",
+    ("cache", "result"),
+)
+IN_FLIGHT = REGISTRY.gauge(
+    "docext_in_flight_requests",
+    "Requests currently being processed by endpoint.",
+    ("endpoint",),
+)
+GRADIO_QUEUE_DEPTH = REGISTRY.gauge(
+    "docext_gradio_queue_depth",
+    "Number of gradio requests waiting for a concurrency slot.",
+)
+
+
+def queued(fn: Callable, concurrency_limit: int | None) -> Callable:
+    """
+    Wrap a gradio handler so that at most `concurrency_limit` calls run at the same
+    time, the other calls wait in the wrapper and are counted in
+    `docext_gradio_queue_depth`. Register the wrapped handler with
+    `concurrency_limit=None`, the calls from the UI and from the API then go
+    through the same counting, and a call is uncounted even if it fails. The
+    waiting calls hold a gradio worker thread (`max_threads` of `launch`).
+    """
+    slots = threading.BoundedSemaphore(concurrency_limit) if concurrency_limit else None
+
+    @contextmanager
+    def slot():
+        GRADIO_QUEUE_DEPTH.labels().inc()
+        try:
+            if slots is not None:
+                slots.acquire()
+        finally:
+            GRADIO_QUEUE_DEPTH.labels().dec()
+        try:
+            yield
+        finally:
+            if slots is not None:
+                slots.release()
+
+    if inspect.isgeneratorfunction(fn):
+
+        @functools.wraps(fn)
+        def generator_wrapper(*args, **kwargs):
+            with slot():
+                yield from fn(*args, **kwargs)
+
+        return generator_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with slot():
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def record_usage(model_name: str, usage: dict | None):
+    if not usage:
+        return
+    VLM_TOKENS.labels(model_name, "in").inc(usage.get("prompt_tokens") or 0)
+    VLM_TOKENS.labels(model_name, "out").inc(usage.get("completion_tokens") or 0)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes every few seconds would flood the logs
+        pass
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    """
+    Serve the metrics on http://host:port/metrics from a daemon thread.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
@@ -2,11 +2,19 @@ from __future__ import annotations
 
 import json
 import os
+import time
 from collections.abc import Generator
 
 import requests
 from loguru import logger
 
+from docext.core.metrics import IN_FLIGHT
+from docext.core.metrics import record_usage
+from docext.core.metrics import STAGE_LATENCY
+from docext.core.metrics import VLM_REQUESTS
+from docext.core.trace import Span
+from docext.core.trace import stage
+from docext.core.trace import Trace
 from docext.core.utils import convert_files_to_images
 from docext.core.utils import encode_image
 from docext.core.utils import resize_images
@@ -18,9 +26,13 @@ def stream_request(
     model_name: str,
     max_tokens: int = 8000,
     temperature: float = 0.0,
+    span: Span | None = None,
 ) -> Generator[str]:
     """
     Make a streaming request to the vLLM server running on localhost:8000
+
+    If `span` is given, `ttft` (server queue + prefill) and `decode` child spans are
+    added to it.
     """
     vlm_url = os.getenv("VLM_MODEL_URL", "")
     if vlm_url == "":
@@ -35,6 +47,7 @@ def stream_request(
         "max_tokens": max_tokens,
         "temperature": temperature,
         "stream": True,  # Enable streaming
+        "stream_options": {"include_usage": True},  # token counts for the metrics
     }
 
     headers = {
@@ -45,6 +58,10 @@ def stream_request(
     # Make streaming request
     url = f"{vlm_url}/chat/completions"
 
+    start_time = time.perf_counter()
+    start_time_ns = time.time_ns()
+    first_token_time = None
+    first_token_time_ns = None
     try:
         with requests.post(url, json=payload, headers=headers, stream=True) as response:
             response.raise_for_status()
@@ -58,124 +75,212 @@ def stream_request(
                             break
                         try:
                             json_data = json.loads(data)
+                            if json_data.get("usage"):
+                                record_usage(model_name, json_data["usage"])
                             if "choices" in json_data and len(json_data["choices"]) > 0:
                                 choice = json_data["choices"][0]
                                 if "delta" in choice and "content" in choice["delta"]:
                                     content = choice["delta"]["content"]
                                     if content:
+                                        if first_token_time is None:
+                                            first_token_time = time.perf_counter()
+                                            first_token_time_ns = time.time_ns()
+                                            STAGE_LATENCY.labels("ttft").observe(
+                                                first_token_time - start_time
+                                            )
                                         yield content
                         except json.JSONDecodeError:
                             continue
     except requests.exceptions.RequestException as e:
+        VLM_REQUESTS.labels(model_name, "error").inc()
         logger.error(f"Error making streaming request: {e}")
         raise
+    VLM_REQUESTS.labels(model_name, "success").inc()
+    if first_token_time is not None:
+        STAGE_LATENCY.labels("decode").observe(time.perf_counter() - first_token_time)
+        if span is not None:
+            span.add_child("ttft", start_time_ns, first_token_time_ns)
+            span.add_child("decode", first_token_time_ns, time.time_ns())
+
+
+PDF2MD_USER_PROMPT = """Extract the text from the above document as if you were reading it naturally. Return the tables in html format. Watermarks should be wrapped in brackets. Ex: <watermark>OFFICIAL COPY</watermark>. Page numbers should be wrapped in brackets. Ex: <page_number>14</page_number> or <page_number>9/22</page_number>. Prefer using ☐ and ☑ for check boxes."""
+
+
+def get_pdf2md_messages(file_path: str) -> list[dict]:
+    content = [
+        {
+            "type": "image_url",
+            "image_url": {"url": f"data:image/jpeg;base64,{encode_image(file_path)}"},
+        },
+        {"type": "text", "text": PDF2MD_USER_PROMPT},
+    ]
+    return [{"role": "user", "content": content}]
+
+
+def convert_page_to_markdown(
+    file_path: str, model_name: str, max_gen_tokens: int, span: Span | None = None
+):
+    """
+    Convert a single (already resized) page image to markdown. Used by the batch
+    workers, which checkpoint their progress page by page.
+    """
+    from docext.core.client import sync_request
+
+    with stage("encode", span):
+        messages = get_pdf2md_messages(file_path)
+    response = sync_request(
+        messages=messages,
+        model_name=model_name,
+        max_tokens=max_gen_tokens,
+        span=span,
+    )
+    return response["choices"][0]["message"]["content"]
+
+
+class MarkdownResult(str):
+    """
+    Markdown returned by `convert_to_markdown`, with the `trace` of the request
+    (None when no trace was passed).
+    """
+
+    trace: Trace | None = None
 
 
 def convert_to_markdown_stream(
-    file_inputs, model_name, max_img_size, concurrency_limit, max_gen_tokens
+    file_inputs,
+    model_name,
+    max_img_size,
+    concurrency_limit,
+    max_gen_tokens,
+    trace: Trace | None = None,
 ):
     """
     Generator function that yields streaming markdown conversion results
     Processes images one by one and concatenates results
+
+    Pass a `Trace` to record the time spent in each stage, with one `page` span per page.
+    The trace is ended when the generator is done.
     """
-    file_paths: list[str] = [
-        file_input[0] if isinstance(file_input, tuple) else file_input
-        for file_input in file_inputs
-    ]
-    validate_file_paths(file_paths)
-    file_paths = convert_files_to_images(file_paths)
-    resize_images(file_paths, max_img_size)
+    IN_FLIGHT.labels("pdf2md").inc()
+    try:
+        file_paths: list[str] = [
+            file_input[0] if isinstance(file_input, tuple) else file_input
+            for file_input in file_inputs
+        ]
+        validate_file_paths(file_paths)
+        with stage("rasterize", trace):
+            file_paths = convert_files_to_images(file_paths)
+        with stage("resize", trace):
+            resize_images(file_paths, max_img_size)
 
-    # Create system prompt for PDF to markdown conversion
-    user_prompt = """Extract the text from the above document as if you were reading it naturally. Return the tables in html format. Watermarks should be wrapped in brackets. Ex: <watermark>OFFICIAL COPY</watermark>. Page numbers should be wrapped in brackets. Ex: <page_number>14</page_number> or <page_number>9/22</page_number>. Prefer using ☐ and ☑ for check boxes."""
+        logger.info(
+            f"Converting {len(file_paths)} image(s) to markdown using {model_name} (processing one by one)"
+        )
 
-    logger.info(
-        f"Converting {len(file_paths)} image(s) to markdown using {model_name} (processing one by one)"
-    )
+        # Accumulate results from all pages
+        full_markdown_content = ""
 
-    # Accumulate results from all pages
-    full_markdown_content = ""
-
-    # Process each image individually
-    for i, file_path in enumerate(file_paths):
-        logger.info(f"Processing page {i + 1} of {len(file_paths)}: {file_path}")
-
-        # Build messages for this single image
-        content = [
-            {
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{encode_image(file_path)}"
-                },
-            },
-            {"type": "text", "text": user_prompt},
-        ]
+        # Process each image individually
+        for i, file_path in enumerate(file_paths):
+            logger.info(f"Processing page {i + 1} of {len(file_paths)}: {file_path}")
 
-        messages = [{"role": "user", "content": content}]
-
-        # Stream this individual page
-        page_content = ""
-        try:
-            for chunk in stream_request(
-                messages=messages,
-                model_name=model_name,
-                max_tokens=max_gen_tokens,
-            ):
-                page_content += chunk
-                # Yield accumulated content from all pages processed so far + current page
-                current_total = (
-                    full_markdown_content
-                    + f"Page {i + 1} of {len(file_paths)}\n"
-                    + page_content
-                )
-                yield current_total
-
-            # Process the completed page content and add it to the full content
-            full_markdown_content += (
-                f"Page {i + 1} of {len(file_paths)}\n" + page_content
+            page_span = (
+                trace.add_child("page", page_number=i + 1)
+                if trace is not None
+                else None
             )
-            logger.info(f"Successfully converted page {i + 1}")
 
-        except Exception as e:
-            logger.error(f"Error during streaming conversion of page {i + 1}: {e}")
-            # Fallback to non-streaming for this page
-            logger.info(f"Falling back to non-streaming request for page {i + 1}")
+            # Build messages for this single image
+            with stage("encode", page_span):
+                messages = get_pdf2md_messages(file_path)
+
+            # Stream this individual page
+            page_content = ""
             try:
-                from docext.core.client import sync_request
+                for chunk in stream_request(
+                    messages=messages,
+                    model_name=model_name,
+                    max_tokens=max_gen_tokens,
+                    span=page_span,
+                ):
+                    page_content += chunk
+                    # Yield accumulated content from all pages processed so far + current page
+                    current_total = (
+                        full_markdown_content
+                        + f"Page {i + 1} of {len(file_paths)}\n"
+                        + page_content
+                    )
+                    yield current_total
 
-                response = sync_request(
-                    messages=messages, model_name=model_name, max_tokens=max_gen_tokens
-                )
-                page_content = response["choices"][0]["message"]["content"]
+                # Process the completed page content and add it to the full content
                 full_markdown_content += (
                     f"Page {i + 1} of {len(file_paths)}\n" + page_content
                 )
-                yield full_markdown_content
-            except Exception as fallback_error:
-                logger.error(f"Fallback also failed for page {i + 1}: {fallback_error}")
-                error_content = (
-                    f"\n\n**Error processing page {i + 1}: {str(fallback_error)}**\n\n"
-                )
-                full_markdown_content += (
-                    f"Page {i + 1} of {len(file_paths)}\n" + error_content
-                )
-                yield full_markdown_content
+                logger.info(f"Successfully converted page {i + 1}")
+
+            except Exception as e:
+                logger.error(f"Error during streaming conversion of page {i + 1}: {e}")
+                # Fallback to non-streaming for this page
+                logger.info(f"Falling back to non-streaming request for page {i + 1}")
+                try:
+                    from docext.core.client import sync_request
+
+                    response = sync_request(
+                        messages=messages,
+                        model_name=model_name,
+                        max_tokens=max_gen_tokens,
+                        span=page_span,
+                    )
+                    page_content = response["choices"][0]["message"]["content"]
+                    full_markdown_content += (
+                        f"Page {i + 1} of {len(file_paths)}\n" + page_content
+                    )
+                    yield full_markdown_content
+                except Exception as fallback_error:
+                    logger.error(
+                        f"Fallback also failed for page {i + 1}: {fallback_error}"
+                    )
+                    error_content = f"\n\n**Error processing page {i + 1}: {str(fallback_error)}**\n\n"
+                    full_markdown_content += (
+                        f"Page {i + 1} of {len(file_paths)}\n" + error_content
+                    )
+                    yield full_markdown_content
+            finally:
+                if page_span is not None:
+                    page_span.end()
 
-    # print raw model response
-    logger.info(f"Raw model response:\n {full_markdown_content}")
-    logger.info("Successfully completed document conversion")
+        # print raw model response
+        logger.info(f"Raw model response:\n {full_markdown_content}")
+        logger.info("Successfully completed document conversion")
+    finally:
+        IN_FLIGHT.labels("pdf2md").dec()
+        if trace is not None:
+            trace.end()
 
 
 def convert_to_markdown(
-    file_inputs, model_name, max_img_size, concurrency_limit, max_gen_tokens
+    file_inputs,
+    model_name,
+    max_img_size,
+    concurrency_limit,
+    max_gen_tokens,
+    trace: Trace | None = None,
 ):
     """
-    Non-streaming version for backward compatibility
+    Non-streaming version for backward compatibility, the result is a
+    `MarkdownResult` with the `trace` attached.
     """
     # Get the final result from the streaming generator
     final_result = ""
     for result in convert_to_markdown_stream(
-        file_inputs, model_name, max_img_size, concurrency_limit, max_gen_tokens
+        file_inputs,
+        model_name,
+        max_img_size,
+        concurrency_limit,
+        max_gen_tokens,
+        trace=trace,
     ):
         final_result = result
-    return final_result
+    markdown = MarkdownResult(final_result)
+    markdown.trace = trace
+    return markdown
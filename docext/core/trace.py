@@ -0,0 +1,164 @@
+"""
+Opt-in per-request timing traces.
+
+Pass a `Trace` to `extract_information` or `convert_to_markdown` and it is filled
+with nested spans (rasterize, resize, encode, request, ttft, decode, parse). The
+spans use the OpenTelemetry field names (trace_id, span_id, parent_span_id,
+start_time_unix_nano, end_time_unix_nano, attributes), so the JSONL written by
+`JSONLSpanExporter` can be loaded by OTel tooling or simply with pandas:
+
+    trace = Trace("extract", attributes={"document_class": "invoice"})
+    extract_information(files, model_name, max_img_size, fields_and_tables, trace=trace)
+    print(trace.stage_durations())
+    JSONLSpanExporter("traces.jsonl").export(trace)
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+from docext.core.metrics import STAGE_LATENCY
+
+
+class Span:
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_span_id: str | None = None,
+        attributes: dict[str, Any] | None = None,
+        start_time_unix_nano: int | None = None,
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_span_id = parent_span_id
+        self.attributes = attributes or {}
+        self.start_time_unix_nano = start_time_unix_nano or time.time_ns()
+        self.end_time_unix_nano: int | None = None
+        self.children: list[Span] = []
+        self._lock = threading.Lock()
+
+    def add_child(
+        self,
+        name: str,
+        start_time_unix_nano: int | None = None,
+        end_time_unix_nano: int | None = None,
+        **attributes: Any,
+    ):
+        child = Span(
+            name,
+            self.trace_id,
+            parent_span_id=self.span_id,
+            attributes=attributes,
+            start_time_unix_nano=start_time_unix_nano,
+        )
+        child.end_time_unix_nano = end_time_unix_nano
+        # fields and tables are extracted in parallel threads
+        with self._lock:
+            self.children.append(child)
+        return child
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        child = self.add_child(name, **attributes)
+        try:
+            yield child
+        finally:
+            child.end()
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def end(self):
+        if self.end_time_unix_nano is None:
+            self.end_time_unix_nano = time.time_ns()
+
+    @property
+    def duration_s(self):
+        end = self.end_time_unix_nano or time.time_ns()
+        return (end - self.start_time_unix_nano) / 1e9
+
+    def walk(self) -> Iterator[Span]:
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_time_unix_nano,
+            "end_time_unix_nano": self.end_time_unix_nano,
+            "duration_s": self.duration_s,
+            "attributes": self.attributes,
+        }
+
+
+class Trace(Span):
+    """
+    Root span of a request.
+    """
+
+    def __init__(self, name: str = "request", attributes: dict[str, Any] | None = None):
+        super().__init__(name, uuid.uuid4().hex, attributes=attributes)
+
+    def spans(self):
+        return [span.to_dict() for span in self.walk()]
+
+    def stage_durations(self) -> dict[str, float]:
+        """
+        Total seconds per span name, eg: {"rasterize": 0.4, "request": 3.1, ...}.
+        Parallel spans (fields and tables requests) are summed.
+        """
+        durations: dict[str, float] = {}
+        for span in self.walk():
+            if span is self:
+                continue
+            durations[span.name] = durations.get(span.name, 0.0) + span.duration_s
+        return durations
+
+
+@contextmanager
+def stage(name: str, parent: Span | None = None, **attributes: Any):
+    """
+    Time a processing stage. The latency always goes to the `docext_stage_latency_seconds`
+    metric, and to a child span of `parent` when a trace is being recorded.
+    """
+    start = time.perf_counter()
+    child = parent.add_child(name, **attributes) if parent is not None else None
+    try:
+        yield child
+    finally:
+        STAGE_LATENCY.labels(name).observe(time.perf_counter() - start)
+        if child is not None:
+            child.end()
+
+
+class JSONLSpanExporter:
+    """
+    Append the spans of finished traces to a JSONL file, one span per line.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        dirname = os.path.dirname(os.path.abspath(path))
+        os.makedirs(dirname, exist_ok=True)
+
+    def export(self, trace: Trace):
+        trace.end()
+        lines = "".join(
+            json.dumps(span, ensure_ascii=False, default=str) + "\n"
+            for span in trace.spans()
+        )
+        with self._lock, open(self.path, "a") as f:
+            f.write(lines)
@@ -0,0 +1,466 @@
+"""
+Batch workers for the local job queue.
+
+Enqueue documents:
+    docext enqueue --queue_path jobs.db --kind extract --template "invoice 🧾" a.pdf b.png
+    docext enqueue --queue_path jobs.db --kind pdf2md report.pdf
+
+Start a pool of workers (add more processes, on this host or on another host that
+shares the volume, to scale throughput):
+    docext worker --queue_path jobs.db --num_workers 4 --model_name hosted_vllm/nanonets/Nanonets-OCR-s
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from typing import Any
+
+from loguru import logger
+
+from docext.core.config import TEMPLATES_FIELDS
+from docext.core.config import TEMPLATES_TABLES
+from docext.core.job_queue import Job
+from docext.core.job_queue import JOB_KINDS
+from docext.core.job_queue import JobQueue
+from docext.core.trace import JSONLSpanExporter
+from docext.core.trace import stage
+from docext.core.trace import Trace
+
+
+def get_template_fields_and_tables(template: str) -> dict[str, list[dict]]:
+    """
+    Convert a template from `docext.core.config` to the format expected by
+    `extract_information`.
+    """
+    assert (
+        template in TEMPLATES_FIELDS or template in TEMPLATES_TABLES
+    ), f"Template {template} not found in docext.core.config"
+    return {
+        "fields": [
+            {
+                "name": field["field_name"],
+                "type": "field",
+                "description": field["description"],
+            }
+            for field in TEMPLATES_FIELDS.get(template, [])
+        ],
+        "tables": [
+            {
+                "name": column["field_name"],
+                "type": "table",
+                "description": column["description"],
+            }
+            for column in TEMPLATES_TABLES.get(template, [])
+        ],
+    }
+
+
+def _copy_to_workdir(job: Job) -> tuple[str, list[str]]:
+    # docext resizes the images in place and writes the pdf pages next to the pdf,
+    # the job works on copies so the documents of the user are left untouched
+    from docext.core.utils import validate_file_paths
+
+    validate_file_paths(job.payload["file_paths"])
+    workdir = tempfile.mkdtemp(prefix=f"docext_job_{job.id}_")
+    copies = []
+    for i, file_path in enumerate(job.payload["file_paths"]):
+        copy = os.path.join(workdir, f"{i}_{os.path.basename(file_path)}")
+        shutil.copyfile(file_path, copy)
+        copies.append(copy)
+    return workdir, copies
+
+
+def _run_extract_job(
+    job: Job,
+    file_paths: list[str],
+    model_name: str,
+    max_img_size: int,
+    trace: Trace | None = None,
+):
+    from docext.core.extract import extract_information
+
+    if "template" in job.payload:
+        fields_and_tables = get_template_fields_and_tables(job.payload["template"])
+    else:
+        fields_and_tables = job.payload["fields_and_tables"]
+    fields_df, tables_df = extract_information(
+        file_paths,
+        job.payload.get("model_name", model_name),
+        job.payload.get("max_img_size", max_img_size),
+        fields_and_tables,
+        trace=trace,
+    )
+    return {
+        "fields": json.loads(fields_df.to_json(orient="records")),
+        "tables": json.loads(tables_df.to_json(orient="records")),
+    }
+
+
+def _run_pdf2md_job(
+    job: Job,
+    file_paths: list[str],
+    queue: JobQueue,
+    worker_id: str,
+    model_name: str,
+    max_img_size: int,
+    max_gen_tokens: int,
+    trace: Trace | None = None,
+):
+    from docext.core.pdf2md.pdf2md import convert_page_to_markdown
+    from docext.core.utils import convert_files_to_images
+    from docext.core.utils import resize_images
+
+    # the pages are rasterized in the work dir of every attempt, only the converted
+    # pages are kept in the progress
+    with stage("rasterize", trace):
+        image_paths = convert_files_to_images(file_paths)
+    with stage("resize", trace):
+        resize_images(image_paths, job.payload.get("max_img_size", max_img_size))
+    progress = {"pages": job.progress.get("pages", [])}
+
+    # resume from the first page that was not converted by a previous attempt
+    for i in range(len(progress["pages"]), len(image_paths)):
+        logger.info(f"Job {job.id}: converting page {i + 1} of {len(image_paths)}")
+        page_span = (
+            trace.add_child("page", page_number=i + 1) if trace is not None else None
+        )
+        page_content = convert_page_to_markdown(
+            image_paths[i],
+            job.payload.get("model_name", model_name),
+            job.payload.get("max_gen_tokens", max_gen_tokens),
+            span=page_span,
+        )
+        if page_span is not None:
+            page_span.end()
+        progress["pages"].append(page_content)
+        if not queue.save_progress(job.id, worker_id, progress):
+            raise RuntimeError(f"Lost the lease of job {job.id}")
+
+    return "".join(
+        f"Page {i + 1} of {len(image_paths)}\n" + page_content
+        for i, page_content in enumerate(progress["pages"])
+    )
+
+
+def _heartbeat(
+    queue: JobQueue,
+    job_id: int,
+    worker_id: str,
+    visibility_timeout: float,
+    stop: threading.Event,
+):
+    while not stop.wait(visibility_timeout / 3):
+        if not queue.heartbeat(job_id, worker_id, visibility_timeout):
+            logger.warning(f"Worker {worker_id} lost the lease of job {job_id}")
+            return
+
+
+def _save_result(output_dir: str, job: Job, result: Any):
+    os.makedirs(output_dir, exist_ok=True)
+    if job.kind == "pdf2md":
+        with open(os.path.join(output_dir, f"{job.id}.md"), "w") as f:
+            f.write(result)
+    else:
+        with open(os.path.join(output_dir, f"{job.id}.json"), "w") as f:
+            json.dump(result, f, ensure_ascii=False)
+
+
+def process_job(
+    job: Job,
+    queue: JobQueue,
+    worker_id: str,
+    model_name: str,
+    max_img_size: int,
+    max_gen_tokens: int,
+    visibility_timeout: float,
+    retry_delay: float,
+    output_dir: str | None = None,
+    exporter: JSONLSpanExporter | None = None,
+):
+    trace = (
+        Trace(
+            job.kind,
+            attributes={
+                "job_id": job.id,
+                "attempt": job.attempts,
+                "template": job.payload.get("template"),
+            },
+        )
+        if exporter is not None
+        else None
+    )
+    stop_heartbeat = threading.Event()
+    heartbeat_thread = threading.Thread(
+        target=_heartbeat,
+        args=(queue, job.id, worker_id, visibility_timeout, stop_heartbeat),
+        daemon=True,
+    )
+    heartbeat_thread.start()
+    workdir = None
+    try:
+        if job.kind not in JOB_KINDS:
+            raise ValueError(f"Job kind {job.kind} is not supported.")
+        workdir, file_paths = _copy_to_workdir(job)
+        if job.kind == "extract":
+            result = _run_extract_job(job, file_paths, model_name, max_img_size, trace)
+        else:
+            result = _run_pdf2md_job(
+                job,
+                file_paths,
+                queue,
+                worker_id,
+                model_name,
+                max_img_size,
+                max_gen_tokens,
+                trace,
+            )
+        if output_dir is not None:
+            _save_result(output_dir, job, result)
+        if queue.complete(job.id, worker_id, result):
+            logger.info(f"Worker {worker_id} completed job {job.id}")
+        else:
+            logger.warning(
+                f"Worker {worker_id} finished job {job.id} after losing its lease, result discarded"
+            )
+    except Exception as e:
+        logger.error(f"Worker {worker_id} failed job {job.id}: {e}")
+        queue.fail(
+            job.id,
+            worker_id,
+            traceback.format_exc(),
+            retry_delay=retry_delay * 2 ** (job.attempts - 1),
+        )
+    finally:
+        stop_heartbeat.set()
+        heartbeat_thread.join()
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+        if exporter is not None and trace is not None:
+            trace.end()
+            exporter.export(trace)
+
+
+def run_worker(
+    queue_path: str,
+    model_name: str,
+    max_img_size: int,
+    max_gen_tokens: int,
+    visibility_timeout: float = 600.0,
+    poll_interval: float = 2.0,
+    retry_delay: float = 30.0,
+    output_dir: str | None = None,
+    exit_when_empty: bool = False,
+    trace_path: str | None = None,
+):
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    queue = JobQueue(queue_path)
+    exporter = JSONLSpanExporter(trace_path) if trace_path is not None else None
+    logger.info(f"Worker {worker_id} polling {queue_path}")
+    while True:
+        job = queue.claim(worker_id, visibility_timeout)
+        if job is None:
+            stats = queue.stats()
+            if exit_when_empty and stats["queued"] == 0 and stats["running"] == 0:
+                logger.info(f"Worker {worker_id}: queue is empty, exiting")
+                return
+            time.sleep(poll_interval)
+            continue
+        logger.info(
+            f"Worker {worker_id} claimed job {job.id} ({job.kind}, attempt {job.attempts}/{job.max_attempts})"
+        )
+        process_job(
+            job,
+            queue,
+            worker_id,
+            model_name,
+            max_img_size,
+            max_gen_tokens,
+            visibility_timeout,
+            retry_delay,
+            output_dir,
+            exporter,
+        )
+
+
+def parse_worker_args(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        description="DocExt: process extraction and pdf2md jobs from a local queue",
+    )
+    parser.add_argument(
+        "--queue_path",
+        type=str,
+        default="docext_jobs.db",
+        help="Path to the SQLite job queue. Use a shared volume to run workers on multiple hosts.",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=1,
+        help="Number of worker processes to start.",
+    )
+    parser.add_argument(
+        "--model_name",
+        type=str,
+        default="hosted_vllm/Qwen/Qwen2.5-VL-3B-Instruct-AWQ",
+        help="Name of the model to use. Jobs can override it in their payload.",
+    )
+    parser.add_argument(
+        "--vlm_server_host",
+        type=str,
+        default="127.0.0.1",
+        help="Host for the vLLM/OLLAMA server",
+    )
+    parser.add_argument(
+        "--vlm_server_port",
+        type=int,
+        default=8000,
+        help="Port for the vLLM/OLLAMA server",
+    )
+    parser.add_argument(
+        "--max_img_size",
+        type=int,
+        default=2048,
+        help="Maximum size of the image to process.",
+    )
+    parser.add_argument(
+        "--max_gen_tokens",
+        type=int,
+        default=10000,
+        help="Maximum number of tokens to generate for pdf2md jobs.",
+    )
+    parser.add_argument(
+        "--visibility_timeout",
+        type=float,
+        default=600.0,
+        help="Seconds a claimed job stays invisible to other workers. Workers extend the lease while they are alive.",
+    )
+    parser.add_argument(
+        "--retry_delay",
+        type=float,
+        default=30.0,
+        help="Base delay in seconds before a failed job is retried. Doubles with every attempt.",
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default=None,
+        help="Optionally also write the results as `<job_id>.json` / `<job_id>.md` files.",
+    )
+    parser.add_argument(
+        "--exit_when_empty",
+        action="store_true",
+        help="Exit when there are no queued or running jobs left.",
+    )
+    parser.add_argument(
+        "--trace_path",
+        type=str,
+        default=None,
+        help="Append per-job timing traces (one span per line) to this JSONL file.",
+    )
+    return parser.parse_args(argv)
+
+
+def parse_enqueue_args(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        description="DocExt: add documents to the local job queue",
+    )
+    parser.add_argument("file_paths", nargs="+", help="Documents for this job")
+    parser.add_argument(
+        "--queue_path",
+        type=str,
+        default="docext_jobs.db",
+        help="Path to the SQLite job queue.",
+    )
+    parser.add_argument("--kind", type=str, default="extract", choices=JOB_KINDS)
+    parser.add_argument(
+        "--template",
+        type=str,
+        default=None,
+        help="Template name from docext.core.config. Required for extract jobs.",
+    )
+    parser.add_argument("--max_attempts", type=int, default=3)
+    parser.add_argument(
+        "--one_job_per_file",
+        action="store_true",
+        help="Create a job for each file instead of one job for all files.",
+    )
+    return parser.parse_args(argv)
+
+
+def docext_worker(argv: list[str] | None = None):
+    args = parse_worker_args(argv)
+    logger.info(f"Config:\n{args}")
+
+    # set vlm_model_url env variable, same as the gradio app
+    hosted_model_url = f"http://{args.vlm_server_host}:{args.vlm_server_port}"
+    os.environ["VLM_MODEL_URL"] = (
+        f"{hosted_model_url}/v1"
+        if args.model_name.startswith("hosted_vllm/")
+        else hosted_model_url
+    )
+
+    worker_kwargs = dict(
+        queue_path=args.queue_path,
+        model_name=args.model_name,
+        max_img_size=args.max_img_size,
+        max_gen_tokens=args.max_gen_tokens,
+        visibility_timeout=args.visibility_timeout,
+        retry_delay=args.retry_delay,
+        output_dir=args.output_dir,
+        exit_when_empty=args.exit_when_empty,
+        trace_path=args.trace_path,
+    )
+    if args.num_workers == 1:
+        run_worker(**worker_kwargs)
+        return
+
+    processes = [
+        multiprocessing.Process(target=run_worker, kwargs=worker_kwargs)
+        for _ in range(args.num_workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # leases of the interrupted jobs expire and other workers pick them up
+        for process in processes:
+            process.terminate()
+
+
+def docext_enqueue(argv: list[str] | None = None):
+    args = parse_enqueue_args(argv)
+    if args.kind == "extract":
+        assert args.template is not None, "--template is required for extract jobs"
+        # fail early for unknown templates
+        get_template_fields_and_tables(args.template)
+
+    queue = JobQueue(args.queue_path)
+    file_groups = (
+        [[file_path] for file_path in args.file_paths]
+        if args.one_job_per_file
+        else [args.file_paths]
+    )
+    for file_paths in file_groups:
+        payload: dict[str, Any] = {
+            "file_paths": [os.path.abspath(f) for f in file_paths]
+        }
+        if args.template is not None:
+            payload["template"] = args.template
+        job_id = queue.enqueue(args.kind, payload, max_attempts=args.max_attempts)
+        logger.info(f"Enqueued job {job_id} ({args.kind}): {file_paths}")
+    logger.info(f"Queue stats: {queue.stats()}")
+
+
+if __name__ == "__main__":
+    docext_worker()
@@ -0,0 +1,2 @@
+# Empty file to make docext.testing a Python package
+from __future__ import annotations
@@ -0,0 +1,637 @@
+"""
+Deterministic OpenAI-compatible stub of a VLM server, for load testing and CI
+benchmarks on CPU-only machines.
+
+It serves `/v1/chat/completions` (with SSE streaming, logprobs and `n`),
+`/v1/models` and `/health`, and answers with canned outputs for the prompts used
+by docext:
+    - fields extraction / confidence scores / KIE: a JSON object with the requested keys
+    - tables extraction: a markdown table with the requested columns
+    - TABLE benchmark: a JSON list of rows with the requested columns
+    - pdf2md: a markdown page with a heading, paragraphs and an html table
+    - classification: one of the requested labels
+    - anything else: a short sentence
+
+Outputs only depend on the request body and `--seed`, so repeated runs produce the
+same responses. Latency is simulated with a time to first token and a decode
+speed, and `--max_num_seqs` limits the number of requests decoded at the same
+time, like the batch size of a real server.
+
+    python -m docext.testing.stub_vlm --port 8000 --ttft 0.3 --tokens_per_second 60
+
+    # then point docext at it
+    docext --vlm_server_port 8000 --model_name hosted_vllm/stub
+"""
+from __future__ import annotations
+
+import argparse
+import ast
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import asdict
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Any
+
+from loguru import logger
+
+PDF2MD_MARKER = "as if you were reading it naturally"
+TABLE_MARKER = "table in markdown format with exactly these columns"
+CLASSIFICATION_MARKER = "into one of the following categories"
+CONFIDENCE_MARKER = "confidence score"
+
+WORDS = [
+    "invoice",
+    "total",
+    "amount",
+    "date",
+    "payment",
+    "account",
+    "customer",
+    "order",
+    "number",
+    "address",
+    "tax",
+    "balance",
+    "due",
+    "item",
+    "quantity",
+    "price",
+    "description",
+    "reference",
+    "company",
+    "service",
+]
+
+# roughly 4 characters per token, like the BPE tokenizers of most VLMs
+TOKEN_PATTERN = re.compile(r"\s*[^\s]{1,4}|\s+")
+
+
+@dataclass
+class StubVLMConfig:
+    model_name: str = "stub"
+    ttft: float = 0.2
+    ttft_per_image: float = 0.0
+    tokens_per_second: float = 50.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 1.0
+    max_num_seqs: int = 0
+    image_tokens: int = 1000
+    table_rows: int = 5
+    seed: int = 0
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text)
+
+
+def _text_content(message: dict) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, str):
+        return content
+    return "\n".join(
+        part.get("text", "") for part in content if part.get("type") == "text"
+    )
+
+
+def _num_images(messages: list[dict]) -> int:
+    return sum(
+        1
+        for message in messages
+        if isinstance(message.get("content"), list)
+        for part in message["content"]
+        if part.get("type") == "image_url"
+    )
+
+
+def _find_literal(text: str, opening: str):
+    """
+    Return the last python/JSON literal in `text` starting with `opening`, eg: the
+    `{'field': '...'}` output format at the end of the prompts.
+    """
+    closing = {"{": "}", "[": "]"}[opening]
+    for start in reversed([m.start() for m in re.finditer(re.escape(opening), text)]):
+        depth = 0
+        for end in range(start, len(text)):
+            if text[end] in "{[":
+                depth += 1
+            elif text[end] in "}]":
+                depth -= 1
+                if depth == 0:
+                    break
+        if depth != 0 or text[end] != closing:
+            continue
+        try:
+            return ast.literal_eval(text[start : end + 1])
+        except (ValueError, SyntaxError):
+            continue
+    return None
+
+
+def _value(rng: random.Random):
+    if rng.random() < 0.4:
+        return f"{rng.randint(1, 9999)}.{rng.randint(0, 99):02d}"
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 3)))
+
+
+def _markdown_table(columns: list[str], rows: list[list[str]]):
+    lines = [
+        "| " + " | ".join(columns) + " |",
+        "|" + "|".join("---" for _ in columns) + "|",
+    ]
+    lines.extend("| " + " | ".join(row) + " |" for row in rows)
+    return "\n".join(lines)
+
+
+def _pdf2md_page(rng: random.Random, table_rows: int):
+    paragraphs = [
+        " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 40))).capitalize()
+        + "."
+        for _ in range(3)
+    ]
+    header = "".join(f"<th>{rng.choice(WORDS)}</th>" for _ in range(3))
+    body = "".join(
+        "<tr>" + "".join(f"<td>{_value(rng)}</td>" for _ in range(3)) + "</tr>"
+        for _ in range(table_rows)
+    )
+    return (
+        f"# {rng.choice(WORDS).capitalize()} {rng.randint(1, 99)}\n\n"
+        + "\n\n".join(paragraphs)
+        + f"\n\n<table><tr>{header}</tr>{body}</table>\n\n"
+        + f"<page_number>{rng.randint(1, 20)}</page_number>"
+    )
+
+
+def canned_output(messages: list[dict], rng: random.Random, table_rows: int = 5):
+    """
+    Build a plausible answer for the last user message.
+    """
+    prompt = _text_content(messages[-1]) if messages else ""
+    system_prompt = " ".join(
+        _text_content(m) for m in messages if m.get("role") == "system"
+    )
+
+    if PDF2MD_MARKER in prompt:
+        return _pdf2md_page(rng, table_rows)
+
+    if TABLE_MARKER in prompt:
+        header = prompt.split(TABLE_MARKER, 1)[1].strip(":\n ").split("\n")[0]
+        columns = [column.strip() for column in header.strip("|").split("|")]
+        rows = [[_value(rng) for _ in columns] for _ in range(table_rows)]
+        return _markdown_table(columns, rows)
+
+    if CLASSIFICATION_MARKER in prompt or CLASSIFICATION_MARKER in system_prompt:
+        labels = _find_literal(prompt, "[") or _find_literal(system_prompt, "[")
+        if labels:
+            return str(rng.choice(labels))
+
+    output_format = _find_literal(prompt, "{")
+    rows_format = _find_literal(prompt, "[")
+    if (
+        isinstance(rows_format, list)
+        and rows_format
+        and isinstance(rows_format[0], dict)
+    ):
+        columns = list(rows_format[0].keys())
+        records = [
+            {column: _value(rng) for column in columns} for _ in range(table_rows)
+        ]
+        return json.dumps(records)
+    if isinstance(output_format, dict):
+        if CONFIDENCE_MARKER in prompt:
+            return json.dumps({key: rng.randint(50, 100) for key in output_format})
+        return json.dumps({key: _value(rng) for key in output_format})
+
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 15))) + "."
+
+
+class StubVLM:
+    """
+    Request handling of the stub, independent of the HTTP server.
+    """
+
+    def __init__(self, config: StubVLMConfig):
+        self.config = config
+        self._error_rng = random.Random(config.seed)
+        self._error_lock = threading.Lock()
+        self._slots = (
+            threading.BoundedSemaphore(config.max_num_seqs)
+            if config.max_num_seqs > 0
+            else None
+        )
+
+    def request_rng(self, body: dict[str, Any], index: int = 0):
+        key = json.dumps(
+            [body.get("messages"), body.get("model"), index, self.config.seed],
+            sort_keys=True,
+            default=str,
+        )
+        return random.Random(hashlib.sha256(key.encode()).hexdigest())
+
+    def sample_error(self):
+        """
+        Return an injected `(status, message)` or None. Errors are drawn from their
+        own seeded sequence, so retries of the same request can succeed.
+        """
+        with self._error_lock:
+            draw = self._error_rng.random()
+        if draw < self.config.rate_limit_rate:
+            return 429, "Rate limit exceeded (injected by the stub)"
+        if draw < self.config.rate_limit_rate + self.config.error_rate:
+            return 500, "Internal server error (injected by the stub)"
+        return None
+
+    def usage(self, messages: list[dict], completion_tokens: int):
+        prompt_tokens = (
+            sum(len(tokenize(_text_content(m))) for m in messages)
+            + _num_images(messages) * self.config.image_tokens
+        )
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def completions(self, body: dict[str, Any]):
+        messages = body.get("messages") or []
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens")
+        choices = []
+        for index in range(body.get("n") or 1):
+            rng = self.request_rng(body, index)
+            tokens = tokenize(canned_output(messages, rng, self.config.table_rows))
+            finish_reason = "stop"
+            if max_tokens is not None and len(tokens) > max_tokens:
+                tokens = tokens[:max_tokens]
+                finish_reason = "length"
+            choices.append((tokens, finish_reason, rng))
+        return choices
+
+    def ttft(self, messages: list[dict]):
+        return self.config.ttft + self.config.ttft_per_image * _num_images(messages)
+
+    def logprobs(self, tokens: list[str], rng: random.Random, top_logprobs: int = 0):
+        content = []
+        for token in tokens:
+            logprob = -rng.random() * 0.2
+            content.append(
+                {
+                    "token": token,
+                    "logprob": logprob,
+                    "bytes": list(token.encode()),
+                    "top_logprobs": [
+                        {
+                            "token": token,
+                            "logprob": logprob,
+                            "bytes": list(token.encode()),
+                        }
+                    ]
+                    + [
+                        {
+                            "token": rng.choice(WORDS),
+                            "logprob": logprob - 2 - rng.random() * 5,
+                            "bytes": None,
+                        }
+                        for _ in range(max(top_logprobs - 1, 0))
+                    ]
+                    if top_logprobs
+                    else [],
+                }
+            )
+        return {"content": content}
+
+    def acquire_slot(self):
+        if self._slots is not None:
+            self._slots.acquire()
+
+    def release_slot(self):
+        if self._slots is not None:
+            self._slots.release()
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stub: StubVLM
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers: dict | None = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif path == "/v1/models":
+            self._send_json(
+                200,
+                {
+                    "object": "list",
+                    "data": [
+                        {
+                            "id": self.stub.config.model_name,
+                            "object": "model",
+                            "owned_by": "docext",
+                        }
+                    ],
+                },
+            )
+        else:
+            self._send_json(404, {"error": {"message": f"{path} not found"}})
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError as e:
+            self._send_json(400, {"error": {"message": f"Invalid JSON: {e}"}})
+            return
+        if path != "/v1/chat/completions":
+            self._send_json(404, {"error": {"message": f"{path} not found"}})
+            return
+
+        error = self.stub.sample_error()
+        if error is not None:
+            status, message = error
+            headers = (
+                {"Retry-After": str(self.stub.config.retry_after)}
+                if status == 429
+                else {}
+            )
+            self._send_json(
+                status,
+                {"error": {"message": message, "type": "stub_error", "code": status}},
+                headers,
+            )
+            return
+
+        # the latency starts once the request is scheduled, like in a real server
+        self.stub.acquire_slot()
+        start = time.perf_counter()
+        try:
+            if body.get("stream"):
+                self._stream(body, start)
+            else:
+                self._complete(body, start)
+        finally:
+            self.stub.release_slot()
+
+    def _decode_delay(self, num_tokens: int):
+        return num_tokens / self.stub.config.tokens_per_second
+
+    def _complete(self, body: dict, start: float):
+        messages = body.get("messages") or []
+        choices = self.stub.completions(body)
+        completion_tokens = sum(len(tokens) for tokens, _, _ in choices)
+        delay = self.stub.ttft(messages) + self._decode_delay(
+            max(len(tokens) for tokens, _, _ in choices)
+        )
+        time.sleep(max(start + delay - time.perf_counter(), 0.0))
+        self._send_json(
+            200,
+            {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", self.stub.config.model_name),
+                "choices": [
+                    {
+                        "index": index,
+                        "message": {"role": "assistant", "content": "".join(tokens)},
+                        "logprobs": self.stub.logprobs(
+                            tokens, rng, body.get("top_logprobs") or 0
+                        )
+                        if body.get("logprobs")
+                        else None,
+                        "finish_reason": finish_reason,
+                    }
+                    for index, (tokens, finish_reason, rng) in enumerate(choices)
+                ],
+                "usage": self.stub.usage(messages, completion_tokens),
+            },
+        )
+
+    def _send_event(self, payload: dict | str):
+        data = payload if isinstance(payload, str) else json.dumps(payload)
+        chunk = f"data: {data}\n\n".encode()
+        self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, body: dict, start: float):
+        messages = body.get("messages") or []
+        choices = self.stub.completions(body)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = body.get("model", self.stub.config.model_name)
+
+        def chunk(choices_payload: list[dict], usage: dict | None = None):
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": choices_payload,
+            }
+            if usage is not None:
+                payload["usage"] = usage
+            return payload
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        ttft = self.stub.ttft(messages)
+        time.sleep(max(start + ttft - time.perf_counter(), 0.0))
+        self._send_event(
+            chunk(
+                [
+                    {
+                        "index": index,
+                        "delta": {"role": "assistant", "content": ""},
+                        "finish_reason": None,
+                    }
+                    for index in range(len(choices))
+                ]
+            )
+        )
+        # pace the tokens on an absolute schedule, so the decode speed does not drift
+        # with the time spent writing the events
+        decode_start = start + ttft
+        for position in range(max(len(tokens) for tokens, _, _ in choices)):
+            time.sleep(
+                max(
+                    decode_start
+                    + self._decode_delay(position + 1)
+                    - time.perf_counter(),
+                    0.0,
+                )
+            )
+            deltas = []
+            for index, (tokens, _, rng) in enumerate(choices):
+                if position >= len(tokens):
+                    continue
+                delta = {
+                    "index": index,
+                    "delta": {"content": tokens[position]},
+                    "finish_reason": None,
+                }
+                if body.get("logprobs"):
+                    delta["logprobs"] = self.stub.logprobs(
+                        [tokens[position]], rng, body.get("top_logprobs") or 0
+                    )
+                deltas.append(delta)
+            self._send_event(chunk(deltas))
+        self._send_event(
+            chunk(
+                [
+                    {"index": index, "delta": {}, "finish_reason": finish_reason}
+                    for index, (_, finish_reason, _) in enumerate(choices)
+                ]
+            )
+        )
+        if (body.get("stream_options") or {}).get("include_usage"):
+            completion_tokens = sum(len(tokens) for tokens, _, _ in choices)
+            self._send_event(chunk([], self.stub.usage(messages, completion_tokens)))
+        self._send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class StubVLMServer:
+    """
+    Run the stub in a background thread, eg: in a benchmark script
+
+        with StubVLMServer(StubVLMConfig(ttft=0.1), port=8001) as server:
+            os.environ["VLM_MODEL_URL"] = server.url
+            ...
+    """
+
+    def __init__(
+        self,
+        config: StubVLMConfig | None = None,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+    ):
+        self.config = config or StubVLMConfig()
+        handler = type("StubHandler", (_StubHandler,), {"stub": StubVLM(self.config)})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"Stub VLM server listening on {self.url} with {self.config}")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def parse_args(argv: list[str] | None = None):
+    defaults = StubVLMConfig()
+    parser = argparse.ArgumentParser(
+        description="DocExt: deterministic OpenAI-compatible VLM stub server",
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--model_name",
+        type=str,
+        default=defaults.model_name,
+        help="Model name listed on /v1/models. Requests for any model are accepted.",
+    )
+    parser.add_argument(
+        "--ttft",
+        type=float,
+        default=defaults.ttft,
+        help="Time to first token in seconds.",
+    )
+    parser.add_argument(
+        "--ttft_per_image",
+        type=float,
+        default=defaults.ttft_per_image,
+        help="Extra time to first token per image in the request (simulated prefill).",
+    )
+    parser.add_argument(
+        "--tokens_per_second", type=float, default=defaults.tokens_per_second
+    )
+    parser.add_argument(
+        "--error_rate",
+        type=float,
+        default=defaults.error_rate,
+        help="Fraction of requests answered with a 500 error.",
+    )
+    parser.add_argument(
+        "--rate_limit_rate",
+        type=float,
+        default=defaults.rate_limit_rate,
+        help="Fraction of requests answered with a 429 error and a Retry-After header.",
+    )
+    parser.add_argument("--retry_after", type=float, default=defaults.retry_after)
+    parser.add_argument(
+        "--max_num_seqs",
+        type=int,
+        default=defaults.max_num_seqs,
+        help="Maximum number of requests processed at the same time, others wait. 0 means unlimited.",
+    )
+    parser.add_argument(
+        "--image_tokens",
+        type=int,
+        default=defaults.image_tokens,
+        help="Prompt tokens reported per image.",
+    )
+    parser.add_argument("--table_rows", type=int, default=defaults.table_rows)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None):
+    args = parse_args(argv)
+    config = StubVLMConfig(
+        **{
+            key: value
+            for key, value in vars(args).items()
+            if key in asdict(StubVLMConfig())
+        }
+    )
+    server = StubVLMServer(config, host=args.host, port=args.port).start()
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
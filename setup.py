@@ -27,7 +27,8 @@ setup(
         "https://github.com/huggingface/transformers/tarball/49b5ab6a27511de5168c72e83318164f1b4adc43#egg=transformers",
     ],
     extras_require={
-        "dev": ["pre-commit"],
+        "dev": ["pre-commit", "pytest"],
+        "benchmark": ["rapidfuzz>=3.6"],
     },
     entry_points={
         "console_scripts": [
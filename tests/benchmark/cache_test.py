@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+
+from docext.benchmark.cache import SQLitePredictionCache
+
+
+def test_sqlite_cache_connections_stay_bounded(tmp_path):
+    cache = SQLitePredictionCache(str(tmp_path / "prediction_cache.db"), pool_size=4)
+
+    def process(pair_item):
+        pair, item = pair_item
+        key = f"{pair:04d}{item:04d}"
+        assert cache.get("hosted_vllm/model", key) is None
+        cache.set("hosted_vllm/model", key, {"pair": pair, "item": item})
+        return cache.get("hosted_vllm/model", key)
+
+    # a new executor per (dataset, model) pair, as in `_collect_responses`
+    for pair in range(100):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(
+                executor.map(process, [(pair, item) for item in range(16)])
+            )
+        assert responses == [{"pair": pair, "item": item} for item in range(16)]
+        assert cache.num_connections <= 4
+
+    assert len(cache) == 100 * 16
+    assert len(cache.get_many("hosted_vllm/model", ["00000000", "00990015"])) == 2
+    cache.close()
+    assert cache.num_connections == 0
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import time
+
+import pandas as pd
+import pytest
+import requests
+
+from docext.benchmark.concurrency import find_saturation
+from docext.benchmark.concurrency import run_level
+from docext.benchmark.concurrency import summarize_level
+from docext.testing.stub_vlm import StubVLMConfig
+from docext.testing.stub_vlm import StubVLMServer
+
+
+# the client overhead of each request is not limited by the server slots, it keeps
+# the throughput growing slowly past max_num_seqs
+@pytest.mark.parametrize("client_overhead", [0.0, 0.05])
+def test_saturation_at_max_num_seqs(client_overhead):
+    config = StubVLMConfig(ttft=0.15, tokens_per_second=1e9, max_num_seqs=4)
+    payloads = [
+        [{"role": "user", "content": f"describe document {i}"}] for i in range(16)
+    ]
+    with StubVLMServer(config, port=0) as server:
+
+        def send(messages):
+            time.sleep(client_overhead)
+            response = requests.post(
+                f"{server.url}/chat/completions",
+                json={"model": "stub", "messages": messages},
+                timeout=30,
+            )
+            response.raise_for_status()
+            return response.json()
+
+        rows = []
+        for concurrency in [1, 2, 4, 8, 16]:
+            records, wall_time = run_level(send, payloads, concurrency)
+            rows.append(summarize_level("stub", concurrency, records, wall_time))
+
+    df = pd.DataFrame(rows)
+    assert (df["errors"] == 0).all()
+    # the throughput grows with the concurrency up to the 4 slots, then flattens
+    throughput = df.set_index("concurrency")["throughput_requests_per_s"]
+    assert throughput[2] > 1.8 * throughput[1]
+    assert throughput[4] > 1.8 * throughput[2]
+    assert throughput[16] < 1.5 * throughput[4]
+    assert find_saturation(df)["saturation_concurrency"] == 4
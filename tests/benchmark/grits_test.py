@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from docext.benchmark.metrics.grits import cells_to_grid
+from docext.benchmark.metrics.grits import df_to_cells
+from docext.benchmark.metrics.grits import grits_con
+from docext.benchmark.metrics.grits import grits_con_fast
+from docext.benchmark.metrics.grits import grits_from_df
+from docext.benchmark.metrics.grits import html_to_cells
+
+WORDS = ["", "0", "1.5", "total", "tax", "N/A", "12,000.00", "Invoice #42"]
+LONG_WORDS = ["lorem ipsum dolor sit amet " * 20, "x" * 500, "Total amount due " * 30]
+
+
+def random_grid(rng, num_rows, num_columns, words=WORDS):
+    grid = np.empty((num_rows, num_columns), dtype=object)
+    grid[...] = rng.choice(words, size=(num_rows, num_columns))
+    return grid
+
+
+def random_df(rng, num_rows, num_columns):
+    return pd.DataFrame(rng.choice(WORDS, size=(num_rows, num_columns)))
+
+
+@pytest.mark.parametrize(
+    "true_shape,pred_shape",
+    [
+        ((0, 0), (0, 0)),
+        ((0, 3), (2, 3)),
+        ((3, 2), (0, 0)),
+        ((1, 1), (1, 1)),
+        ((1, 7), (1, 5)),
+        ((6, 1), (1, 6)),
+        ((4, 3), (4, 3)),
+    ],
+)
+def test_grits_con_fast_shapes(true_shape, pred_shape):
+    rng = np.random.default_rng(0)
+    for _ in range(10):
+        true_grid = random_grid(rng, *true_shape)
+        pred_grid = random_grid(rng, *pred_shape)
+        assert grits_con_fast(true_grid, pred_grid) == grits_con(true_grid, pred_grid)
+
+
+def test_grits_con_fast_random_grids():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        true_grid = random_grid(rng, rng.integers(0, 10), rng.integers(0, 6))
+        if rng.random() < 0.2:
+            pred_grid = true_grid.copy()
+        else:
+            pred_grid = random_grid(rng, rng.integers(0, 10), rng.integers(0, 6))
+        assert grits_con_fast(true_grid, pred_grid) == grits_con(true_grid, pred_grid)
+
+
+def test_grits_con_fast_long_strings():
+    rng = np.random.default_rng(0)
+    words = WORDS + LONG_WORDS
+    for _ in range(20):
+        true_grid = random_grid(rng, rng.integers(1, 5), rng.integers(1, 4), words)
+        pred_grid = random_grid(rng, rng.integers(1, 5), rng.integers(1, 4), words)
+        assert grits_con_fast(true_grid, pred_grid) == grits_con(true_grid, pred_grid)
+
+
+def test_grits_from_df_matches_reference():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        true_df = random_df(rng, rng.integers(0, 12), rng.integers(0, 6))
+        pred_df = random_df(rng, rng.integers(0, 12), rng.integers(0, 6))
+        assert grits_from_df(true_df, pred_df) == grits_from_df(
+            true_df, pred_df, reference=True
+        )
+
+
+@pytest.mark.parametrize(
+    "df",
+    [
+        pd.DataFrame(),
+        pd.DataFrame(columns=["a", "b"]),
+        pd.DataFrame(index=[0, 1]),
+        pd.DataFrame({"a": [1.5, None, float("nan")], "b": ["<td>", "a & b", " x "]}),
+        pd.DataFrame({"a": ["line\r\nbreak", "tab\tx", "\x01"]}),
+        pd.DataFrame(
+            {"a": [1, 2, 3], "b": [4, 5, 6]},
+            index=pd.MultiIndex.from_tuples(
+                [("a", 1), ("a", 2), ("b", 1)], names=["x", "y"]
+            ),
+        ),
+        pd.DataFrame(
+            [[1, 2, 3]],
+            columns=pd.MultiIndex.from_tuples([("a", 1), ("a", 2), ("b", 1)]),
+        ),
+        pd.DataFrame({"a": [1, 2]}, index=pd.Index(["r1", "r2"], name="rows")),
+        pd.DataFrame({"a": [[1, 2], {"k": "v"}], "b": [True, None]}),
+    ],
+)
+def test_df_to_cells_matches_html(df):
+    cells = df_to_cells(df)
+    if cells is None:
+        pytest.skip("layout not supported by df_to_cells")
+    html_cells = html_to_cells(df.to_html())
+    assert cells_to_grid(cells, key="cell_text") == cells_to_grid(
+        html_cells, key="cell_text"
+    )
+
+
+def test_grits_banded_bounds():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        true_df = random_df(rng, rng.integers(1, 30), rng.integers(1, 6))
+        pred_df = random_df(rng, rng.integers(1, 30), rng.integers(1, 6))
+        exact_score = grits_from_df(true_df, pred_df)
+        assert grits_from_df(true_df, pred_df, band_width=100) == exact_score
+        banded_score, upper_bound = grits_from_df(
+            true_df, pred_df, band_width=2, return_upper_bound=True
+        )
+        assert banded_score <= upper_bound + 1e-12
+        assert exact_score <= upper_bound + 1e-12
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from docext.core.metrics import GRADIO_QUEUE_DEPTH
+from docext.core.metrics import queued
+
+
+def queue_depth():
+    return GRADIO_QUEUE_DEPTH.labels().get()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_queued_counts_the_waiting_calls():
+    release = threading.Event()
+    running = []
+
+    def extract_information(index):
+        running.append(index)
+        release.wait(5)
+        return index
+
+    # the API calls the wrapped handler directly, without any UI event
+    handler = queued(extract_information, concurrency_limit=2)
+    assert handler.__name__ == "extract_information"
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [executor.submit(handler, index) for index in range(5)]
+        wait_for(lambda: len(running) == 2 and queue_depth() == 3)
+        release.set()
+        assert [future.result() for future in futures] == list(range(5))
+    assert queue_depth() == 0
+
+
+def test_queued_generator_and_errors():
+    def process_markdown_streaming(pages):
+        for page in range(pages):
+            yield f"page {page}"
+        raise RuntimeError("failed")
+
+    handler = queued(process_markdown_streaming, concurrency_limit=1)
+    with pytest.raises(RuntimeError):
+        list(handler(2))
+    assert queue_depth() == 0
+
+    # a stream closed by the client releases its slot
+    stream = handler(3)
+    assert next(stream) == "page 0"
+    stream.close()
+    stream = handler(1)
+    assert next(stream) == "page 0"
+    stream.close()
+    assert queue_depth() == 0
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from docext.testing.stub_vlm import StubVLMConfig
+from docext.testing.stub_vlm import StubVLMServer
+
+
+@pytest.mark.parametrize("stream", [False, True])
+@pytest.mark.parametrize("max_num_seqs,num_requests", [(2, 8), (3, 7), (0, 6)])
+def test_max_num_seqs_limits_throughput(stream, max_num_seqs, num_requests):
+    latency = 0.3
+    config = StubVLMConfig(
+        ttft=latency, tokens_per_second=1e9, max_num_seqs=max_num_seqs
+    )
+    body = {
+        "model": "stub",
+        "messages": [{"role": "user", "content": "hello"}],
+        "stream": stream,
+    }
+    with StubVLMServer(config, port=0) as server:
+
+        def send(_):
+            response = requests.post(
+                f"{server.url}/chat/completions", json=body, timeout=30
+            )
+            response.raise_for_status()
+            return response.content
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=num_requests) as executor:
+            list(executor.map(send, range(num_requests)))
+        elapsed = time.perf_counter() - start
+
+    waves = math.ceil(num_requests / max_num_seqs) if max_num_seqs else 1
+    assert waves * latency <= elapsed < waves * latency + 0.25